@@ -26,9 +26,11 @@ import json
 import time
 import argparse as ap
 import logging
+from collections import OrderedDict
+from contextlib import contextmanager
 
 import pytz
-from numpy import array
+from numpy import array, empty
 
 from hydra_client.plugin import JsonConnection
 from hydra_client.output import write_progress, \
@@ -43,6 +45,81 @@ log = logging.getLogger(__name__)
 __location__ = os.path.split(sys.argv[0])[0]
 
 
+def import_shared(name):
+    """
+        Import a module shared with ImportCSV: the fake server for
+        --fake-server or the profiler for --profile. These are only imported
+        when they are asked for, so ExportCSV does not otherwise need
+        ImportCSV to be installed beside it.
+    """
+    try:
+        return __import__(name)
+    except ImportError:
+        sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ImportCSV'))
+        return __import__(name)
+
+class NullStage(object):
+    def count(self, kind, num=1):
+        pass
+
+class NullProfiler(object):
+    """
+        Stands in for the profiler when --profile is not used.
+        Stages are marked but nothing is recorded.
+    """
+    enabled = False
+
+    @contextmanager
+    def stage(self, name, filename=None, counter=None):
+        yield NullStage()
+
+
+class FileWriterPool(object):
+    """
+        Keeps the array and timeseries files of a scenario open while the
+        scenario is exported, rather than opening and closing a file for
+        every value written to it. At most max_open files are open at once.
+        When there are more, the file used least recently is closed, and
+        opened again for appending if it is written to later.
+    """
+    def __init__(self, target_dir, max_open=64):
+        self.target_dir = target_dir
+        self.max_open   = max(1, max_open)
+        #Open files by name, the least recently used first
+        self.files      = OrderedDict()
+        #Files opened before, which are appended to if opened again
+        self.opened     = set()
+
+    def open(self, file_name):
+        """
+            Returns the open file with the given name in the target
+            directory, and whether it has just been created, in which
+            case the caller writes its header.
+        """
+        f = self.files.pop(file_name, None)
+        created = False
+        if f is None:
+            file_loc = os.path.join(self.target_dir, file_name)
+            if file_name in self.opened or os.path.exists(file_loc):
+                f = open(file_loc, 'a')
+            else:
+                f = open(file_loc, 'w')
+                created = True
+            self.opened.add(file_name)
+
+            if len(self.files) >= self.max_open:
+                oldest_name, oldest = self.files.popitem(last=False)
+                oldest.close()
+
+        self.files[file_name] = f
+        return f, created
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+        self.files.clear()
+
+
 class ExportCSV(object):
     """
     """
@@ -51,18 +128,29 @@ class ExportCSV(object):
     Scenario = None
     timezone = pytz.utc
 
-    def __init__(self, url=None, session_id=None):
+    def __init__(self, url=None, session_id=None, connection=None):
 
         self.errors = []
         self.warnings = []
         self.files    = []
 
-        self.connection = JsonConnection(url)
-        if session_id is not None:
-            log.info("Using existing session %s", session_id)
-            self.connection.session_id=session_id
-        else:
+        #The most array and timeseries files kept open at once
+        self.max_open_files = 64
+
+        #Times the stages of the export if --profile is used
+        self.profiler = NullProfiler()
+
+        if connection is not None:
+            #Any object with the same calls as a JsonConnection
+            self.connection = connection
             self.connection.login()
+        else:
+            self.connection = JsonConnection(url)
+            if session_id is not None:
+                log.info("Using existing session %s", session_id)
+                self.connection.session_id=session_id
+            else:
+                self.connection.login()
 
         all_attributes = self.call('get_all_attributes')
         self.attributes = {}
@@ -95,7 +183,8 @@ class ExportCSV(object):
             try:
                 network_id = int(network_id)
                 x = time.time()
-                network = self.call('get_network', {'network_id':network_id})
+                with self.profiler.stage('get_network'):
+                    network = self.call('get_network', {'network_id':network_id})
                 log.info("Network retrieved in %s", time.time()-x)
             except:
                 raise HydraPluginError("Network %s not found."%network_id)
@@ -157,8 +246,36 @@ class ExportCSV(object):
         if not os.path.exists(scenario.target_dir):
             os.mkdir(scenario.target_dir)
 
-        network_file = open(os.path.join(scenario.target_dir, "network.csv"), 'w')
+        #Index the data in the scenario by resource attribute, so that the
+        #value of each one is found without searching the whole scenario.
+        scenario.rs_index = {}
+        for rs in scenario.resourcescenarios or []:
+            if rs.resource_attr_id not in scenario.rs_index:
+                scenario.rs_index[rs.resource_attr_id] = rs
+
+        scenario.attr_units = self.get_attr_units(scenario)
+
+        #The array and timeseries files are kept open until
+        #the whole scenario has been exported.
+        scenario.writers = FileWriterPool(scenario.target_dir, self.max_open_files)
+        try:
+            network_file = open(os.path.join(scenario.target_dir, "network.csv"), 'w')
+            try:
+                self.write_network(network, scenario, network_file)
+            finally:
+                network_file.close()
+        finally:
+            scenario.writers.close()
+
+        log.info("Network export complete")
+
+        log.info("networks written to file: %s", network_file.name)
 
+    def write_network(self, network, scenario, network_file):
+        """
+            Export the nodes, links, groups and rules of a scenario and
+            write the network file.
+        """
         network_attributes = self.get_resource_attributes([network])
 
         network_attributes_string = ""
@@ -209,7 +326,9 @@ class ExportCSV(object):
         write_progress(4, self.num_steps)
         node_map = dict()
         if network.nodes:
-            node_map = self.export_nodes(scenario, network.nodes)
+            with self.profiler.stage('export_nodes', scenario.name) as stage:
+                node_map = self.export_nodes(scenario, network.nodes)
+                stage.count('nodes', len(network.nodes))
             network_data['nodes'] = "nodes.csv"
         else:
             log.warning("Network has no nodes!")
@@ -217,7 +336,9 @@ class ExportCSV(object):
         write_progress(5, self.num_steps)
         link_map = dict()
         if network.links:
-            link_map = self.export_links(scenario, network.links, node_map)
+            with self.profiler.stage('export_links', scenario.name) as stage:
+                link_map = self.export_links(scenario, network.links, node_map)
+                stage.count('links', len(network.links))
             network_data['links'] = "links.csv"
         else:
             log.warning("Network has no links!")
@@ -225,13 +346,17 @@ class ExportCSV(object):
         write_progress(6, self.num_steps)
         group_map = dict()
         if network.resourcegroups:
-            group_map = self.export_resourcegroups(scenario, network.resourcegroups, node_map, link_map)
+            with self.profiler.stage('export_groups', scenario.name) as stage:
+                group_map = self.export_resourcegroups(scenario, network.resourcegroups, node_map, link_map)
+                stage.count('groups', len(network.resourcegroups))
             network_data['groups'] = "groups.csv"
         else:
             log.warning("Network has no resourcegroups.")
 
         write_progress(7, self.num_steps)
-        rules = self.export_rules(scenario, node_map, link_map, group_map)
+        with self.profiler.stage('export_rules', scenario.name) as stage:
+            rules = self.export_rules(scenario, node_map, link_map, group_map)
+            stage.count('rules', len(rules))
         if len(rules) > 0:
             network_data['rules'] = "rules.csv"
 
@@ -258,10 +383,6 @@ class ExportCSV(object):
         network_file.write(network_units_heading)
         network_file.write(network_entry)
 
-        log.info("Network export complete")
-
-        log.info("networks written to file: %s", network_file.name)
-
 
     def export_nodes(self, scenario, nodes):
         write_output("Exporting nodes.")
@@ -611,15 +732,44 @@ class ExportCSV(object):
         return attributes
 
 
+    def get_attr_units(self, scenario):
+        """
+            Returns the unit of each attribute within a scenario, taken from
+            the first value of the attribute which has a unit. Attributes
+            whose values have different units are reported in the warnings.
+        """
+        attr_units = {}
+        conflicts  = {}
+        for rs in scenario.resourcescenarios or []:
+            unit = rs.value.unit
+            if unit is None:
+                continue
+            if rs.attr_id not in attr_units:
+                attr_units[rs.attr_id] = unit
+            elif attr_units[rs.attr_id] != unit:
+                conflicts.setdefault(rs.attr_id, [attr_units[rs.attr_id]])
+                if unit not in conflicts[rs.attr_id]:
+                    conflicts[rs.attr_id].append(unit)
+
+        for attr_id, units in conflicts.items():
+            warning = "Attribute %s has values in more than one unit in scenario '%s' (%s). "\
+                      "The column is headed %s."%(self.attributes.get(attr_id, attr_id),
+                                                   scenario.name,
+                                                   ", ".join(units),
+                                                   units[0])
+            log.warning(warning)
+            self.warnings.append(warning)
+
+        return attr_units
+
+
     def get_attr_unit(self, scenario, attr_id, attr_name=None):
         """
             Returns the unit of a given resource attribute within a scenario
         """
-
-        for rs in scenario.resourcescenarios:
-            if rs.attr_id == attr_id:
-                if rs.value.unit is not None:
-                    return rs.value.unit
+        unit = scenario.attr_units.get(attr_id)
+        if unit is not None:
+            return unit
 
         log.warning("Unit not found in scenario '%s' for attr: %s", scenario.name, attr_name)
 
@@ -637,102 +787,117 @@ class ExportCSV(object):
         #if resource_attr.attr_is_var == 'Y':
         #    return 'NULL', ''
 
-        for rs in scenario.resourcescenarios:
-            if rs.resource_attr_id == r_attr_id:
-                if rs.value.type == 'descriptor':
-                    value = str(rs.value.value)
-                elif rs.value.type == 'array':
-                    value = rs.value.value
-                    file_name = "array_%s_%s.csv"%(resource_attr.ref_key, attr_name)
-                    file_loc = os.path.join(scenario.target_dir, file_name)
-                    if os.path.exists(file_loc):
-                        arr_file      = open(file_loc, 'a')
-                    else:
-                        arr_file      = open(file_loc, 'w')
-
-                        if rs.value.metadata is not None:
-                            for k, v in json.loads(rs.value.metadata).items():
-                                if k == 'data_struct':
-                                    arr_desc = ",".join(v.split('|'))
-                                    arr_file.write("array , ,%s\n"%arr_desc)
-
-                    arr_val = json.loads(value)
-
-                    np_val = array(eval(repr(arr_val)))
-                    shape = np_val.shape
-                    n = 1
-                    shape_str = []
-                    for x in shape:
-                        n = n * x
-                        shape_str.append(str(x))
-                    one_dimensional_val = np_val.reshape(1, n)
-                    arr_file.write("%s,%s,%s\n"%
-                                (
-                                    resource_name,
-                                    ' '.join(shape_str),
-                                    ','.join([str(x) for x in one_dimensional_val.tolist()[0]]))
-                                 )
-
-                    arr_file.close()
-                    value = file_name
-                elif rs.value.type == 'scalar':
-
-                    value = json.loads(rs.value.value)
-
-                elif rs.value.type == 'timeseries':
-                    value = json.loads(rs.value.value)
-
-                    if value is None or value == {}:
-                        log.debug("Not exporting %s from resource %s as it is empty", attr_name, resource_name)
-                        continue
-
-                    col_names = value.keys()
-                    file_name = "timeseries_%s_%s.csv"%(resource_attr.ref_key, attr_name)
-                    file_loc = os.path.join(scenario.target_dir, file_name)
-                    if os.path.exists(file_loc):
-                        ts_file      = open(file_loc, 'a')
-                    else:
-                        ts_file      = open(file_loc, 'w')
+        rs = scenario.rs_index.get(r_attr_id)
+        if rs is None:
+            return ('', '')
+
+        if rs.value.type == 'descriptor':
+            value = str(rs.value.value)
+        elif rs.value.type == 'array':
+            value = rs.value.value
+            file_name = "array_%s_%s.csv"%(resource_attr.ref_key, attr_name)
+            arr_file, created = scenario.writers.open(file_name)
+            if created:
+                if rs.value.metadata is not None:
+                    for k, v in json.loads(rs.value.metadata).items():
+                        if k == 'data_struct':
+                            arr_desc = ",".join(v.split('|'))
+                            arr_file.write("array , ,%s\n"%arr_desc)
+
+            arr_val = json.loads(value)
 
-                        ts_file.write(",,,%s\n"%','.join(col_names))
-                    if not value:
-                        log.critical(attr_name)
-                        log.critical(resource_name)
-                        log.critical(resource_attr)
-                        log.critical(value)
-                    timestamps = value[col_names[0]].keys()
-                    ts_dict = {}
-                    for t in timestamps:
-                        ts_dict[t] = []
+            np_val = array(eval(repr(arr_val)))
+            shape = np_val.shape
+            n = 1
+            shape_str = []
+            for x in shape:
+                n = n * x
+                shape_str.append(str(x))
+            one_dimensional_val = np_val.reshape(1, n)
+            arr_file.write("%s,%s,%s\n"%
+                        (
+                            resource_name,
+                            ' '.join(shape_str),
+                            ','.join([str(x) for x in one_dimensional_val.tolist()[0]]))
+                         )
 
-                    for col, ts in value.items():
-                        for timestep, val in ts.items():
-                            ts_dict[timestep].append(val)
+            value = file_name
+        elif rs.value.type == 'scalar':
 
-                    for timestep, val in ts_dict.items():
-                            np_val = array(val)
-                            shape = np_val.shape
-                            n = 1
-                            shape_str = []
-                            for x in shape:
-                                n = n * x
-                                shape_str.append(str(x))
-                            one_dimensional_val = np_val.reshape(1, n)
-                            ts_file.write("%s,%s,%s,%s\n"%
-                                        ( resource_name,
-                                        timestep,
-                                        ' '.join(shape_str),
-                                        ','.join([str(x) for x in one_dimensional_val.tolist()[0]])))
+            value = json.loads(rs.value.value)
 
-                    ts_file.close()
+        elif rs.value.type == 'timeseries':
+            value = json.loads(rs.value.value)
 
-                    value = file_name
+            if value is None or value == {}:
+                log.debug("Not exporting %s from resource %s as it is empty", attr_name, resource_name)
+                return ('', '')
 
-                metadata = json.loads(rs.value.metadata)
+            col_names = list(value.keys())
+            file_name = "timeseries_%s_%s.csv"%(resource_attr.ref_key, attr_name)
+            ts_file, created = scenario.writers.open(file_name)
+            if created:
+                ts_file.write(",,,%s\n"%','.join(col_names))
 
-                return (str(value), metadata)
+            self.write_timeseries(ts_file, resource_name, [value[col] for col in col_names])
 
-        return ('', '')
+            value = file_name
+
+        metadata = json.loads(rs.value.metadata)
+
+        return (str(value), metadata)
+
+
+    def write_timeseries(self, ts_file, resource_name, columns):
+        """
+            Write the columns of a timeseries, each a dictionary of values
+            by time step, as one row per time step, in time order:
+            resource name, time step, shape, value of each column.
+            A timeseries whose values are all numbers, or all strings, as
+            ImportCSV saves them, with the same time steps in every column
+            is written as one block. Any other, such as one holding arrays,
+            is written a row at a time.
+        """
+        timesteps = sorted(columns[0].keys())
+
+        value_types = set(type(val) for ts in columns for val in ts.values())
+        is_block = len(value_types) == 1 and \
+                   value_types.pop() in (int, long, float, str, unicode)
+        if is_block and len(columns) > 1:
+            is_block = all(set(ts) == set(timesteps) for ts in columns[1:])
+
+        if is_block:
+            rows = empty((len(timesteps), len(columns) + 3), dtype=object)
+            rows[:, 0] = resource_name
+            rows[:, 1] = timesteps
+            rows[:, 2] = str(len(columns))
+            for i, ts in enumerate(columns):
+                rows[:, i + 3] = [ts[t] for t in timesteps]
+            #Format the whole block at once. %s formats each number
+            #or string as str() does below.
+            row_format = "%s\n"%(",".join(["%s"] * rows.shape[1]),)
+            ts_file.write((row_format * rows.shape[0])%tuple(rows.ravel()))
+            return
+
+        ts_dict = OrderedDict((t, []) for t in timesteps)
+        for ts in columns:
+            for timestep, val in ts.items():
+                ts_dict[timestep].append(val)
+
+        for timestep, val in ts_dict.items():
+            np_val = array(val)
+            shape = np_val.shape
+            n = 1
+            shape_str = []
+            for x in shape:
+                n = n * x
+                shape_str.append(str(x))
+            one_dimensional_val = np_val.reshape(1, n)
+            ts_file.write("%s,%s,%s,%s\n"%
+                        ( resource_name,
+                        timestep,
+                        ' '.join(shape_str),
+                        ','.join([str(x) for x in one_dimensional_val.tolist()[0]])))
 
 
 def commandline_parser():
@@ -770,13 +935,63 @@ Written by Stephen Knox <s.knox@ucl.ac.uk>
     parser.add_argument('-c', '--session_id',
                         help='''Session ID. If this does not exist, a login will be
                         attempted based on details in config.''')
+    parser.add_argument('--fake-server', nargs='?', const='',
+                        help='''Export from an in-memory stand-in for a Hydra
+                        server rather than a real one, for testing and
+                        benchmarking. Give the file saved by an import with
+                        --fake-server to export what was imported.''')
+    parser.add_argument('--fake-latency', type=float, default=0.0,
+                        help='''The time, in seconds, which every call to the
+                        fake server (see --fake-server) takes. Defaults to 0.''')
+    parser.add_argument('--fake-bandwidth', type=float,
+                        help='''The rate, in MB/s, at which requests to and
+                        responses from the fake server (see --fake-server) are
+                        sent. By default they take no time.''')
+    parser.add_argument('--max-open-files', type=int, default=64,
+                        help='''The most array and timeseries files kept open
+                        at once while a scenario is exported. Defaults to 64.''')
+    parser.add_argument('--profile', nargs='?', const='',
+                        help='''Record the time, CPU time and memory taken by
+                        each stage of the export and each scenario exported,
+                        and save them to this JSON file. Defaults to
+                        export_profile.json in the exported network's folder.
+                        A summary is added to the message of the export.''')
+    parser.add_argument('--profile-stats',
+                        help='''Also profile the export with cProfile and save
+                        the statistics to this file, to be read with pstats.
+                        Implies --profile.''')
     return parser
 
 
+def get_fake_connection(args):
+    """
+        The fake server asked for on the command line, if any.
+    """
+    if args.fake_server is None:
+        return None
+
+    FakeConnection = import_shared('fake_connection').FakeConnection
+
+    bandwidth = None
+    if args.fake_bandwidth:
+        bandwidth = args.fake_bandwidth*1024*1024
+    return FakeConnection(state_file=args.fake_server or None,
+                          latency=args.fake_latency,
+                          bandwidth=bandwidth)
+
+
 if __name__ == '__main__':
     parser = commandline_parser()
     args = parser.parse_args()
-    csv = ExportCSV(url=args.server_url, session_id=args.session_id)
+
+    profiler = NullProfiler()
+    if args.profile is not None or args.profile_stats is not None:
+        profiler = import_shared('profiling').Profiler(stats_file=args.profile_stats)
+    with profiler.stage('connect'):
+        csv = ExportCSV(url=args.server_url,
+                        session_id=args.session_id,
+                        connection=get_fake_connection(args))
+    csv.profiler = profiler
     try:
         write_progress(1, csv.num_steps)
         validate_plugin_xml(os.path.join(__location__, 'plugin.xml'))
@@ -785,8 +1000,12 @@ if __name__ == '__main__':
         if args.timezone is not None:
             csv.timezone = pytz.timezone(args.timezone)
 
+        csv.max_open_files = args.max_open_files
+
         csv.export(args.network_id, args.scenario_id, args.output_folder)
-        message = "Export complete"
+        message = "Export complete."
+        if args.fake_server is not None:
+            message = "%s %s"%(message, csv.connection.get_summary())
     except HydraPluginError as e:
         message="An error has occurred"
         errors = [e.message]
@@ -796,6 +1015,23 @@ if __name__ == '__main__':
         log.exception(e)
         errors = [e]
 
+    if args.fake_server is not None:
+        csv.connection.close()
+
+    if profiler.enabled:
+        profiler.stop()
+        message = "%s %s"%(message, profiler.get_summary())
+        profile_file = args.profile
+        if not profile_file:
+            profile_file = os.path.join(csv.files[-1] if len(csv.files) > 0 else '',
+                                        'export_profile.json')
+        try:
+            profiler.save(profile_file)
+            csv.files.append(profile_file)
+        except IOError, e:
+            log.exception(e)
+            csv.warnings.append("Unable to save the profile to %s: %s"%(profile_file, e))
+
     xml_response = create_xml_response('ExportCSV',
                                        args.network_id,
                                        [],
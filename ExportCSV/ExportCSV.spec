@@ -1,6 +1,6 @@
 # -*- mode: python -*-
 a = Analysis(['ExportCSV.py'],
-             pathex=[],
+             pathex=['../ImportCSV'],
              hiddenimports=[],
              hookspath=None,
              runtime_hooks=None,
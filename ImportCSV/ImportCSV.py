@@ -22,6 +22,8 @@
 import argparse as ap
 import logging
 import os, sys
+import time
+import multiprocessing
 from datetime import datetime
 import pytz
 
@@ -37,24 +39,68 @@ from hydra_base.lib.objects import JSONObject
 from hydra_base.lib.units import validate_resource_attributes
 from hydra_base.exceptions import HydraPluginError
 
-from csv_util import get_file_data, \
+from csv_util import iter_file_data, \
+                     split_header, \
                      check_header, \
+                     get_field_idx, \
+                     read_metadata, \
+                     read_resource_metadata, \
+                     get_metadata_as_dict, \
                      parse_unit, \
                      get_scenario_times
 
 from rules import RuleReader
-from data import create_dataset
+from registry import ResourceRegistry
+from scheduler import ParseScheduler
+from prefetch import FilePrefetcher
+from fake_connection import FakeConnection
+from profiling import Profiler
+from upload import DataUploader, \
+                   resource_keys, \
+                   get_resource_attr_keys, \
+                   get_resource_attr_ids, \
+                   map_resource_attr_ids
+from incremental import get_dataset_hash, \
+                        get_scenario_hashes, \
+                        get_group_item_keys, \
+                        read_manifest, \
+                        write_manifest
+from data import ParseContext, DatasetPool, create_line_datasets, set_parse_cache
+from cache import ParseCache, default_cache_dir
+from records import Node, Link, Group, ResourceAttr, to_wire
 
 log = logging.getLogger(__name__)
 
 __location__ = os.path.split(sys.argv[0])[0]
 
+#The mandatory columns of node, link and group files and where
+#we expect to see them if the heading does not say otherwise.
+resource_fields = {
+    'NODE' : {'name': 0,
+              'description': -1,
+              'x': 1,
+              'y': 2,
+              'type': None,
+             },
+    'LINK' : {'name': 0,
+              'description': -1,
+              'from': 1,
+              'to': 2,
+              'type': None,
+             },
+    'GROUP': {'name': 0,
+              'description': -1,
+              'type': None,
+              'members':2,
+             },
+}
+
 
 class ImportCSV(object):
     """
     """
 
-    def __init__(self, url=None, session_id=None):
+    def __init__(self, url=None, session_id=None, connection=None):
 
         self.url = url
 
@@ -79,11 +125,9 @@ class ImportCSV(object):
         #so that node, link and group types can be validated
         self.Template      = dict()
 
-        #These are used to keep track of whether
-        #duplicate names have been specified in the files.
-        self.link_names = []
-        self.node_names = []
-        self.group_names = []
+        #This keeps track of whether duplicate names have been specified
+        #in the files, as well as the id and type of every resource.
+        self.registry = ResourceRegistry()
 
         self.update_network_flag = False
         self.timezone = pytz.utc
@@ -92,16 +136,53 @@ class ImportCSV(object):
         self.basepath = ''
 
         self.add_attrs = True
-        self.nodetype_dict = dict()
-        self.linktype_dict = dict()
-        self.grouptype_dict = dict()
         self.networktype = ''
 
+        #Prepares node, link and group files in worker processes
+        #if more than one worker is requested. See scheduler.py
+        self.scheduler = None
+
+        #Reads timeseries and array files in the background
+        #when expanding file names. See prefetch.py
+        self.prefetcher = None
+
+        #Keeps parsed timeseries and array files between runs. See cache.py
+        self.cache = None
+
+        #Holds one copy of each distinct dataset in the scenario
+        self.dataset_pool = DatasetPool()
+
+        #Times the stages of the import if --profile is used. See profiling.py
+        self.profiler = Profiler(enabled=False)
+
+        #If either is set, the network is saved first and its data is
+        #uploaded separately in batches of this many resource scenarios
+        #or bytes.
+        self.batch_size  = None
+        self.batch_bytes = None
+        #How many batches may be uploaded at once to a remote server
+        #and how many times a batch is retried after a connection error.
+        self.upload_threads = 4
+        self.upload_retries = 3
+
+        #In an incremental import only the datasets which have changed since
+        #the last import are uploaded. See incremental.py. The hashes of the
+        #datasets are kept in the manifest file, if there is one.
+        self.incremental = False
+        self.manifest    = None
+        #The scenarios in the network being updated
+        self.base_scenario_ids = []
+
         self.start_time = None
         self.end_time   = None
         self.timestep   = None
 
-        if url is not None:
+        self.url = url
+
+        if connection is not None:
+            #Any object with the same calls as a JSONConnection
+            self.connection = connection
+        elif url is not None:
             self.connection = RemoteJSONConnection(url)
             if session_id is not None:
                 log.info("Using existing session %s", session_id)
@@ -117,6 +198,7 @@ class ImportCSV(object):
         self.attr_id  = temp_ids()
 
         self.units = self.get_dimensions()
+        self.unit_ids = dict((abbr, unit.id) for abbr, unit in self.units.items())
 
         self.warnings = []
         self.message = ''
@@ -137,6 +219,23 @@ class ImportCSV(object):
                 unit.dimension = dimension
         return units
 
+    def set_cache(self, cache_dir=default_cache_dir, max_size=500*1024*1024):
+        self.cache = ParseCache(cache_dir, max_size)
+        set_parse_cache(self.cache)
+
+    def get_parse_context(self):
+        """
+            The settings needed to create datasets, in a form which can be
+            sent to a worker process.
+        """
+        return ParseContext(self.basepath,
+                            self.expand_filenames,
+                            self.timezone,
+                            self.Scenario['name'],
+                            self.unit_ids,
+                            self.Template,
+                            cache=self.cache)
+
     def create_project(self, ID=None, network_id=None):
         if ID is not None:
             try:
@@ -203,35 +302,22 @@ class ImportCSV(object):
 
             self.basepath = os.path.dirname(os.path.realpath(file))
 
-            net_data = get_file_data(file)
+            net_data = iter_file_data(file)
 
-            try:
-                file_parts = file.split(".")
-                file_base = file_parts[0]
-                file_ext = file_parts[1]
-                new_filename = "%s_metadata.%s"%(file_base, file_ext)
-                metadata = self.read_metadata(new_filename)
-            except IOError:
-                log.info("No metadata found for node file %s",file)
-                metadata = {}
-
-            keys = [k.strip() for k in net_data[0].split(',')]
+            metadata = read_resource_metadata(self.basepath, file)
+
+            header, units, net_lines = split_header(file, net_data)
+            keys = [k.strip() for k in header.split(',')]
             #Make a list of all the keys in lowercase so we can perform
             #checks later on for certain headings.
             lower_keys = [k.lower().replace(" ", "") for k in keys]
 
             check_header(file, keys)
-            if net_data[1].lower().startswith('unit'):
-                units = net_data[1].split(',')
-                data_idx = 2
-            else:
-                units = None
-                data_idx = 1
             # A network file should only have one line of data
-            data = net_data[data_idx].split(',')
-            if units is not None:
-                for i, unit in enumerate(units):
-                    units[i] = unit.strip()
+            net_line = next(net_lines, None)
+            if net_line is None:
+                raise HydraPluginError("No network data found in %s"%(file))
+            data = net_line.split(',')
 
             #A projection may not be specified, so we need to account for this
             projection = None
@@ -302,12 +388,15 @@ class ImportCSV(object):
                     # load existing nodes
                     for node in self.Network['nodes']:
                         self.Nodes.update({node['name']: node})
+                        self.registry.set_id('NODE', node['name'], node['id'])
                     # load existing links
                     for link in self.Network['links']:
                         self.Links.update({link['name']: link})
+                        self.registry.set_id('LINK', link['name'], link['id'])
                     # load existing groups
                     for group in self.Network['resourcegroups']:
                         self.Groups.update({group['name']: group})
+                        self.registry.set_id('GROUP', group['name'], group['id'])
 
                     # Nodes and links are now deleted from the network, they
                     # will be added later...
@@ -316,6 +405,7 @@ class ImportCSV(object):
                     self.Network['resourcegroups'] = []
                     # The scenario loaded with the network will be deleted as
                     # well, we create a new one.
+                    self.base_scenario_ids = [sc['id'] for sc in self.Network['scenarios']]
                     self.Network['scenarios'] = []
                     self.Network['type'] = data[field_idx['type']].strip()
                 except RequestError:
@@ -352,6 +442,9 @@ class ImportCSV(object):
                 if i not in field_idx.values():
                     attrs[i]=key.strip()
 
+            if self.prefetcher is not None:
+                self.prefetcher.prefetch_line(self.basepath, data, self.file_dict)
+
             log.info("Adding data to network.")
 
             if len(attrs) > 0:
@@ -374,142 +467,106 @@ class ImportCSV(object):
             )
 
     def read_metadata(self, filename):
-        log.info("Reading metadata from file %s", filename)
-        metadata = get_file_data(os.path.join(self.basepath, filename))
-        keys = metadata[0].split(',')
-        check_header(filename, keys)
-        data = metadata[1:]
-
-        metadata_dict = {}
-        for line_num, data_line in enumerate(data):
-            try:
-                data_line = data_line.replace('\r', '')
-                split_data = data_line.split(',')
-                metadata_dict[split_data[0].strip()] = self.get_metadata_as_dict(keys[1:], split_data[1:])
-            except Exception as e:
-                raise HydraPluginError("Malformed metadata for %s, line %s of %s"%(e.message, line_num+2, filename))
-        return metadata_dict
+        return read_metadata(self.basepath, filename)
 
     def get_metadata_as_dict(self, keys, metadata):
         """
             Turn a list of metadata values into a dictionary structure.
-            @parameter keys to describe the attribte to which this metadata refers
-            @parameter list of metadata. in the structure: ["(key;val) (key;val)", "(key;val) (key;val)",...]
-            @returns dictionary in the format: {attr1 : {key:val, key:val}, attr2: {key:val, key:val}...}
+            See csv_util.get_metadata_as_dict
         """
-        metadata_dict = {}
-        for i, attr in enumerate(keys):
-            try:
-                metadata_dict[attr.strip()] = {}
-                if metadata[i].strip() != '':
-                    attr_metadata = metadata[i].split(")")
-                    for attr_meta in attr_metadata:
-                        if attr_meta == '':
-                            continue
-                        attr_meta = attr_meta.replace('(', '')
-                        #Check if it's ';' or ':' that is the deliminator..
-                        if attr_meta.find(';') > 0:
-                            keyval = attr_meta.split(';')
-                        else:
-                            keyval = attr_meta.split(':')
+        return get_metadata_as_dict(keys, metadata)
 
-                        key = keyval[0].strip()
-                        if key.lower() in ('name', 'dataset_name', 'dataset name'):
-                            key = 'name'
-                        val = keyval[1].strip()
-                        metadata_dict[attr.strip()][key] = val
-            except Exception as e:
-                log.critical(e)
-                log.critical("Make sure the CSV file is formatted correctly.")
-                raise Exception(attr)
+    def open_resource_file(self, kind, file):
+        """
+            Get the metadata, heading, units and lines of a node, link or
+            group file. Each line comes with the datasets created for it by
+            the scheduler, if it has already prepared the file, or None, in
+            which case the datasets are created as the line is read.
+        """
+        prepared = None
+        if self.scheduler is not None:
+            prepared = self.scheduler.get(kind, file)
 
-        return metadata_dict
+        if prepared is not None:
+            return prepared.metadata, prepared.keys, prepared.units, prepared.lines
 
-    def read_nodes(self, file):
-        log.info("Reading Nodes")
+        metadata = read_resource_metadata(self.basepath, file)
 
-        node_data = get_file_data(os.path.join(self.basepath, file))
+        #There may or may not be a units line, so we need to account for that.
+        #The lines after the units line are read as they are processed.
+        file_data = iter_file_data(os.path.join(self.basepath, file))
+        header, units, data = split_header(file, file_data)
 
-        log.info("Node data retrieved")
+        keys = header.split(',')
+        check_header(file, keys)
 
-        try:
-            file_parts = file.split(".")
-            file_base = file_parts[0]
-            file_ext = file_parts[1]
-            new_filename = "%s_metadata.%s"%(file_base, file_ext)
-            metadata = self.read_metadata(new_filename)
-        except IOError:
-            log.info("No metadata found for node file %s",file)
-            metadata = {}
+        return metadata, keys, units, ((line, None) for line in data)
 
-        self.add_attrs = True
+    def schedule_files(self, workers):
+        """
+            Start preparing the node, link and group files listed in the
+            network file in a pool of worker processes.
+        """
+        self.scheduler = ParseScheduler(workers)
+        context = self.get_parse_context()
+        for kind, files in (('NODE', self.node_args),
+                            ('LINK', self.link_args),
+                            ('GROUP', self.group_args)):
+            self.scheduler.schedule(kind, files, resource_fields[kind], context)
+
+    def prefetch_files(self):
+        """
+            Start reading the timeseries and array files referred to in
+            the node, link and group files in the background.
+        """
+        files = [f for f in self.node_args + self.link_args + self.group_args if f != ""]
+        self.prefetcher.prefetch_tables(self.basepath, files, self.file_dict)
 
-        keys  = node_data[0].split(',')
-        check_header(file, keys)
+    def read_nodes(self, file):
+        log.info("Reading Nodes")
 
-        #There may or may not be a units line, so we need to account for that.
-        if node_data[1].lower().startswith('unit'):
-            units = node_data[1].split(',')
-            for i, unit in enumerate(units):
-                units[i] = unit.strip()
+        metadata, keys, units, data = self.open_resource_file('NODE', file)
 
-            data_idx = 2
-        else:
-            units = None
-            data_idx = 1
-        # Get all the lines after the units line.
-        data = node_data[data_idx:]
-
-        field_idx = {'name': 0,
-                     'description': -1,
-                     'x': 1,
-                     'y': 2,
-                     'type': None,
-                     }
-        # Guess parameter position:
-        attrs = dict()
-        for i, key in enumerate(keys):
+        self.add_attrs = True
 
-            if key.lower().strip() in field_idx:
-                field_idx[key.lower().strip()] = i
-            else:
-                attrs.update({i: key.strip()})
+        # Guess parameter position:
+        field_idx = dict(resource_fields['NODE'])
+        attrs = get_field_idx(keys, field_idx)
 
-        for line_num, line in enumerate(data):
+        for line_num, (line, datasets) in enumerate(data):
 
             #skip any empty lines
             if line.strip() in self.ignorelines:
                 continue
 
             try:
-                node = self.read_node_line(line, attrs, field_idx, metadata, units)
+                node = self.read_node_line(line, attrs, field_idx, metadata, units, datasets=datasets)
             except Exception as e:
                 log.exception(e)
                 raise HydraPluginError("An error has occurred in file %s at line %s: %s"%(os.path.split(file)[-1], line_num+3, e))
 
             self.Nodes.update({node['name']: node})
 
-    def read_node_line(self, line, attrs, field_idx, metadata, units):
+    def read_node_line(self, line, attrs, field_idx, metadata, units, datasets=None):
         linedata = line.split(',')
         nodename = linedata[field_idx['name']].strip()
 
         restrictions = {}
 
-        if nodename in self.node_names:
-            raise HydraPluginError("Duplicate Node name: %s"%(nodename))
-        else:
-            self.node_names.append(nodename)
+        self.registry.add('NODE', nodename)
 
         if nodename in self.Nodes:
             node = self.Nodes[nodename]
             log.debug('Node %s exists.' % nodename)
         else:
-            node = dict(
+            node = Node(
                 id = self.node_id.__next__(),
                 name = nodename,
                 description = linedata[field_idx['description']].strip(),
                 attributes = [],
             )
+        self.registry.set_id('NODE', nodename, node['id'])
+
         try:
             float(linedata[field_idx['x']].strip())
             node['x'] = linedata[field_idx['x']].strip()
@@ -539,13 +596,10 @@ class ImportCSV(object):
                         (node_type))
 
                 restrictions = self.Template['resources']['NODE'][node_type]['attributes']
-            if node_type not in self.nodetype_dict:
-                self.nodetype_dict.update({node_type: (nodename,)})
-            else:
-                self.nodetype_dict[node_type] += (nodename,)
+            self.registry.set_type('NODE', nodename, node_type)
 
         if len(attrs) > 0:
-            node = self.add_data(node, attrs, linedata, metadata, units=units, restrictions=restrictions)
+            node = self.add_data(node, attrs, linedata, metadata, units=units, restrictions=restrictions, datasets=datasets)
 
         return node
 
@@ -558,58 +612,21 @@ class ImportCSV(object):
             self.warnings.append("No links specified")
             return
 
-        link_data = get_file_data(os.path.join(self.basepath, file))
-
-        try:
-            file_parts = file.split(".")
-            file_base = file_parts[0]
-            file_ext = file_parts[1]
-            new_filename = "%s_metadata.%s"%(file_base, file_ext)
-            metadata = self.read_metadata(new_filename)
-        except IOError:
-            log.info("No metadata found for node file %s",file)
-            metadata = {}
+        metadata, keys, units, data = self.open_resource_file('LINK', file)
 
         self.add_attrs = True
 
-        keys = link_data[0].split(',')
-        check_header(file, keys)
-
-        #There may or may not be a units line, so we need to account for that.
-        if link_data[1].lower().startswith('unit'):
-            units = link_data[1].split(',')
-            for i, unit in enumerate(units):
-                units[i] = unit.strip()
-
-            data_idx = 2
-        else:
-            units = None
-            data_idx = 1
-
-        # Get all the lines after the units line
-        data = link_data[data_idx:]
-
-        field_idx = {'name': 0,
-                     'description': -1,
-                     'from': 1,
-                     'to': 2,
-                     'type': None,
-                     }
         # Guess parameter position:
-        attrs = dict()
-        for i, key in enumerate(keys):
-            if key.lower().strip() in field_idx:
-                field_idx[key.lower().strip()] = i
-            else:
-                attrs.update({i: key.strip()})
+        field_idx = dict(resource_fields['LINK'])
+        attrs = get_field_idx(keys, field_idx)
 
-        for line_num, line in enumerate(data):
+        for line_num, (line, datasets) in enumerate(data):
             #skip any empty lines
             if line.strip() in self.ignorelines:
                 continue
 
             try:
-                link = self.read_link_line(line, attrs, field_idx, metadata, units)
+                link = self.read_link_line(line, attrs, field_idx, metadata, units, datasets=datasets)
             except Exception as e:
                 log.exception(e)
                 raise HydraPluginError("An error has occurred in file %s at line %s: %s"%(os.path.split(file)[-1], line_num+3, e))
@@ -617,34 +634,30 @@ class ImportCSV(object):
             if link is not None:
                 self.Links.update({link['name']: link})
 
-    def read_link_line(self, line, attrs, field_idx, metadata, units):
+    def read_link_line(self, line, attrs, field_idx, metadata, units, datasets=None):
 
         restrictions = {}
         linedata = line.split(',')
         linkname = linedata[field_idx['name']].strip()
 
-        if linkname in self.link_names:
-            raise HydraPluginError("Duplicate Link name: %s"%(linkname))
-        else:
-            self.link_names.append(linkname)
+        self.registry.add('LINK', linkname)
 
         if linkname in self.Links:
             link = self.Links[linkname]
             log.debug('Link %s exists.' % linkname)
         else:
-            link = dict( id = self.link_id.__next__(),
+            link = Link( id = self.link_id.__next__(),
                          name = linkname,
                          description = linedata[field_idx['description']].strip(),
                          attributes = []
                        )
 
-        try:
-            fromnode = self.Nodes[linedata[field_idx['from']].strip()]
-            tonode = self.Nodes[linedata[field_idx['to']].strip()]
-            link['node_1_id'] = fromnode['id']
-            link['node_2_id'] = tonode['id']
-
-        except KeyError:
+        node_1_id = self.registry.get_id('NODE', linedata[field_idx['from']].strip())
+        node_2_id = self.registry.get_id('NODE', linedata[field_idx['to']].strip())
+        if node_1_id is not None and node_2_id is not None:
+            link['node_1_id'] = node_1_id
+            link['node_2_id'] = node_2_id
+        else:
             log.info(('Start or end node not found (%s -- %s).' +
                           ' No link created.') %
                          (linedata[field_idx['from']].strip(),
@@ -655,6 +668,8 @@ class ImportCSV(object):
                           linedata[field_idx['to']].strip()))
             return None
 
+        self.registry.set_id('LINK', linkname, link['id'])
+
         if field_idx['type'] is not None:
             link_type = linedata[field_idx['type']].strip()
             link['type'] = link_type
@@ -665,12 +680,9 @@ class ImportCSV(object):
                         %(link_type))
 
                 restrictions = self.Template['resources']['LINK'][link_type]['attributes']
-            if link_type not in self.linktype_dict:
-                self.linktype_dict.update({link_type: (linkname,)})
-            else:
-                self.linktype_dict[link_type] += (linkname,)
+            self.registry.set_type('LINK', linkname, link_type)
         if len(attrs) > 0:
-            link = self.add_data(link, attrs, linedata, metadata, units=units, restrictions=restrictions)
+            link = self.add_data(link, attrs, linedata, metadata, units=units, restrictions=restrictions, datasets=datasets)
 
         return link
 
@@ -684,67 +696,28 @@ class ImportCSV(object):
             self.warnings.append("No groups specified")
             return
 
-        group_data = get_file_data(os.path.join(self.basepath, file))
-
-        try:
-            file_parts = file.split(".")
-            file_base = file_parts[0]
-            file_ext = file_parts[1]
-            new_filename = "%s_metadata.%s"%(file_base, file_ext)
-            metadata = self.read_metadata(new_filename)
-        except IOError:
-            log.info("No metadata found for node file %s",file)
-            metadata = {}
+        metadata, keys, units, data = self.open_resource_file('GROUP', file)
 
         self.add_attrs = True
 
-        keys  = group_data[0].split(',')
-        check_header(file, keys)
-
-        #There may or may not be a units line, so we need to account for that.
-        if group_data[1].lower().startswith('unit'):
-            units = group_data[1].split(',')
-            for i, unit in enumerate(units):
-                units[i] = unit.strip()
-
-            data_idx = 2
-        else:
-            units = None
-            data_idx = 1
-
-        # Get all the lines after the units line
-        data = group_data[data_idx:]
-
-        #Indicates what the mandatory columns are and where
-        #we expect to see them.
-        field_idx = {'name': 0,
-                     'description': -1,
-                     'type': None,
-                     'members':2,
-                     }
-
-        attrs = dict()
         # Guess parameter position:
-        for i, key in enumerate(keys):
-            if key.lower().strip() in field_idx:
-                field_idx[key.lower().strip()] = i
-            else:
-                attrs.update({i: key.strip()})
+        field_idx = dict(resource_fields['GROUP'])
+        attrs = get_field_idx(keys, field_idx)
 
-        for line_num, line in enumerate(data):
+        for line_num, (line, datasets) in enumerate(data):
 
             #skip any empty lines
             if line.strip() in self.ignorelines:
                 continue
             try:
-                group = self.read_group_line(line, attrs, field_idx, metadata, units)
+                group = self.read_group_line(line, attrs, field_idx, metadata, units, datasets=datasets)
             except Exception as e:
                 log.exception(e)
                 raise HydraPluginError("An error has occurred in file %s at line %s: %s"%(os.path.split(file)[-1], line_num+3, e))
 
             self.Groups.update({group['name']: group})
 
-    def read_group_line(self, line, attrs, field_idx, metadata, units):
+    def read_group_line(self, line, attrs, field_idx, metadata, units, datasets=None):
 
         group_data = line.split(',')
         group_name = group_data[field_idx['name']].strip()
@@ -755,21 +728,19 @@ class ImportCSV(object):
 
         restrictions = {}
 
-        if group_name in self.group_names:
-            raise HydraPluginError("Duplicate Group name: %s"%(group_name))
-        else:
-            self.group_names.append(group_name)
+        self.registry.add('GROUP', group_name)
 
         if group_name in self.Groups:
             group = self.Groups[group_name]
             log.debug('Group %s exists.' % group_name)
         else:
-            group = dict(
+            group = Group(
                 id = self.group_id.__next__(),
                 name = group_name,
                 description = group_data[field_idx['description']].strip(),
                 attributes = [],
             )
+        self.registry.set_id('GROUP', group_name, group['id'])
 
         if field_idx['type'] is not None:
 
@@ -783,14 +754,10 @@ class ImportCSV(object):
                         %(group_type))
                 restrictions = self.Template['resources']['GROUP'][group_type]['attributes']
 
-            if group_type not in self.grouptype_dict.keys():
-                self.grouptype_dict.update({group_type: (group_name,)})
-            else:
-                self.grouptype_dict[group_type] += (group_name,)
-
+            self.registry.set_type('GROUP', group_name, group_type)
 
         if len(attrs) > 0:
-            group = self.add_data(group, attrs, group_data, metadata, units=units, restrictions=restrictions)
+            group = self.add_data(group, attrs, group_data, metadata, units=units, restrictions=restrictions, datasets=datasets)
 
         return group
 
@@ -805,34 +772,19 @@ class ImportCSV(object):
             member: name of the node, link or group in question.
 
         """
-        member_data = get_file_data(os.path.join(self.basepath, file))
+        member_data = iter_file_data(os.path.join(self.basepath, file))
 
-        keys  = member_data[0].split(',')
-        check_header(file, keys)
         #There may or may not be a units line, so we need to account for that.
-        if member_data[1].lower().startswith('unit'):
-            units = member_data[1].split(',')
-            for i, unit in enumerate(units):
-                units[i] = unit.strip()
-
-            data_idx = 2
-        else:
-            units = None
-            data_idx = 1
+        #The lines after the units line are read as they are processed.
+        header, units, data = split_header(file, member_data)
 
-        # Get all the lines after the units line
-        data = member_data[data_idx:]
+        keys  = header.split(',')
+        check_header(file, keys)
 
         field_idx = {}
         for i, k in enumerate(keys):
             field_idx[k.lower().strip()] = i
 
-        type_map = {
-                'NODE' : self.Nodes,
-                'LINK' : self.Links,
-                'GROUP': self.Groups,
-            }
-
         items = []
 
         for line_num, line in enumerate(data):
@@ -842,7 +794,7 @@ class ImportCSV(object):
                 continue
 
             try:
-                item = self.read_group_member_line(line, field_idx, type_map)
+                item = self.read_group_member_line(line, field_idx)
                 if item is None:
                     continue
             except Exception as e:
@@ -854,13 +806,13 @@ class ImportCSV(object):
 
         self.Scenario['resourcegroupitems'] = items
 
-    def read_group_member_line(self, line, field_idx, type_map):
+    def read_group_member_line(self, line, field_idx):
 
         member_data = line.split(',')
         group_name  = member_data[field_idx['name']].strip()
-        group = self.Groups.get(group_name)
+        group_id = self.registry.get_id('GROUP', group_name)
 
-        if group is None:
+        if group_id is None:
             log.info("Group %s has not been specified."%(group_name) +
                       ' Group item not created.')
             self.warnings.append("Group %s has not been specified"%(group_name) +
@@ -870,7 +822,7 @@ class ImportCSV(object):
 
         member_type = member_data[field_idx['type']].strip().upper()
 
-        if type_map.get(member_type) is None:
+        if not self.registry.has_kind(member_type):
             log.info("Type %s does not exist."%(member_type) +
                       ' Group item not created.')
             self.warnings.append("Type %s does not exist"%(member_type) +
@@ -878,8 +830,8 @@ class ImportCSV(object):
             return None
         member_name = member_data[field_idx['member']].strip()
 
-        member = type_map[member_type].get(member_name)
-        if member is None:
+        member_id = self.registry.get_id(member_type, member_name)
+        if member_id is None:
             log.info("%s %s does not exist."%(member_type, member_name) +
                       ' Group item not created.')
             self.warnings.append("%s %s does not exist."%(member_type, member_name) +
@@ -887,8 +839,8 @@ class ImportCSV(object):
             return None
 
         item = dict(
-            group_id = group['id'],
-            ref_id   = member['id'],
+            group_id = group_id,
+            ref_id   = member_id,
             ref_key  = member_type,
         )
 
@@ -915,10 +867,11 @@ class ImportCSV(object):
 
         return attribute
 
-    def add_data(self, resource, attrs, data, metadata, units=None, restrictions={}):
+    def add_data(self, resource, attrs, data, metadata, units=None, restrictions={}, datasets=None):
         '''Add the data read for each resource to the resource. This requires
         creating the attributes, resource attributes and a scenario which holds
-        the data.'''
+        the data. datasets holds the datasets already created for this line,
+        if the scheduler has prepared it.'''
 
         attributes = []
 
@@ -931,6 +884,16 @@ class ImportCSV(object):
         for res_attr in resource['attributes']:
             resource_attrs.update({res_attr.attr_id: res_attr})
 
+        if datasets is None:
+            datasets = create_line_datasets(data,
+                                            attrs,
+                                            units,
+                                            resource['name'],
+                                            metadata,
+                                            restrictions,
+                                            self.get_parse_context(),
+                                            self.file_dict)
+
         for i in attrs:
             if attrs[i].lower() in self.Attributes:
                 attribute = self.Attributes[attrs[i].lower()]
@@ -964,11 +927,11 @@ class ImportCSV(object):
             if attr['id'] in resource_attrs:
                 res_attr = resource_attrs[attr['id']]
             else:
-                res_attr = JSONObject(dict(
+                res_attr = ResourceAttr(
                     id = self.attr_id.__next__(),
                     attr_id = attr['id'],
                     attr_is_var = 'N',
-                ))
+                )
             # create dataset and assign to attribute (if not empty)
             if len(data[i].strip()) > 0:
 
@@ -982,13 +945,6 @@ class ImportCSV(object):
                 elif data[i].strip() == '-':
                     continue
                 else:
-                    if metadata:
-                        resource_metadata = metadata.get(resource['name'], {})
-                        dataset_metadata = resource_metadata.get(attrs[i], {})
-                    else:
-                        dataset_metadata = {}
-
-                    unit_id = None
                     if units is not None:
                         if units[i] is not None and len(units[i].strip()) > 0 and units[i].strip() != '-':
                             dimension = attr.get('dimension_id')
@@ -997,21 +953,13 @@ class ImportCSV(object):
                         else:
                             dimension = None
 
-                        unit_id      = self.units[units[i]].id
-
                     try:
-                        dataset = create_dataset(data[i],
-                                                  res_attr,
-                                                  unit_id,
-                                                  resource['name'],
-                                                  dataset_metadata,
-                                                  restrictions.get(attr['name'], {}).get('restrictions', {}),
-                                                  self.expand_filenames,
-                                                  self.basepath,
-                                                  self.file_dict,
-                                                  self.Scenario['name'],
-                                                  self.timezone
-                                                )
+                        dataset = datasets[i]
+                        if isinstance(dataset, Exception):
+                            raise dataset
+                        dataset['attr_id'] = res_attr['attr_id']
+                        dataset['resource_attr_id'] = res_attr['id']
+                        dataset['dataset'] = self.dataset_pool.add(dataset['dataset'])
                         #Extrapolate the scenario start time, end time and time step from the first
                         #timeseries we find
                         if dataset['dataset']['type'] == 'timeseries' and self.Scenario.get('start_time') is None:
@@ -1032,7 +980,8 @@ class ImportCSV(object):
 
         errors = []
         if len(self.Template):
-            errors = validate_resource_attributes(resource, self.Attributes, self.Template)
+            with self.profiler.stage('validate'):
+                errors = validate_resource_attributes(resource, self.Attributes, self.Template)
         #resource.attributes = res_attr_array
 
         if len(errors) > 0:
@@ -1048,31 +997,14 @@ class ImportCSV(object):
         else:
             raise HydraPluginError("No template specified. Please supply a template")
 
-        type_ids = dict()
         warnings = []
 
-        for type_name in self.nodetype_dict:
-            for tmpltype in template.get('templatetypes', []):
-                if tmpltype['name'] == type_name:
-                    type_ids[tmpltype['name']] = tmpltype['id']
-                    break
-
-        for type_name in self.linktype_dict:
-            for tmpltype in template.get('templatetypes', []):
-                if tmpltype['name'] == type_name:
-                    type_ids[tmpltype['name']] = tmpltype['id']
-                    break
-
-        for type_name in self.grouptype_dict:
-            for tmpltype in template.get('templatetypes', []):
-                if tmpltype['name'] == type_name:
-                    type_ids[tmpltype['name']] = tmpltype['id']
-                    break
-
+        #Index the template types by name. If there are several types with
+        #the same name, the first one is used.
+        type_ids = dict()
         for tmpltype in template.get('templatetypes', []):
-            if tmpltype['name'] == self.networktype:
+            if tmpltype['name'] not in type_ids:
                 type_ids[tmpltype['name']] = tmpltype['id']
-                break
 
         args = []
 
@@ -1087,46 +1019,44 @@ class ImportCSV(object):
         else:
             warnings.append("Network type %s not found"%(self.networktype))
 
-        if self.NetworkSummary.get('nodes', []):
-            for node in self.NetworkSummary['nodes']:
-                for typename, node_name_list in self.nodetype_dict.items():
-                    if type_ids[typename] and node['name'] in node_name_list:
-                        args.append(JSONObject(dict(
-                            ref_key = 'NODE',
-                            ref_id  = node['id'],
-                            type_id = type_ids[typename],
-                        )))
-        else:
-            warnings.append("No nodes found when setting template types")
-
-        if self.NetworkSummary.get('links', []):
-            for link in self.NetworkSummary['links']:
-                for typename, link_name_list in self.linktype_dict.items():
-                    if type_ids[typename] and link['name'] in link_name_list:
-                        args.append(JSONObject(dict(
-                            ref_key = 'LINK',
-                            ref_id  = link['id'],
-                            type_id = type_ids[typename],
-                        )))
-        else:
-           warnings.append("No links found when setting template types")
-
-        if self.NetworkSummary.get('resourcegroups'):
-            for group in self.NetworkSummary['resourcegroups']:
-                for typename, group_name_list in self.grouptype_dict.items():
-                    if type_ids[typename] and group['name'] in group_name_list:
-                        args.append(JSONObject(dict(
-                            ref_key = 'GROUP',
-                            ref_id  = group['id'],
-                            type_id = type_ids[typename],
-                        )))
-        else:
-           warnings.append("No resourcegroups found when setting template types")
+        for ref_key, resource_key in (('NODE', 'nodes'),
+                                      ('LINK', 'links'),
+                                      ('GROUP', 'resourcegroups')):
+            resources = self.NetworkSummary.get(resource_key)
+            if not resources:
+                warnings.append("No %s found when setting template types"%(resource_key))
+                continue
+
+            t = time.time()
+            for resource in resources:
+                type_name = self.registry.get_type(ref_key, resource['name'])
+                if type_name is None:
+                    continue
+                if type_name not in type_ids:
+                    raise HydraPluginError("Type %s of %s %s not found in the template."%
+                                           (type_name, ref_key.lower(), resource['name']))
+                if type_ids[type_name]:
+                    args.append(JSONObject(dict(
+                        ref_key = ref_key,
+                        ref_id  = resource['id'],
+                        type_id = type_ids[type_name],
+                    )))
+            log.info("Types of %s %s found in %s seconds",
+                     len(resources), resource_key, time.time() - t)
 
         self.connection.assign_types_to_resources(resource_types=args)
 
         return warnings
 
+    def count_items(self):
+        """
+            The number of each kind of item read so far, for the profiler.
+        """
+        return dict(nodes    = len(self.Nodes),
+                    links    = len(self.Links),
+                    groups   = len(self.Groups),
+                    datasets = len(self.Scenario['resourcescenarios']))
+
     def commit(self):
         log.info("Committing Network")
         for node in self.Nodes.values():
@@ -1135,15 +1065,43 @@ class ImportCSV(object):
             self.Network['links'].append(link)
         for group in self.Groups.values():
             self.Network['resourcegroups'].append(group)
-        self.Network['scenarios'].append(self.Scenario)
         log.info("Network created for sending")
 
+        #The resource attribute ids in the data are temporary. Note which
+        #resource attribute each one belongs to, to find its real id
+        #once the network has been saved.
+        res_attr_keys = get_resource_attr_keys(self.Network)
+
+        base_scenario = None
+        if self.incremental:
+            base_scenario = self.get_base_scenario()
+
+        if base_scenario is not None:
+            self.commit_incremental(res_attr_keys, base_scenario)
+        elif self.batch_size is not None or self.batch_bytes is not None:
+            self.commit_in_batches(res_attr_keys)
+        else:
+            self.Network['scenarios'].append(self.Scenario)
+            self.save_network()
+
+            if self.manifest is not None:
+                id_map = self.get_saved_resource_attr_ids(res_attr_keys)
+                self.save_manifest(self.get_saved_scenario_id(),
+                                   [(id_map.get(rs['resource_attr_id']), rs['dataset'])
+                                    for rs in self.Scenario['resourcescenarios']])
+
+    def save_network(self):
+        with self.profiler.stage('to_wire'):
+            network = JSONObject(to_wire(self.Network))
+
         if self.update_network_flag:
-            self.NetworkSummary = self.connection.update_network(network=JSONObject(self.Network))
+            with self.profiler.stage('update_network'):
+                self.NetworkSummary = self.connection.update_network(network=network)
             log.info("Network %s updated.", self.Network['id'])
         else:
             log.info("Adding Network")
-            self.NetworkSummary = self.connection.add_network(network=JSONObject(self.Network))
+            with self.profiler.stage('add_network'):
+                self.NetworkSummary = self.connection.add_network(network=network)
             log.info("Network created with %s nodes and %s links. Network ID is %s",
                      len(self.NetworkSummary['nodes']),
                      len(self.NetworkSummary['links']),
@@ -1151,6 +1109,244 @@ class ImportCSV(object):
 
         self.message = 'Data import was successful.'
 
+    def get_saved_scenario_id(self):
+        for s in self.NetworkSummary['scenarios']:
+            if s['name'] == self.Scenario['name']:
+                return s['id']
+        raise HydraPluginError("Scenario %s not found in the saved network."%(self.Scenario['name']))
+
+    def get_saved_resource_attr_ids(self, res_attr_keys):
+        """
+            Map the ids of the resource attributes sent to the server
+            to the ids they have in the saved network.
+        """
+        res_attr_ids = get_resource_attr_ids(self.NetworkSummary)
+        if any(key not in res_attr_ids for key in res_attr_keys.values()):
+            #The network returned by the server does not include
+            #the resource attributes, so get them.
+            network = self.connection.get_network(network_id=self.NetworkSummary['id'],
+                                                  include_data='N',
+                                                  summary='N')
+            res_attr_ids = get_resource_attr_ids(network)
+
+        return dict((ra_id, res_attr_ids.get(key)) for ra_id, key in res_attr_keys.items())
+
+    def commit_in_batches(self, res_attr_keys):
+        """
+            Save the network with an empty scenario and then upload the
+            data in the scenario in batches, limited by batch_size and
+            batch_bytes.
+        """
+        resource_scenarios = self.Scenario['resourcescenarios']
+
+        self.Scenario['resourcescenarios'] = []
+        self.Network['scenarios'].append(self.Scenario)
+        self.save_network()
+        self.Scenario['resourcescenarios'] = resource_scenarios
+
+        if len(resource_scenarios) == 0:
+            return
+
+        scenario_id = self.get_saved_scenario_id()
+
+        map_resource_attr_ids(resource_scenarios, self.get_saved_resource_attr_ids(res_attr_keys))
+
+        self.upload_data(scenario_id, resource_scenarios)
+
+        if self.manifest is not None:
+            self.save_manifest(scenario_id,
+                               [(rs['resource_attr_id'], rs['dataset']) for rs in resource_scenarios])
+
+    def get_base_scenario(self):
+        """
+            Find the scenario an incremental import is based on: the one in
+            the manifest, if it is still in the network, or else the most
+            recent scenario in the network.
+            Returns (scenario id, hashes of its datasets or None), or None if
+            the network being updated has no scenarios.
+        """
+        if len(self.base_scenario_ids) == 0:
+            return None
+
+        manifest = read_manifest(self.manifest)
+        if manifest is not None:
+            network_id, scenario_id, hashes = manifest
+            if network_id == self.Network['id'] and scenario_id in self.base_scenario_ids:
+                return scenario_id, hashes
+            log.info("Manifest %s is for another network or scenario. Ignoring it.", self.manifest)
+
+        return max(self.base_scenario_ids), None
+
+    def get_saved_group_items(self):
+        """
+            The group members read from the group member files, with the
+            temporary ids of new groups and members replaced by the ids
+            they have in the saved network.
+        """
+        items = self.Scenario.get('resourcegroupitems') or []
+        if all(item['group_id'] > 0 and item['ref_id'] > 0 for item in items):
+            return items
+
+        names = {}
+        for kind, key in resource_keys:
+            for resource in self.Network[key]:
+                names[(kind, resource['id'])] = resource['name']
+
+        network = self.NetworkSummary
+        if network.get('resourcegroups') is None:
+            network = self.connection.get_network(network_id=network['id'],
+                                                  include_data='N',
+                                                  summary='N')
+        ids = {}
+        for kind, key in resource_keys:
+            for resource in network.get(key) or []:
+                ids[(kind, resource['name'])] = resource['id']
+
+        def get_saved_id(kind, resource_id):
+            if resource_id > 0:
+                return resource_id
+            return ids[(kind, names[(kind, resource_id)])]
+
+        return [dict(group_id = get_saved_id('GROUP', item['group_id']),
+                     ref_key  = item['ref_key'],
+                     ref_id   = get_saved_id(item['ref_key'], item['ref_id']))
+                for item in items]
+
+    def update_incremental_scenario(self, scenario_id, base_scenario):
+        """
+            Make the group members and times of a copy of the base scenario
+            the same as those read from the files.
+        """
+        group_items = self.get_saved_group_items()
+        if get_group_item_keys(group_items) != \
+           get_group_item_keys(base_scenario.get('resourcegroupitems') or []):
+            log.info("Group members have changed since scenario %s. Replacing them.",
+                     base_scenario['id'])
+            #The copy's group items have ids of their own
+            scenario = self.connection.get_scenario(scenario_id=scenario_id,
+                                                    include_data=False)
+            item_ids = [item['id'] for item in scenario.get('resourcegroupitems') or []]
+            if len(item_ids) > 0:
+                self.connection.delete_resourcegroupitems(scenario_id=scenario_id,
+                                                          item_ids=item_ids)
+            if len(group_items) > 0:
+                self.connection.add_resourcegroupitems(scenario_id=scenario_id,
+                                                       items=group_items)
+
+        time_keys = ('start_time', 'end_time', 'time_step')
+        if any(str(base_scenario.get(k)) != str(self.Scenario.get(k)) for k in time_keys):
+            log.info("Times have changed since scenario %s. Updating them.",
+                     base_scenario['id'])
+            scenario = dict(id          = scenario_id,
+                            name        = self.Scenario['name'],
+                            description = self.Scenario['description'])
+            for k in time_keys:
+                scenario[k] = self.Scenario.get(k)
+            self.connection.update_scenario(scenario=scenario,
+                                            update_data=False,
+                                            update_groups=False)
+
+    def commit_incremental(self, res_attr_keys, base_scenario):
+        """
+            Save the changes to the network, then copy the base scenario on
+            the server and bring the copy up to date, so that it is the same
+            as the scenario a full import would create: upload the datasets
+            which are new or differ from those in the base scenario, remove
+            those which are no longer in the files and replace the group
+            members and times if they have changed.
+            base_scenario is the result of get_base_scenario.
+        """
+        base_scenario_id, base_hashes = base_scenario
+
+        #Its data is only needed if there is no manifest to compare with
+        log.info("Getting scenario %s", base_scenario_id)
+        base_scenario = self.connection.get_scenario(scenario_id=base_scenario_id,
+                                                     include_data=base_hashes is None)
+        if base_hashes is None:
+            base_hashes = get_scenario_hashes(base_scenario)
+
+        #Only the topology is saved. The scenario is a copy
+        #of the base scenario.
+        resource_scenarios = self.Scenario['resourcescenarios']
+        self.save_network()
+
+        map_resource_attr_ids(resource_scenarios, self.get_saved_resource_attr_ids(res_attr_keys))
+
+        hashes = {}
+        changed = []
+        for rs in resource_scenarios:
+            dataset_hash = get_dataset_hash(rs['dataset'])
+            hashes[rs['resource_attr_id']] = dataset_hash
+            if base_hashes.get(rs['resource_attr_id']) != dataset_hash:
+                changed.append(rs)
+
+        removed = [ra_id for ra_id in base_hashes if ra_id not in hashes]
+
+        log.info("%s of %s datasets have changed and %s have been removed since scenario %s",
+                 len(changed), len(resource_scenarios), len(removed), base_scenario_id)
+
+        scenario = self.connection.clone_scenario(scenario_id=base_scenario_id,
+                                                  scenario_name=self.Scenario['name'])
+        self.NetworkSummary.setdefault('scenarios', []).append(scenario)
+
+        if len(removed) > 0:
+            self.connection.delete_resource_scenarios(scenario_id=scenario['id'],
+                                                      resource_attr_ids=removed,
+                                                      quiet=True)
+
+        self.update_incremental_scenario(scenario['id'], base_scenario)
+
+        if len(changed) > 0:
+            self.upload_data(scenario['id'], changed)
+
+        if self.manifest is not None:
+            self.save_manifest(scenario['id'], hashes=hashes)
+
+        self.message = ("%s Copied scenario %s, uploaded %s new or changed "
+                        "datasets of %s and removed %s."%(self.message,
+                                                         base_scenario_id,
+                                                         len(changed),
+                                                         len(resource_scenarios),
+                                                         len(removed)))
+
+    def upload_data(self, scenario_id, resource_scenarios):
+        #Only a remote server can take several requests at once
+        max_in_flight = 1
+        connect = None
+        if isinstance(self.connection, RemoteJSONConnection):
+            max_in_flight = self.upload_threads
+            connect = self.connect_upload_thread
+
+        uploader = DataUploader(self.connection,
+                                scenario_id,
+                                batch_size=self.batch_size,
+                                batch_bytes=self.batch_bytes,
+                                max_in_flight=max_in_flight,
+                                retries=self.upload_retries,
+                                connect=connect)
+        with self.profiler.stage('upload_data') as stage:
+            uploader.upload(resource_scenarios)
+            stage.count('datasets', len(resource_scenarios))
+
+        self.message = "%s %s"%(self.message, uploader.get_summary())
+
+    def connect_upload_thread(self):
+        """
+            Make a connection to the server for an upload thread, in the
+            same session as the main connection.
+        """
+        return RemoteJSONConnection(self.url, session_id=self.connection.session_id)
+
+    def save_manifest(self, scenario_id, datasets=None, hashes=None):
+        """
+            Write the hashes of the datasets in the imported scenario to the
+            manifest file, for the next incremental import. datasets is a
+            list of (resource attribute id, dataset).
+        """
+        if hashes is None:
+            hashes = dict((ra_id, get_dataset_hash(dataset)) for ra_id, dataset in datasets)
+        write_manifest(self.manifest, self.NetworkSummary['id'], scenario_id, hashes)
+
     def return_xml(self):
         """This is a fist version of a possible XML output.
         """
@@ -1208,13 +1404,111 @@ def commandline_parser():
     parser.add_argument('-c', '--session_id',
                         help='''Session ID. If this does not exist, a login will be
                         attempted based on details in config.''')
+    parser.add_argument('--incremental', action='store_true',
+                        help='''When updating a network (see -i), copy its most
+                        recent scenario and upload only the values which
+                        have changed, rather than all of them.''')
+    parser.add_argument('--manifest',
+                        help='''A file in which to keep a record of the
+                        imported values. An incremental import compares
+                        against the scenario recorded in this file.''')
+    parser.add_argument('--batch-size', type=int,
+                        help='''Save the network first and then upload its
+                        data in batches of at most this many values, rather
+                        than all at once.''')
+    parser.add_argument('--batch-bytes', type=int,
+                        help='''Save the network first and then upload its
+                        data in batches of roughly this many bytes, rather
+                        than all at once.''')
+    parser.add_argument('--upload-threads', type=int, default=4,
+                        help='''The number of batches uploaded at once to a
+                        remote server (see --batch-size). Defaults to 4.''')
+    parser.add_argument('--upload-retries', type=int, default=3,
+                        help='''The number of times a batch is retried after
+                        a connection error. Defaults to 3.''')
+    parser.add_argument('--cache', action='store_true',
+                        help='''Keep the contents of timeseries and array files
+                        between runs, so that files which have not changed
+                        are not parsed again. See --cache-dir.''')
+    parser.add_argument('--cache-dir',
+                        help='''The directory in which to keep the contents of
+                        timeseries and array files. Implies --cache. Defaults
+                        to ~/.cache/hydra-csv.''')
+    parser.add_argument('--cache-size', type=int, default=500,
+                        help='''The most space, in MB, the cache may use.
+                        The least recently used files are removed to stay
+                        within it. Defaults to 500.''')
+    parser.add_argument('--io-threads', type=int, default=4,
+                        help='''The number of threads used to read timeseries
+                        and array files in the background when expanding
+                        file names (see -x). Defaults to 4. Set to 0 to read
+                        each file when it is first needed.''')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='''The number of processes used to read the node,
+                        link and group files. Defaults to 1, which reads the
+                        files one after another in the main process.''')
+    parser.add_argument('--fake-server', nargs='?', const='',
+                        help='''Import into an in-memory stand-in for a Hydra
+                        server rather than a real one, for testing and
+                        benchmarking. If a file is given, what is imported
+                        is saved to it and loaded again on the next run.''')
+    parser.add_argument('--fake-latency', type=float, default=0.0,
+                        help='''The time, in seconds, which every call to the
+                        fake server (see --fake-server) takes. Defaults to 0.''')
+    parser.add_argument('--fake-bandwidth', type=float,
+                        help='''The rate, in MB/s, at which requests to and
+                        responses from the fake server (see --fake-server) are
+                        sent. By default they take no time.''')
+    parser.add_argument('--profile', nargs='?', const='',
+                        help='''Record the time, CPU time and memory taken by
+                        each stage of the import and each file read, and save
+                        them to this JSON file. Defaults to import_profile.json
+                        next to the network file. A summary is added to the
+                        message of the import.''')
+    parser.add_argument('--profile-stats',
+                        help='''Also profile the import with cProfile and save
+                        the statistics to this file, to be read with pstats.
+                        Implies --profile.''')
     return parser
 
 
+def get_fake_connection(args):
+    """
+        The fake server asked for on the command line, if any.
+    """
+    if args.fake_server is None:
+        return None
+
+    bandwidth = None
+    if args.fake_bandwidth:
+        bandwidth = args.fake_bandwidth*1024*1024
+    return FakeConnection(state_file=args.fake_server or None,
+                          latency=args.fake_latency,
+                          bandwidth=bandwidth)
+
+
+def get_profile_file(args):
+    """
+        The file to save the profile of the import to, if there is one.
+    """
+    if args.profile:
+        return args.profile
+    elif args.profile is not None or args.profile_stats is not None:
+        return os.path.join(os.path.dirname(args.network or ''), 'import_profile.json')
+    return None
+
+
 def run():
     parser = commandline_parser()
     args = parser.parse_args()
-    csv = ImportCSV(url=args.server_url, session_id=args.session_id)
+
+    profile_file = get_profile_file(args)
+    profiler = Profiler(enabled=profile_file is not None, stats_file=args.profile_stats)
+    with profiler.stage('connect'):
+        csv = ImportCSV(url=args.server_url,
+                        session_id=args.session_id,
+                        connection=get_fake_connection(args))
+    csv.profiler = profiler
 
     network_id = None
     scen_ids = []
@@ -1230,24 +1524,51 @@ def run():
         if args.timezone is not None:
             csv.timezone = pytz.timezone(args.timezone)
 
+        csv.incremental = args.incremental
+        csv.manifest    = args.manifest
+        if args.incremental and args.network_id is None:
+            csv.warnings.append("No network specified to update. Importing all the data.")
+
+        csv.batch_size  = args.batch_size
+        csv.batch_bytes = args.batch_bytes
+        csv.upload_threads = args.upload_threads
+        csv.upload_retries = args.upload_retries
+
         # Create project and network only when there is actual data to
         # import.
         write_progress(2,csv.num_steps)
-        csv.create_project(ID=args.project, network_id=args.network_id)
-        csv.create_scenario(name=args.scenario)
-        csv.create_network(file=args.network, network_id=args.network_id)
+        with profiler.stage('create_project'):
+            csv.create_project(ID=args.project, network_id=args.network_id)
+            csv.create_scenario(name=args.scenario)
+        if csv.expand_filenames and (args.cache or args.cache_dir is not None):
+            csv.set_cache(args.cache_dir or default_cache_dir, args.cache_size*1024*1024)
+
+        if csv.expand_filenames and args.io_threads > 0:
+            csv.prefetcher = FilePrefetcher(args.io_threads)
+
+        with profiler.stage('read_network', args.network):
+            csv.create_network(file=args.network, network_id=args.network_id)
+
+        #Files read by worker processes are expanded there,
+        #so there is nothing to prefetch in this process.
+        if args.workers > 1:
+            csv.schedule_files(args.workers)
+        elif csv.prefetcher is not None:
+            csv.prefetch_files()
 
         write_progress(3,csv.num_steps)
         for nodefile in csv.node_args:
             write_output("Reading Node file %s" % nodefile)
-            csv.read_nodes(nodefile)
+            with profiler.stage('read_nodes', nodefile, counter=csv.count_items):
+                csv.read_nodes(nodefile)
             log.info("Finished reading nodes")
 
         write_progress(4,csv.num_steps)
         if len(csv.link_args) > 0:
             for linkfile in csv.link_args:
                 write_output("Reading Link file %s" % linkfile)
-                csv.read_links(linkfile)
+                with profiler.stage('read_links', linkfile, counter=csv.count_items):
+                    csv.read_links(linkfile)
                 log.info("Finished reading links")
         else:
             log.warn("No link files found")
@@ -1257,24 +1578,39 @@ def run():
         if len(csv.group_args) > 0:
             for groupfile in csv.group_args:
                 write_output("Reading Group file %s"% groupfile)
-                csv.read_groups(groupfile)
+                with profiler.stage('read_groups', groupfile, counter=csv.count_items):
+                    csv.read_groups(groupfile)
                 log.info("Finished reading groups")
         else:
             log.warn("No group files specified.")
             csv.warnings.append("No group files specified.")
 
+        if csv.scheduler is not None:
+            csv.scheduler.shutdown()
+
+        if csv.prefetcher is not None:
+            log.info(csv.prefetcher.get_summary())
+            csv.prefetcher.shutdown()
+
         write_progress(6,csv.num_steps)
         if len(csv.groupmember_args) > 0:
             write_output("Reading Group Members")
             for groupmemberfile in csv.groupmember_args:
-                csv.read_group_members(groupmemberfile)
+                with profiler.stage('read_group_members', groupmemberfile):
+                    csv.read_group_members(groupmemberfile)
         else:
             log.warn("No group member files specified.")
             csv.warnings.append("No group member files specified.")
 
         write_progress(7,csv.num_steps)
         write_output("Saving network")
-        csv.commit()
+        with profiler.stage('commit'):
+            csv.commit()
+        if csv.prefetcher is not None:
+            csv.message = "%s %s"%(csv.message, csv.prefetcher.get_summary())
+        if csv.cache is not None:
+            csv.message = "%s %s"%(csv.message, csv.cache.get_summary())
+        csv.message = "%s %s"%(csv.message, csv.dataset_pool.get_summary())
         if csv.NetworkSummary.get('scenarios') is not None:
             scen_ids = [s['id'] for s in csv.NetworkSummary['scenarios']]
 
@@ -1288,7 +1624,8 @@ def run():
 
             rule_reader = RuleReader(csv.connection, scenario_id, csv.NetworkSummary, csv.rule_args)
 
-            rule_reader.read_rules()
+            with profiler.stage('read_rules'):
+                rule_reader.read_rules()
 
         network_id = csv.NetworkSummary['id']
 
@@ -1299,7 +1636,8 @@ def run():
         else:
             csv.template_id = args.template
             try:
-                warnings = csv.set_resource_types()
+                with profiler.stage('set_resource_types'):
+                    warnings = csv.set_resource_types()
                 csv.warnings.extend(warnings)
             except Exception as e:
                 raise HydraPluginError("An error occurred setting the types from the template. "
@@ -1307,6 +1645,9 @@ def run():
                                        "Please check the template and resource types."%(e.message))
         write_progress(9,csv.num_steps)
 
+        if isinstance(csv.connection, FakeConnection):
+            csv.message = "%s %s"%(csv.message, csv.connection.get_summary())
+
     except HydraPluginError as e:
         if len(errors) == 0:
             errors = [e.message]
@@ -1314,6 +1655,23 @@ def run():
     except Exception as e:
         log.exception(e)
         errors = [e]
+    finally:
+        if csv.scheduler is not None:
+            csv.scheduler.shutdown()
+        if csv.prefetcher is not None:
+            csv.prefetcher.shutdown()
+        if isinstance(csv.connection, FakeConnection):
+            csv.connection.close()
+
+    if profile_file is not None:
+        profiler.stop()
+        csv.message = "%s %s"%(csv.message, profiler.get_summary())
+        try:
+            profiler.save(profile_file)
+            csv.files.append(profile_file)
+        except IOError as e:
+            log.exception(e)
+            csv.warnings.append("Unable to save the profile to %s: %s"%(profile_file, e))
 
     xml_response = create_xml_response('ImportCSV',
                                        network_id,
@@ -1326,4 +1684,6 @@ def run():
     print(xml_response)
 
 if __name__ == '__main__':
+    #Needed for the worker processes when running as a frozen executable
+    multiprocessing.freeze_support()
     run()
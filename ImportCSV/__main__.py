@@ -1,2 +1,7 @@
+import multiprocessing
 import ImportCSV
-ImportCSV.run()
+
+if __name__ == '__main__':
+    #Needed for the worker processes when running as a frozen executable
+    multiprocessing.freeze_support()
+    ImportCSV.run()
@@ -0,0 +1,244 @@
+# (c) Copyright 2013, 2014,2015 University of Manchester
+#
+# ImportCSV is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImportCSV is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with ImportCSV.  If not, see <http://www.gnu.org/licenses/>
+#
+
+import os
+import json
+import hashlib
+import logging
+
+import numpy as np
+
+from data import DataFile, FileSchema
+
+log = logging.getLogger(__name__)
+
+#Change this when the format of the entries changes, so old ones are ignored.
+CACHE_VERSION = 3
+
+default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'hydra-csv')
+
+def get_file_hash(full_file_path):
+    file_hash = hashlib.sha1()
+    with open(full_file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+class ParseCache(object):
+    """
+        Keeps the contents of timeseries and array files on disk once they
+        have been read and parsed (see data.DataFile), so that files which
+        have not changed since the last import do not need to be parsed again.
+
+        There is one .npz file per data file. An entry is only used if the
+        absolute path, size and modification time of the data file match
+        those stored with it, as well as the seasonal key used to parse its
+        timeseries. The file is not read at all in that case. If only the
+        modification time differs, the content hash stored with the entry
+        decides whether the file has changed. When the entries take up more
+        than max_size bytes, the least recently used ones are removed.
+    """
+    def __init__(self, cache_dir=default_cache_dir, max_size=500*1024*1024):
+        self.cache_dir = cache_dir
+        self.max_size  = max_size
+        self.hits      = 0
+        self.misses    = 0
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def get_entry_path(self, full_file_path):
+        name = hashlib.sha1(full_file_path.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, "%s.npz"%(name,))
+
+    def get_key(self, full_file_path, seasonal_key, file_hash=None):
+        stat = os.stat(full_file_path)
+        if file_hash is None:
+            file_hash = get_file_hash(full_file_path)
+        return json.dumps([CACHE_VERSION,
+                           full_file_path,
+                           stat.st_size,
+                           stat.st_mtime_ns,
+                           file_hash,
+                           seasonal_key])
+
+    def get(self, full_file_path, seasonal_key):
+        """
+            Get the DataFile for a file from the cache.
+            Returns None if it is not there or the file has changed.
+        """
+        full_file_path = os.path.abspath(full_file_path)
+        #Not a file at all, so the value will be treated as a descriptor.
+        if not os.path.isfile(full_file_path):
+            return None
+
+        entry_path = self.get_entry_path(full_file_path)
+        if not os.path.isfile(entry_path):
+            self.misses += 1
+            return None
+
+        try:
+            with np.load(entry_path, allow_pickle=False) as entry:
+                stored_key = json.loads(str(entry['key'][0]))
+                stat = os.stat(full_file_path)
+                if stored_key[:3] != [CACHE_VERSION, full_file_path, stat.st_size] or \
+                   stored_key[5] != seasonal_key:
+                    self.misses += 1
+                    return None
+                #The file has been touched. Only read it to
+                #check whether its contents have changed.
+                touched = stored_key[3] != stat.st_mtime_ns
+                if touched and stored_key[4] != get_file_hash(full_file_path):
+                    self.misses += 1
+                    return None
+                datafile = self.load_entry(entry)
+        except Exception as e:
+            log.info("Unable to use cache entry for %s: %s", full_file_path, e)
+            self.misses += 1
+            return None
+
+        if touched:
+            #Record the new modification time, so the
+            #file is not hashed again next time.
+            self.put(full_file_path, seasonal_key, datafile, file_hash=stored_key[4])
+        else:
+            #Mark the entry as recently used
+            os.utime(entry_path, None)
+        self.hits += 1
+        log.info("Using cached contents of %s", full_file_path)
+        return datafile
+
+    def put(self, full_file_path, seasonal_key, datafile, file_hash=None):
+        full_file_path = os.path.abspath(full_file_path)
+        entry_path = self.get_entry_path(full_file_path)
+        try:
+            arrays = self.dump_entry(datafile)
+            arrays['key'] = np.array([self.get_key(full_file_path, seasonal_key, file_hash)])
+
+            #Write to a temporary file first so that a half
+            #written entry is never read.
+            tmp_path = "%s.%s.tmp"%(entry_path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp_path, entry_path)
+        except Exception as e:
+            log.info("Unable to cache the contents of %s: %s", full_file_path, e)
+            return
+
+        self.evict()
+
+    def dump_entry(self, datafile):
+        """
+            Flatten the contents of a DataFile into arrays of strings and
+            integers, which can be saved without pickling.
+        """
+        names = list(datafile.index.keys())
+        lines = [l for name in names for l in datafile.index[name]]
+
+        arrays = dict(
+            header       = np.array(datafile.header or [], dtype=str),
+            names        = np.array(names, dtype=str),
+            line_counts  = np.array([len(datafile.index[name]) for name in names], dtype=np.int64),
+            line_lengths = np.array([len(l) for l in lines], dtype=np.int64),
+            cells        = np.array([c for l in lines for c in l], dtype=str),
+            schema       = np.array([json.dumps(datafile.get_schema().as_dict())]),
+        )
+
+        if datafile.timeseries is not None:
+            ts_names = list(datafile.timeseries.keys())
+            ts = [datafile.timeseries[name] for name in ts_names]
+            arrays.update(
+                ts_names  = np.array(ts_names, dtype=str),
+                ts_times  = np.array([t for times, _ in ts for t in times], dtype=str),
+                ts_ndims  = np.array([block.ndim for _, block in ts], dtype=np.int64),
+                ts_shape  = np.array([d for _, block in ts for d in block.shape], dtype=np.int64),
+                ts_values = np.array([v for _, block in ts for v in block.ravel().tolist()], dtype=str),
+            )
+
+        return arrays
+
+    def load_entry(self, entry):
+        cells = entry['cells'].tolist()
+        line_lengths = entry['line_lengths'].tolist()
+
+        index = {}
+        cell_pos = 0
+        line_pos = 0
+        for name, count in zip(entry['names'].tolist(), entry['line_counts'].tolist()):
+            lines = []
+            for length in line_lengths[line_pos:line_pos + count]:
+                lines.append(cells[cell_pos:cell_pos + length])
+                cell_pos += length
+            line_pos += count
+            index[name] = lines
+
+        datafile = DataFile(entry['header'].tolist(), index)
+
+        schema = json.loads(str(entry['schema'][0]))
+        if schema['shape'] is not None:
+            schema['shape'] = tuple(schema['shape'])
+        datafile.schema = FileSchema(**schema)
+
+        if 'ts_names' in entry.files:
+            timeseries = {}
+            ts_times = entry['ts_times'].tolist()
+            ts_values = entry['ts_values']
+            shapes = entry['ts_shape'].tolist()
+            time_pos = 0
+            value_pos = 0
+            shape_pos = 0
+            for name, ndim in zip(entry['ts_names'].tolist(), entry['ts_ndims'].tolist()):
+                shape = tuple(shapes[shape_pos:shape_pos + ndim])
+                shape_pos += ndim
+                size = int(np.prod(shape))
+                block = ts_values[value_pos:value_pos + size].reshape(shape)
+                value_pos += size
+                timeseries[name] = (ts_times[time_pos:time_pos + shape[0]], block)
+                time_pos += shape[0]
+            datafile.timeseries = timeseries
+
+        return datafile
+
+    def evict(self):
+        """
+            Remove the least recently used entries until the
+            cache is within its size budget.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npz'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                log.info("Removed %s from the cache", path)
+            except OSError:
+                pass
+
+    def get_summary(self):
+        return "Parse cache: %s hit(s), %s miss(es)."%(self.hits, self.misses)
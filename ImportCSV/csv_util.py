@@ -18,6 +18,7 @@ import os
 import logging
 import json
 import re
+import itertools
 
 
 from hydra_base.exceptions import HydraPluginError, HydraError
@@ -28,50 +29,86 @@ from dateutil.relativedelta import relativedelta
 log = logging.getLogger(__name__)
 
 
-def get_file_data(file):
+#Whitespace around delimiters
+delimiter_re = re.compile(' *, *')
+non_ascii_re = re.compile('[^\x00-\x7f]')
+
+def iter_file_data(file):
     """
-        Taking a csv file as an argument,
-        return an array where each element is a line in the csv.
+        Taking a csv file as an argument, yield the lines in the csv one at
+        a time. Whitespace around delimiters is removed, comments and empty
+        lines are skipped and non-ascii characters are replaced with spaces.
+        Only one line of the file is held in memory at a time.
     """
-    file_data=None
     if file == None:
         log.warn("No file specified")
-        return None
+        return
 
     file = os.path.realpath(file)
 
     log.info("Reading file data from: %s", file)
 
     with open(file, mode='r') as csv_file:
+        line_num = 0
+        try:
+            for line in csv_file:
+                line_num += 1
+                line = delimiter_re.sub(',', line).strip()
+
+                # Ignore comments
+                if len(line) == 0 or line[0] == '#':
+                    continue
+
+                if not line.isascii():
+                    line = non_ascii_re.sub(' ', line)
 
-        raw_file_data = csv_file.read()
-        file_data = re.sub(' *, *', ',', raw_file_data)
-        file_data = file_data.split('\n')
-        if len(file_data) == 0:
+                yield line
+        except UnicodeDecodeError:
+            #The line after the last one read successfully has
+            #characters which cannot be decoded.
+            raise HydraPluginError("Line %s in %s contains characters which "
+                                   "cannot be read."%(line_num+1, file))
+
+        if line_num == 0:
             log.warn("File contains no data")
 
-    new_file_data = []
-    bad_lines = []
-    for i, line in enumerate(file_data):
-        line = line.strip()
+def get_file_data(file):
+    """
+        Taking a csv file as an argument,
+        return an array where each element is a line in the csv.
+    """
+    if file == None:
+        log.warn("No file specified")
+        return None
 
-        # Ignore comments
-        if len(line) == 0 or line[0] == '#':
-            continue
-        try:
-            line = ''.join([x if ord(x) < 128 else ' ' for x in line])
-            new_file_data.append(line)
-        except UnicodeDecodeError as e:
-            #If there are unknown characters in this line, save the line
-            #and the column in the line where the bad character has occurred.
-            bad_lines.append((i+1, e.start))
+    return list(iter_file_data(file))
 
-    #Complain about the lines that the bad characters are on.
-    if len(bad_lines) > 0:
-        lines = [a[0] for a in bad_lines]
-        raise HydraPluginError("Lines %s, in %s contain non ascii characters"%(lines, file))
+def split_header(file, file_data):
+    """
+        Separate the heading line and the optional units line from the
+        data lines of a file. file_data may be a list of lines or a generator
+        from iter_file_data, in which case the data lines are still read lazily.
+        Returns the heading line, the list of units (None if there is no units
+        line) and an iterator over the remaining lines.
+    """
+    lines = iter(file_data)
 
-    return new_file_data
+    header = next(lines, None)
+    if header is None:
+        raise HydraPluginError("File %s is empty"%(file))
+
+    first_line = next(lines, None)
+    if first_line is None:
+        return header, None, iter([])
+
+    if first_line.lower().startswith('unit'):
+        units = [unit.strip() for unit in first_line.split(',')]
+        #The first cell marks the units line, so is not the unit of the
+        #first column.
+        units[0] = ''
+        return header, units, lines
+
+    return header, None, itertools.chain([first_line], lines)
 
 def check_header(file, header):
     """
@@ -97,6 +134,91 @@ def check_header(file, header):
         raise HydraPluginError("Malformed Header in file %s: Duplicate columns: %s"%
                                (file , dupe_headings))
 
+def get_field_idx(keys, field_idx):
+    """
+        Find the columns of the mandatory fields (name, description etc) in
+        the heading of a node, link or group file. field_idx maps each
+        mandatory field to the column where we expect to see it and is
+        updated with the columns actually found.
+        Returns a dictionary of column index -> attribute name for every
+        other column.
+    """
+    attrs = dict()
+    for i, key in enumerate(keys):
+        if key.lower().strip() in field_idx:
+            field_idx[key.lower().strip()] = i
+        else:
+            attrs.update({i: key.strip()})
+    return attrs
+
+def read_metadata(basepath, filename):
+    log.info("Reading metadata from file %s", filename)
+    metadata = iter_file_data(os.path.join(basepath, filename))
+    keys = next(metadata, '').split(',')
+    check_header(filename, keys)
+    data = metadata
+
+    metadata_dict = {}
+    for line_num, data_line in enumerate(data):
+        try:
+            data_line = data_line.replace('\r', '')
+            split_data = data_line.split(',')
+            metadata_dict[split_data[0].strip()] = get_metadata_as_dict(keys[1:], split_data[1:])
+        except Exception as e:
+            raise HydraPluginError("Malformed metadata for %s, line %s of %s"%(e.message, line_num+2, filename))
+    return metadata_dict
+
+def read_resource_metadata(basepath, file):
+    """
+        Read the metadata file which accompanies a node, link or group file.
+        The metadata for nodes.csv is in nodes_metadata.csv.
+        Returns an empty dictionary if there is no metadata file.
+    """
+    try:
+        file_parts = file.split(".")
+        file_base = file_parts[0]
+        file_ext = file_parts[1]
+        new_filename = "%s_metadata.%s"%(file_base, file_ext)
+        return read_metadata(basepath, new_filename)
+    except IOError:
+        log.info("No metadata found for node file %s",file)
+        return {}
+
+def get_metadata_as_dict(keys, metadata):
+    """
+        Turn a list of metadata values into a dictionary structure.
+        @parameter keys to describe the attribte to which this metadata refers
+        @parameter list of metadata. in the structure: ["(key;val) (key;val)", "(key;val) (key;val)",...]
+        @returns dictionary in the format: {attr1 : {key:val, key:val}, attr2: {key:val, key:val}...}
+    """
+    metadata_dict = {}
+    for i, attr in enumerate(keys):
+        try:
+            metadata_dict[attr.strip()] = {}
+            if metadata[i].strip() != '':
+                attr_metadata = metadata[i].split(")")
+                for attr_meta in attr_metadata:
+                    if attr_meta == '':
+                        continue
+                    attr_meta = attr_meta.replace('(', '')
+                    #Check if it's ';' or ':' that is the deliminator..
+                    if attr_meta.find(';') > 0:
+                        keyval = attr_meta.split(';')
+                    else:
+                        keyval = attr_meta.split(':')
+
+                    key = keyval[0].strip()
+                    if key.lower() in ('name', 'dataset_name', 'dataset name'):
+                        key = 'name'
+                    val = keyval[1].strip()
+                    metadata_dict[attr.strip()][key] = val
+        except Exception as e:
+            log.critical(e)
+            log.critical("Make sure the CSV file is formatted correctly.")
+            raise Exception(attr)
+
+    return metadata_dict
+
 def validate_value(value, restriction_dict):
     if restriction_dict is None or restriction_dict == {}:
         return
@@ -119,8 +241,8 @@ def get_scenario_times(dataset):
     """
         Given a timeseries, get the start_time, end_time and time step of a scenario
     """
-    ts = json.loads(dataset['value']['value'])
-    times = sorted(ts[ts.keys()[0]].keys())
+    ts = json.loads(dataset['dataset']['value'])
+    times = sorted(ts[list(ts.keys())[0]].keys())
 
     start_time = get_datetime(times[0])
     second_time = get_datetime(times[1])
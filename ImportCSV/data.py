@@ -18,6 +18,9 @@ import os
 import logging
 import json
 import re
+import ast
+import math
+import functools
 from datetime import datetime
 
 import pytz
@@ -28,16 +31,127 @@ from hydra_base.exceptions import HydraPluginError
 from hydra_base.util import config, hydra_dateutil
 
 from csv_util import validate_value
+from records import Dataset, ResourceScenario
 
 
 global seasonal_key
 seasonal_key = None
 
-global time_formats
-time_formats = {}
+#Where parsed timeseries and array files are kept between runs, if anywhere.
+#See cache.py
+global parse_cache
+parse_cache = None
 
 log = logging.getLogger(__name__)
 
+class ParseContext(object):
+    """
+        The settings needed to create the datasets in a node, link, group
+        or network file. They are kept apart from the ImportCSV object, which
+        holds the connection to the server, so that datasets can also be
+        created in a worker process.
+    """
+    def __init__(self, basepath, expand_filenames, timezone, default_name, unit_ids, template, cache=None):
+        self.basepath         = basepath
+        self.expand_filenames = expand_filenames
+        self.timezone         = timezone
+        self.default_name     = default_name
+        #unit abbreviation -> unit id
+        self.unit_ids         = unit_ids
+        self.template         = template
+        #The parse cache, if there is one
+        self.cache            = cache
+
+class DatasetPool(object):
+    """
+        Keeps a single copy of each distinct dataset. Resources often share
+        values, such as a demand profile used by many nodes, and each time
+        create_dataset reads one it builds a new dataset. Adding datasets to
+        the pool returns the first dataset seen with the same content, so
+        every resource scenario with that value refers to the same dataset.
+        This only saves memory: each resource scenario still carries a copy
+        of its dataset when it is sent to the server.
+
+        The content of a dataset is its type, unit, name, hidden flag,
+        metadata and value, all of which are strings or numbers, so they
+        are used as the key directly rather than being hashed separately.
+    """
+    def __init__(self):
+        self.datasets = {}
+        self.count = 0
+        #The size of the values and metadata of the duplicates
+        self.duplicate_bytes = 0
+
+    def add(self, dataset):
+        self.count += 1
+        key = (dataset['type'],
+               dataset['unit_id'],
+               dataset['name'],
+               dataset['hidden'],
+               dataset['metadata'],
+               dataset['value'])
+
+        existing = self.datasets.get(key)
+        if existing is None:
+            self.datasets[key] = dataset
+            return dataset
+
+        self.duplicate_bytes += len(str(dataset['value'])) + len(dataset['metadata'] or '')
+        return existing
+
+    def get_summary(self):
+        unique = len(self.datasets)
+        ratio = float(self.count) / unique if unique > 0 else 1.0
+        return ("%s datasets, %s of them distinct (%.2f:1). %.1fKB of duplicate "
+                "values are held once in memory. Each is still sent with every "
+                "value that uses it."%(self.count, unique, ratio,
+                                      self.duplicate_bytes / 1024.0))
+
+def create_line_datasets(linedata, attrs, units, resource_name, metadata, restrictions, context, file_dict):
+    """
+        Create a dataset for every value on a line of a node, link, group
+        or network file. Empty cells, variables ('NULL') and '-' have no
+        dataset.
+        Returns a dictionary of column index -> resource scenario. The
+        resource attribute ids in each resource scenario are left empty
+        to be filled in by the caller. If a dataset cannot be created, the
+        exception is stored in its place, to be raised when the value is
+        added to the resource.
+    """
+    datasets = {}
+    for i, attr_name in attrs.items():
+        value = linedata[i].strip()
+        if len(value) == 0 or value in ('NULL', 'I AM NOT A NUMBER! I AM A FREE MAN!', '-'):
+            continue
+
+        try:
+            if metadata:
+                resource_metadata = metadata.get(resource_name, {})
+                dataset_metadata = resource_metadata.get(attr_name, {})
+            else:
+                dataset_metadata = {}
+
+            unit_id = None
+            if units is not None:
+                unit_id = context.unit_ids[units[i]]
+
+            datasets[i] = create_dataset(linedata[i],
+                                         dict(attr_id=None, id=None),
+                                         unit_id,
+                                         resource_name,
+                                         dataset_metadata,
+                                         restrictions.get(attr_name, {}).get('restrictions', {}),
+                                         context.expand_filenames,
+                                         context.basepath,
+                                         file_dict,
+                                         context.default_name,
+                                         context.timezone
+                                        )
+        except Exception as e:
+            datasets[i] = e
+
+    return datasets
+
 def create_dataset(value,
                    resource_attr,
                    unit_id,
@@ -51,11 +165,9 @@ def create_dataset(value,
                    timezone,
                   ):
 
-    resourcescenario = dict()
+    resourcescenario = ResourceScenario()
 
-    global seasonal_key
-    if seasonal_key is None:
-        seasonal_key = config.get('DEFAULT', 'seasonal_key', '9999')
+    get_seasonal_key()
 
     if metadata.get('name'):
         dataset_name = metadata['name']
@@ -64,7 +176,7 @@ def create_dataset(value,
         dataset_name = 'Import CSV data'
 
 
-    dataset          = dict(
+    dataset          = Dataset(
         id=None,
         type=None,
         unit_id=None,
@@ -89,56 +201,45 @@ def create_dataset(value,
         #to a valid file.
         value = value.replace('\\', '/')
         try:
-            filedata = []
             if expand_filenames:
                 full_file_path = os.path.join(basepath, value)
-                if file_dict.get(full_file_path) is None:
-                    with open(full_file_path) as f:
-                        filedata = []
-                        for l in f:
-                            l = re.sub('\s*,\s*', ',', l)
-                            l = re.sub('^ *', '', l)
-                            l = re.sub(' *$', '', l)
-                            l = l.replace('\n', '').replace('\r', '').split(',')
-                            filedata.append(l)
-                        file_dict[full_file_path] = filedata
-                else:
-                    filedata = file_dict[full_file_path]
-
-
+                datafile = get_data_file(full_file_path, file_dict)
 
                 #The name of the resource is how to identify the data for it.
-                #Once this the correct line(s) has been identified, remove the
-                #name from the start of the line
-                data = []
-                for l in filedata:
-
-                    l_resource_name = l[0]
-                    if l_resource_name == resource_name:
-                        data.append(l[1:])
+                #The file index holds the line(s) for each resource, with the
+                #name already removed from the start of each line.
+                data = datafile.get_data(resource_name)
 
-                if len(data) == 0:
+                if data is None:
                     log.info('%s: No data found in file %s' %
                                  (resource_name, value))
                     raise HydraPluginError('%s: No data found in file %s' %
                                          (resource_name, value))
                 else:
-                    if is_timeseries(data):
-                        data_columns = get_data_columns(filedata)
+                    schema = datafile.get_schema()
+                    if schema.is_timeseries(data):
+                        data_columns = schema.columns
+
+                        #Parse every timeseries in the file in one go the first
+                        #time any of them is needed.
+                        if datafile.timeseries is None:
+                            datafile.timeseries = parse_timeseries_file(datafile)
 
                         ts = create_timeseries( data,
                                                 restriction_dict=restriction_dict,
                                                 data_columns=data_columns,
                                                 filename=value,
-                                                timezone=timezone)
+                                                timezone=timezone,
+                                                parsed=datafile.timeseries.get(resource_name),
+                                                schema=schema)
 
                         dataset['type'] = 'timeseries'
                         dataset['value'] = ts
                     else:
                         dataset['type'] = 'array'
-                        if len(filedata) > 0:
+                        if len(data) > 0:
                             try:
-                                dataset['value'] = create_array(data[0], restriction_dict)
+                                dataset['value'] = create_array(data[0], restriction_dict, schema)
                             except Exception as e:
                                 log.exception(e)
                                 raise HydraPluginError("There is a value "
@@ -175,6 +276,196 @@ def create_dataset(value,
 
     return resourcescenario
 
+class DataFile(object):
+    """
+        The contents of an array or timeseries file, indexed by the name
+        of the resource in the first column of each line.
+    """
+
+    def __init__(self, header, index):
+        #The first line of the file, which may contain column descriptors
+        self.header = header
+        #resource name -> list of lines, with the resource name removed
+        self.index = index
+        #resource name -> (timestamps, values), filled in by parse_timeseries_file
+        self.timeseries = None
+        #What the file holds, see infer_schema
+        self.schema = None
+
+    def get_data(self, resource_name):
+        """
+            Return the lines in this file for the given resource, or None
+            if the resource does not appear in the file.
+        """
+        return self.index.get(resource_name)
+
+    def get_schema(self):
+        if self.schema is None:
+            self.schema = infer_schema(self)
+        return self.schema
+
+class FileSchema(object):
+    """
+        What a timeseries or array file holds, worked out once from its
+        first line of data and then used for every resource in the file:
+        the kind of data ('timeseries' or 'array'), the time format of its
+        dates and whether they are seasonal, the column headings given on
+        its first line and the shape of its values.
+
+        first_cell is the date (or, in an array file, the shape) at the
+        start of the first line of data. Resources starting with the same
+        date, or another date in the same format, do not need their time
+        format guessed again.
+    """
+    def __init__(self, kind, columns=None, timeformat=None, seasonal=False, first_cell=None, shape=None):
+        self.kind       = kind
+        self.columns    = columns
+        self.timeformat = timeformat
+        self.seasonal   = seasonal
+        self.first_cell = first_cell
+        self.shape      = shape
+        #shape text -> shape, for the shapes seen in this file
+        self.shapes     = {}
+
+    def as_dict(self):
+        return dict(kind       = self.kind,
+                    columns    = self.columns,
+                    timeformat = self.timeformat,
+                    seasonal   = self.seasonal,
+                    first_cell = self.first_cell,
+                    shape      = self.shape)
+
+    def get_timeformat(self, date):
+        if date == self.first_cell:
+            return self.timeformat
+        if self.timeformat is not None:
+            try:
+                datetime.strptime(date, self.timeformat)
+                return self.timeformat
+            except ValueError:
+                pass
+        return get_timeformat(date)
+
+    def is_timeseries(self, data):
+        """
+            Check whether the data for a resource is a timeseries.
+            See is_timeseries
+        """
+        try:
+            return self.get_timeformat(data[0][0]) is not None
+        except:
+            raise HydraPluginError("Unable to parse timeseries %s"%data)
+
+    def get_shape(self, shape, value_length):
+        """
+            Convert the shape column of a line ('2 3') to a tuple.
+            If it is empty the values are taken to be 1D.
+        """
+        if shape == '':
+            return (value_length,)
+        array_shape = self.shapes.get(shape)
+        if array_shape is None:
+            array_shape = tuple([int(a) for a in shape.split(" ")])
+            self.shapes[shape] = array_shape
+        return array_shape
+
+def infer_schema(datafile):
+    """
+        Work out the FileSchema of a file from its header and first line of data.
+    """
+    columns = None
+    first = None
+    if datafile.header is not None:
+        columns = get_data_columns(datafile.header)
+        for name, lines in datafile.index.items():
+            #Skip the line of column descriptors
+            if columns is not None and name == datafile.header[0]:
+                continue
+            if len(lines) > 0 and len(lines[0]) > 0:
+                first = lines[0]
+            break
+
+    if first is None:
+        return FileSchema('array', columns)
+
+    timeformat = get_timeformat(first[0])
+    if timeformat is None:
+        schema = FileSchema('array', columns, first_cell=first[0])
+        shape_text, values = first[0], first[1:]
+    else:
+        seasonal = 'XXXX' in timeformat or get_seasonal_key() in timeformat
+        schema = FileSchema('timeseries', columns, timeformat, seasonal, first[0])
+        shape_text, values = (first[1], first[2:]) if len(first) > 1 else ('', [])
+
+    try:
+        schema.shape = schema.get_shape(shape_text, len(values))
+    except ValueError:
+        pass
+
+    return schema
+
+def read_data_file(full_file_path):
+    """
+        Read an array or timeseries file and index its lines by resource name,
+        so each resource's data can be found without rescanning the file.
+    """
+    header = None
+    index = {}
+    with open(full_file_path) as f:
+        for l in f:
+            l = re.sub('\s*,\s*', ',', l)
+            l = re.sub('^ *', '', l)
+            l = re.sub(' *$', '', l)
+            l = l.replace('\n', '').replace('\r', '').split(',')
+            if header is None:
+                header = l
+            rows = index.get(l[0])
+            if rows is None:
+                index[l[0]] = [l[1:]]
+            else:
+                rows.append(l[1:])
+
+    return DataFile(header, index)
+
+def set_parse_cache(cache):
+    global parse_cache
+    parse_cache = cache
+
+def load_data_file(full_file_path):
+    """
+        Read and index a file and, if it holds timeseries, parse them,
+        unless the parse cache already holds the result.
+    """
+    if parse_cache is not None:
+        datafile = parse_cache.get(full_file_path, get_seasonal_key())
+        if datafile is not None:
+            return datafile
+
+    datafile = read_data_file(full_file_path)
+
+    if datafile.get_schema().kind == 'timeseries':
+        datafile.timeseries = parse_timeseries_file(datafile)
+
+    if parse_cache is not None:
+        parse_cache.put(full_file_path, get_seasonal_key(), datafile)
+
+    return datafile
+
+def get_data_file(full_file_path, file_dict):
+    """
+        Get the indexed contents of a file from the cache, reading it
+        the first time it is referenced.
+    """
+    datafile = file_dict.get(full_file_path)
+    if datafile is None:
+        datafile = load_data_file(full_file_path)
+        file_dict[full_file_path] = datafile
+    elif not isinstance(datafile, DataFile):
+        #The file is being read in the background. See prefetch.py
+        datafile = datafile.result()
+        file_dict[full_file_path] = datafile
+    return datafile
+
 def create_scalar(value, restriction_dict={}):
     """
         Create a scalar (single numerical value) from CSV data
@@ -191,7 +482,138 @@ def create_descriptor(value, restriction_dict={}):
     descriptor = value
     return descriptor
 
-def create_timeseries(data, restriction_dict={}, data_columns=None, filename="", timezone=pytz.utc):
+def parse_timeseries_file(datafile):
+    """
+        Parse all the timeseries in a file at once. The date column of the
+        whole file is converted in a single vectorized call and each resource's
+        values are reshaped as a block, rather than line by line.
+
+        Returns a dictionary of resource name -> (timestamps, values), where
+        values is an array with one row per timestamp. Resources which cannot
+        be parsed this way (short or irregular lines, unparseable dates,
+        duplicates)
+        are left out, so that create_timeseries falls back to reading their
+        lines individually and reports the error.
+    """
+    schema = datafile.get_schema()
+
+    #Group the resources by time format, as each format needs its own conversion
+    format_groups = {}
+    for resource_name, lines in datafile.index.items():
+        if len(lines) == 0 or len(lines[0]) == 0:
+            continue
+        timeformat = schema.get_timeformat(lines[0][0])
+        if timeformat is None:
+            continue
+        lines = [l for l in lines if len(l) > 0 and l[0] != '#']
+        #A line with no shape or values is left to create_timeseries,
+        #so only this resource fails.
+        if any(len(l) < 2 for l in lines):
+            continue
+        if len(lines) > 0:
+            format_groups.setdefault(timeformat, []).append((resource_name, lines))
+
+    parsed = {}
+    for timeformat, resources in format_groups.items():
+        dates = [l[0] for _, lines in resources for l in lines]
+        try:
+            ts_times, invalid = to_hydra_timestamps(dates, timeformat)
+        except ValueError:
+            continue
+
+        #Find duplicate timestamps within each resource across the whole
+        #column at once. Resources with duplicates are left to
+        #create_timeseries, which reports each one.
+        resource_idx = np.repeat(np.arange(len(resources)),
+                                 [len(lines) for _, lines in resources])
+        duplicated = pd.DataFrame({'resource': resource_idx, 'time': ts_times}).duplicated().values
+
+        offset = 0
+        for resource_name, lines in resources:
+            start, offset = offset, offset + len(lines)
+            if invalid[start:offset].any() or duplicated[start:offset].any():
+                continue
+            resource_times = ts_times[start:offset].tolist()
+
+            #All the lines must share a shape to be reshaped as one block
+            shape = lines[0][1]
+            value_length = len(lines[0]) - 2
+            if any(l[1] != shape or len(l) - 2 != value_length for l in lines):
+                continue
+            try:
+                array_shape = schema.get_shape(shape, value_length)
+                block = np.array([l[2:] for l in lines], dtype=str)
+                block = np.reshape(block, (len(lines),) + array_shape)
+            except ValueError:
+                continue
+
+            parsed[resource_name] = (resource_times, block)
+
+    return parsed
+
+def to_hydra_timestamps(dates, timeformat, timezone=pytz.utc):
+    """
+        Convert a column of dates, all in the given format, to Hydra
+        timestamps ('%Y-%m-%dT%H:%M:%S.%f', with the seasonal key as the
+        year of seasonal dates) in one vectorized operation.
+
+        The dates are local times in the given timezone. A Hydra timestamp
+        is the local time without an offset, which is what localizing each
+        date and passing it to hydra_dateutil.date_to_string produces, so
+        local times are kept as they are, including ambiguous and
+        non-existent ones around daylight saving changes.
+
+        Timeseries in the same file, or in different files, usually share
+        their time axis, so each distinct date is converted once and the
+        conversions of recent time axes are remembered.
+
+        Returns an array of timestamps and an array which is True for
+        each date which could not be converted.
+    """
+    codes, unique = pd.factorize(pd.Series(dates, dtype=object))
+    ts_times, invalid = _convert_time_axis(tuple(unique), timeformat, str(timezone))
+    return ts_times[codes], invalid[codes]
+
+@functools.lru_cache(maxsize=64)
+def _convert_time_axis(dates, timeformat, timezone):
+    times = pd.to_datetime(pd.Series(dates, dtype=object), format=timeformat, errors='coerce')
+
+    invalid = times.isnull().values
+    #Hydra timestamps are what numpy produces for microsecond datetimes.
+    ts_times = np.datetime_as_string(times.values.astype('datetime64[us]'), unit='us')
+
+    seasonal_key = get_seasonal_key()
+    if 'XXXX' in timeformat or seasonal_key in timeformat:
+        ts_times = np.array([seasonal_key + t[4:] for t in ts_times])
+
+    return ts_times, invalid
+
+def get_seasonal_key():
+    """
+        The year used in timestamps of seasonal (yearly recurring) timeseries
+    """
+    global seasonal_key
+    if seasonal_key is None:
+        seasonal_key = config.get('DEFAULT', 'seasonal_key', '9999')
+    return seasonal_key
+
+@functools.lru_cache(maxsize=10000)
+def get_timeformat(date):
+    """
+        Guess the time format of a date, remembering the result for the
+        most recently used dates. Each file keeps the format of its own
+        dates in its FileSchema, so only a limited number are needed here.
+    """
+    return hydra_dateutil.guess_timefmt(date)
+
+def create_timeseries(data, restriction_dict={}, data_columns=None, filename="", timezone=pytz.utc, parsed=None, schema=None):
+    """
+        Create a timeseries from the lines of a file belonging to one resource.
+        If the file has already been parsed by parse_timeseries_file, the
+        (timestamps, values) it produced for this resource can be passed in
+        as 'parsed' to avoid converting the lines again. schema is the
+        FileSchema of the file, if known.
+    """
     if len(data) == 0:
         return None
 
@@ -200,48 +622,96 @@ def create_timeseries(data, restriction_dict={}, data_columns=None, filename="",
     else:
         col_headings =[str(idx) for idx in range(len(data[0][2:]))]
 
-    date = data[0][0]
-    global time_formats
-    timeformat = time_formats.get(date)
-    if timeformat is None:
-        timeformat = hydra_dateutil.guess_timefmt(date)
-        time_formats[date] = timeformat
+    ts_values = {}
+    for col in col_headings:
+        ts_values[col] = {}
+
+    if parsed is not None and parsed[1].shape[1] <= len(col_headings):
+        ts_times, ts_block = parsed
+        for i in range(ts_block.shape[1]):
+            ts_values[col_headings[i]] = dict(zip(ts_times, ts_block[:, i].tolist()))
+    else:
+        if schema is None:
+            schema = FileSchema('timeseries', data_columns)
+        _parse_timeseries_lines(data, ts_values, col_headings, filename, timezone, schema)
+
+    #Only build a DataFrame if there is something to validate against
+    if restriction_dict:
+        validate_value(get_timeseries_frame(ts_values), restriction_dict)
+
+    timeseries = json.dumps(ts_values)
+
+    return timeseries
+
+def get_timeseries_frame(ts_values):
+    """
+        Build the DataFrame used to validate a timeseries directly from its
+        values. As pd.read_json would, the timestamps are converted to dates
+        and the values to numbers where possible.
+    """
+    frame = pd.DataFrame(ts_values)
+
+    try:
+        frame.index = pd.to_datetime(frame.index)
+    except (ValueError, TypeError):
+        #Seasonal timestamps may be out of the range pandas can represent
+        pass
+
+    for col in frame.columns:
+        try:
+            frame[col] = frame[col].astype(np.float64)
+        except (ValueError, TypeError):
+            pass
+
+    return frame
+
+def _parse_timeseries_lines(data, ts_values, col_headings, filename, timezone, schema):
+    """
+        Convert the lines of a single timeseries one at a time, adding the
+        values to ts_values. This handles the timeseries which parse_timeseries_file
+        could not, and raises the appropriate error for malformed lines.
+    """
+    timeformat = schema.get_timeformat(data[0][0])
+    seasonal_key = get_seasonal_key()
 
     seasonal = False
 
     if 'XXXX' in timeformat or seasonal_key in timeformat:
         seasonal = True
 
-    ts_values = {}
-    for col in col_headings:
-        ts_values[col] = {}
-    ts_times = [] # to check for duplicae timestamps in a timeseries.
-    timedata = data
-    for dataset in timedata:
+    timedata = [dataset for dataset in data if len(dataset) > 0 and dataset[0] != '#']
 
-        if len(dataset) == 0 or dataset[0] == '#':
-            continue
+    #Convert all the dates at once. Any which cannot be converted that way
+    #are converted on their own below, which reports the error.
+    try:
+        converted, invalid = to_hydra_timestamps([dataset[0] for dataset in timedata],
+                                                 timeformat,
+                                                 timezone)
+        converted = converted.tolist()
+    except ValueError:
+        converted, invalid = None, None
 
-        tstime = datetime.strptime(dataset[0], timeformat)
-        tstime = timezone.localize(tstime)
+    ts_times = set() # to check for duplicate timestamps in a timeseries.
+    duplicates = []
+    for row, dataset in enumerate(timedata):
 
-        ts_time = hydra_dateutil.date_to_string(tstime, seasonal=seasonal)
+        if converted is not None and not invalid[row]:
+            ts_time = converted[row]
+        else:
+            tstime = datetime.strptime(dataset[0], timeformat)
+            tstime = timezone.localize(tstime)
+
+            ts_time = hydra_dateutil.date_to_string(tstime, seasonal=seasonal)
 
         if ts_time in ts_times:
-            raise HydraPluginError("A duplicate time %s has been found "
-                                   "in %s where the value = %s)"%( ts_time,
-                                                      filename,
-                                                     dataset[2:]))
+            #Keep going, so that every duplicate can be reported at once.
+            duplicates.append((ts_time, dataset[2:]))
+            continue
         else:
-            ts_times.append(ts_time)
+            ts_times.add(ts_time)
 
         value_length = len(dataset[2:])
-        shape = dataset[1]
-        if shape != '':
-            array_shape = tuple([int(a) for a in
-                                 shape.split(" ")])
-        else:
-            array_shape = (value_length,)
+        array_shape = schema.get_shape(dataset[1], value_length)
 
         ts_val_1d = []
         for i in range(value_length):
@@ -259,37 +729,29 @@ def create_timeseries(data, restriction_dict={}, data_columns=None, filename="",
             idx = col_headings[i]
             ts_values[idx][ts_time] = ts_val
 
-    timeseries = json.dumps(ts_values)
-
-    validate_value(pd.read_json(timeseries), restriction_dict)
-
+    if len(duplicates) > 0:
+        raise HydraPluginError("%s duplicate time(s) found in %s: %s"%(
+                                    len(duplicates),
+                                    filename,
+                                    ", ".join(["%s where the value = %s"%(ts_time, value)
+                                               for ts_time, value in duplicates])))
 
-    return timeseries
-
-def create_array(dataset, restriction_dict={}):
+def create_array(dataset, restriction_dict={}, schema=None):
     """
         Create a (multi-dimensional) array from csv data
     """
+    if schema is None:
+        schema = FileSchema('array')
+
     #First column is always the array dimensions
     arr_shape = dataset[0]
     #The actual data is everything after column 0
-    eval_dataset = []
-    for d in dataset[1:]:
-        try:
-            d = eval(d)
-        except:
-            d = str(d)
-        eval_dataset.append(d)
-        #dataset = [eval(d) for d in dataset[1:]]
+    arr = parse_array_values(dataset[1:])
 
     #If the dimensions are not set, we assume the array is 1D
-    if arr_shape != '':
-        array_shape = tuple([int(a) for a in arr_shape.split(" ")])
-    else:
-        array_shape = (len(eval_dataset),)
+    array_shape = schema.get_shape(arr_shape, len(arr))
 
     #Reshape the array back to its correct dimensions
-    arr = np.array(eval_dataset)
     try:
         arr = np.reshape(arr, array_shape)
     except:
@@ -303,19 +765,71 @@ def create_array(dataset, restriction_dict={}):
 
     return arr
 
+def parse_array_values(values):
+    """
+        Convert the cells of an array line to an ndarray without evaluating
+        them. If every cell is numeric the whole line is converted at once
+        to an int or float array. Otherwise each cell is parsed on its own.
+
+        The whole line is only converted at once if every cell is written
+        as the number it converts to, so that nothing is lost: integers
+        too big for int64 stay exact and cells such as '01', which are not
+        python numbers, stay text.
+    """
+    cells = np.array(values, dtype=str)
+    text = np.char.strip(cells)
+    try:
+        arr = cells.astype(np.int64)
+        if (arr.astype(str) == text).all():
+            return arr
+    except (ValueError, OverflowError):
+        pass
+
+    try:
+        arr = cells.astype(np.float64)
+        #'nan' and 'inf' are not python literals, so are kept as text below.
+        #Integers in a line of floats may be written without a decimal point.
+        if np.isfinite(arr).all() and \
+           ((arr.astype(str) == text) | (np.char.mod('%d', arr) == text)).all():
+            return arr
+    except ValueError:
+        pass
+
+    return np.array([parse_array_cell(d) for d in values])
+
+def parse_array_cell(value):
+    """
+        Parse a single array cell. Numbers written as python writes them are
+        converted directly, anything else is parsed as a python literal and
+        if that fails kept as a string.
+    """
+    text = value.strip()
+    try:
+        i = int(value)
+        if str(i) == text:
+            return i
+    except ValueError:
+        pass
+
+    try:
+        f = float(value)
+        if math.isfinite(f) and repr(f) == text:
+            return f
+    except ValueError:
+        pass
+
+    try:
+        return ast.literal_eval(value)
+    except Exception:
+        return str(value)
+
 def is_timeseries(data):
     """
         Check whether a piece of data is a timeseries by trying to guess its
         date format. If that fails, it's not a time series.
     """
     try:
-        date = data[0][0]
-
-        global time_formats
-        timeformat = time_formats.get(date)
-        if timeformat is None:
-            timeformat = hydra_dateutil.guess_timefmt(date)
-            time_formats[date] = timeformat
+        timeformat = get_timeformat(data[0][0])
 
         if timeformat is None:
             return False
@@ -324,12 +838,11 @@ def is_timeseries(data):
     except:
         raise HydraPluginError("Unable to parse timeseries %s"%data)
 
-def get_data_columns(filedata):
+def get_data_columns(header):
     """
         Look for column descriptors on the first line of the array and timeseries files
     """
     data_columns = None
-    header = filedata[0]
     compressed_header = ','.join(header).replace(' ', '').lower()
     #Has a header been specified?
     if compressed_header.startswith('arraydescription') or \
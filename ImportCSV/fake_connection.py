@@ -0,0 +1,586 @@
+# (c) Copyright 2013, 2014,2015 University of Manchester
+#
+# ImportCSV is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImportCSV is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with ImportCSV.  If not, see <http://www.gnu.org/licenses/>
+#
+
+"""
+    An in-memory stand-in for a Hydra server, so that the CSV plug-ins can
+    be run, tested and benchmarked on a machine with no server (see
+    --fake-server). It is used by both ImportCSV and ExportCSV, so it must
+    work with python 2 and 3.
+
+    Only the calls made by the plug-ins are supported. Ids are assigned as
+    the server would, replacing the temporary (negative) ids of new nodes,
+    links, groups and resource attributes, so a network imported with it
+    can be exported again. Nothing is validated.
+"""
+
+import os
+import json
+import time
+import numbers
+import atexit
+import logging
+
+from hydra_base.lib.objects import JSONObject
+from hydra_client.exception import RequestError
+
+log = logging.getLogger(__name__)
+
+#The units known to the fake server, by dimension. These cover the
+#example networks in testdata and the benchmark networks. A unit with a
+#factor, such as '1e3 GBP', needs its base unit too, as the dimension of
+#an attribute is found from the unit without the factor.
+DEFAULT_DIMENSIONS = [
+    ('Dimensionless', ['', '-', '%']),
+    ('Volume', ['m^3', 'hm^3', 'Ml', 'ac-ft', '1000 ac-ft']),
+    ('Volumetric flow rate', ['m^3 s^-1', 'hm^3 mon^-1', 'Ml day^-1',
+                              'ac-ft mon^-1', '1000 ac-ft mon^-1']),
+    ('Length', ['m', 'km']),
+    ('Mass', ['kg', 't']),
+    ('Mass flow', ['t yr^-1']),
+    ('Concentration', ['kg Ml^-1']),
+    ('Currency', ['USD', 'GBP', '1e3 GBP']),
+    ('Currency rate', ['GBP yr^-1', '1e3 GBP yr^-1']),
+    ('Unit cost', ['USD ac-ft^-1', 'GBP Ml^-1', '0.01 GBP Ml^-1',
+                   'GBP t^-1', '1e-2 GBP t^-1']),
+]
+
+#The kinds of resource in a network, with the key of the list they
+#are kept in.
+RESOURCE_KEYS = (('NODE', 'nodes'), ('LINK', 'links'), ('GROUP', 'resourcegroups'))
+
+def copy_payload(obj):
+    """
+        Copy a request or a response through JSON, as if it had been sent to
+        or from a server, so that the state of the fake server never shares
+        objects with the plug-in.
+    """
+    return json.loads(json.dumps(obj, default=list))
+
+class FakeConnection(object):
+    """
+        Answers the calls made by the plug-ins from data held in memory.
+
+        If state_file is given, the projects, networks, attributes,
+        templates and rules are loaded from it and, if any call has changed
+        them, saved to it once by close() or when the process exits, so that
+        one run can use what another created (an import followed by an
+        export, for example). Saving after every call would make the cost of
+        a run grow with the size of the state, which would distort the
+        timings the fake server is used to take.
+
+        To approximate the cost of a remote server, every call can be made
+        to take 'latency' seconds plus the time to send its request and
+        response at 'bandwidth' bytes per second.
+    """
+    def __init__(self, state_file=None, latency=0.0, bandwidth=None, dimensions=DEFAULT_DIMENSIONS):
+        self.state_file = state_file
+        self.latency    = latency
+        self.bandwidth  = bandwidth
+        self.session_id = None
+        #Whether the state has changed since it was loaded or last saved
+        self.changed    = False
+
+        #What has been asked of the server, for reporting
+        self.num_calls  = 0
+        self.call_counts = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.delay      = 0.0
+
+        self.state = dict(next_id    = 1,
+                          dimensions = [],
+                          attributes = {},
+                          projects   = {},
+                          networks   = {},
+                          templates  = {},
+                          rules      = {})
+
+        if state_file is not None and os.path.isfile(state_file):
+            with open(state_file) as f:
+                self.state = json.load(f)
+            log.info("Loaded fake server state from %s", state_file)
+        else:
+            for name, units in dimensions:
+                self.state['dimensions'].append(dict(
+                    id    = self.new_id(),
+                    name  = name,
+                    units = [dict(id=self.new_id(), abbreviation=abbr) for abbr in units]))
+
+        if state_file is not None:
+            atexit.register(self.close)
+
+    def new_id(self):
+        new_id = self.state['next_id']
+        self.state['next_id'] += 1
+        return new_id
+
+    def close(self):
+        """
+            Save the state, if it has changed.
+        """
+        if self.changed:
+            self.save()
+
+    def save(self):
+        if self.state_file is None:
+            return
+        tmp_file = "%s.tmp"%(self.state_file,)
+        with open(tmp_file, 'w') as f:
+            json.dump(self.state, f)
+        if os.path.exists(self.state_file):
+            os.remove(self.state_file)
+        os.rename(tmp_file, self.state_file)
+        self.changed = False
+        log.info("Saved fake server state to %s", self.state_file)
+
+    def request(self, func, args, handler, changes_state=False):
+        """
+            Carry out a call: copy the request, simulate the cost of sending
+            it, run the handler and copy the response back as JSONObjects.
+        """
+        self.num_calls += 1
+        self.call_counts[func] = self.call_counts.get(func, 0) + 1
+
+        args = copy_payload(args)
+        result = handler(**args)
+        result = copy_payload(result)
+
+        delay = self.latency
+        if self.bandwidth:
+            sent = len(json.dumps(args))
+            received = len(json.dumps(result))
+            self.bytes_sent += sent
+            self.bytes_received += received
+            delay += float(sent + received) / self.bandwidth
+        if delay > 0:
+            time.sleep(delay)
+            self.delay += delay
+
+        if changes_state:
+            self.changed = True
+
+        if isinstance(result, dict):
+            return JSONObject(result)
+        elif isinstance(result, list):
+            return [JSONObject(r) if isinstance(r, dict) else r for r in result]
+        return result
+
+    def call(self, func, args={}):
+        """
+            Make a call by name, as ExportCSV and the rule reader do.
+        """
+        method = getattr(self, func, None)
+        if method is None or func.startswith('_'):
+            raise RequestError("The fake server does not support %s"%(func,))
+        return method(**args)
+
+    def get_summary(self):
+        summary = "Fake server: %s call(s)"%(self.num_calls,)
+        if self.delay > 0:
+            summary = "%s, %.2fs of simulated delay"%(summary, self.delay)
+        if self.bandwidth:
+            summary = "%s, %s bytes sent and %s received"%(summary, self.bytes_sent, self.bytes_received)
+        return "%s."%(summary,)
+
+    def login(self, username=None, password=None):
+        self.session_id = 'fake-session'
+        return self.session_id
+
+    #Units and attributes
+
+    def get_dimensions(self):
+        return self.request('get_dimensions', {}, lambda: self.state['dimensions'])
+
+    def get_all_attributes(self):
+        return self.request('get_all_attributes', {},
+                            lambda: list(self.state['attributes'].values()))
+
+    def add_attributes(self, attrs):
+        return self.request('add_attributes', dict(attrs=attrs), self._add_attributes, True)
+
+    def _add_attributes(self, attrs):
+        existing = dict(((a['name'], a.get('dimension_id')), a)
+                        for a in self.state['attributes'].values())
+        added = []
+        for attr in attrs:
+            key = (attr['name'], attr.get('dimension_id'))
+            if key not in existing:
+                attr['id'] = self.new_id()
+                self.state['attributes'][str(attr['id'])] = attr
+                existing[key] = attr
+            added.append(existing[key])
+        return added
+
+    #Projects
+
+    def add_project(self, project):
+        return self.request('add_project', dict(project=project), self._add_project, True)
+
+    def _add_project(self, project):
+        project['id'] = self.new_id()
+        self.state['projects'][str(project['id'])] = project
+        return project
+
+    def get_project(self, project_id):
+        return self.request('get_project', dict(project_id=project_id),
+                            lambda project_id: self._get_item('projects', project_id))
+
+    def get_networks(self, project_id, include_data='N'):
+        return self.request('get_networks',
+                            dict(project_id=project_id, include_data=include_data),
+                            self._get_networks)
+
+    def _get_networks(self, project_id, include_data='N'):
+        return [self._get_network(n['id'], include_data)
+                for n in self.state['networks'].values()
+                if n.get('project_id') == int(project_id)]
+
+    def get_network_project(self, network_id):
+        return self.request('get_network_project', dict(network_id=network_id),
+                            self._get_network_project)
+
+    def _get_network_project(self, network_id):
+        network = self._get_item('networks', network_id)
+        return self._get_item('projects', network['project_id'])
+
+    def _get_item(self, kind, item_id):
+        item = self.state[kind].get(str(item_id))
+        if item is None:
+            raise RequestError("%s %s not found"%(kind[:-1].capitalize(), item_id))
+        return item
+
+    #Networks
+
+    def add_network(self, network):
+        return self.request('add_network', dict(network=network), self._add_network, True)
+
+    def _add_network(self, network):
+        network['id'] = self.new_id()
+        network['scenarios'] = network.get('scenarios') or []
+        self.state['networks'][str(network['id'])] = network
+
+        self._assign_ids(network, network['scenarios'], {})
+        return self._get_network(network['id'], include_data='N')
+
+    def update_network(self, network):
+        return self.request('update_network', dict(network=network), self._update_network, True)
+
+    def _update_network(self, network):
+        stored = self._get_item('networks', network['id'])
+
+        #Scenarios which are not in the update are kept
+        scenarios = dict((s['id'], s) for s in stored.get('scenarios', []))
+        new_scenarios = []
+        for scenario in network.get('scenarios') or []:
+            if scenario.get('id') in scenarios and scenario['id'] > 0:
+                scenarios[scenario['id']].update(scenario)
+            else:
+                new_scenarios.append(scenario)
+        network['scenarios'] = list(scenarios.values()) + new_scenarios
+        self.state['networks'][str(network['id'])] = network
+
+        self._assign_ids(network, new_scenarios, stored)
+        return self._get_network(network['id'], include_data='N')
+
+    def _assign_ids(self, network, new_scenarios, stored):
+        """
+            Give new nodes, links, groups, resource attributes and scenarios
+            their ids, and replace the temporary ids used to refer to them.
+            Resources in the stored version of the network keep their types.
+        """
+        resource_ids = dict(NODE={}, LINK={}, GROUP={})
+        res_attr_ids = {}
+
+        stored_types = {}
+        for ref_key, key in RESOURCE_KEYS:
+            for resource in stored.get(key) or []:
+                stored_types[(ref_key, resource['id'])] = resource.get('types')
+
+        def assign(ref_key, resource):
+            if resource.get('id') is None or resource['id'] < 0:
+                new_id = self.new_id()
+                resource_ids[ref_key][resource.get('id')] = new_id
+                resource['id'] = new_id
+            elif resource.get('types') is None:
+                resource['types'] = stored_types.get((ref_key, resource['id']))
+            for res_attr in resource.get('attributes') or []:
+                if res_attr.get('id') is None or res_attr['id'] < 0:
+                    new_id = self.new_id()
+                    res_attr_ids[res_attr.get('id')] = new_id
+                    res_attr['id'] = new_id
+                res_attr['ref_key'] = ref_key
+                res_attr['ref_id']  = resource['id']
+
+        network['types'] = network.get('types') or stored.get('types')
+        for res_attr in network.get('attributes') or []:
+            if res_attr.get('id') is None or res_attr['id'] < 0:
+                new_id = self.new_id()
+                res_attr_ids[res_attr.get('id')] = new_id
+                res_attr['id'] = new_id
+            res_attr['ref_key'] = 'NETWORK'
+            res_attr['ref_id']  = network['id']
+
+        for ref_key, key in RESOURCE_KEYS:
+            network[key] = network.get(key) or []
+            for resource in network[key]:
+                assign(ref_key, resource)
+
+        for link in network['links']:
+            link['node_1_id'] = resource_ids['NODE'].get(link['node_1_id'], link['node_1_id'])
+            link['node_2_id'] = resource_ids['NODE'].get(link['node_2_id'], link['node_2_id'])
+
+        for scenario in new_scenarios:
+            scenario['id'] = self.new_id()
+            scenario['network_id'] = network['id']
+            for rs in scenario.get('resourcescenarios') or []:
+                rs['resource_attr_id'] = res_attr_ids.get(rs['resource_attr_id'], rs['resource_attr_id'])
+                self._add_dataset(rs)
+            for item in scenario.get('resourcegroupitems') or []:
+                item['id'] = self.new_id()
+                item['group_id'] = resource_ids['GROUP'].get(item['group_id'], item['group_id'])
+                item['ref_id'] = resource_ids[item['ref_key']].get(item['ref_id'], item['ref_id'])
+
+    def _add_dataset(self, rs):
+        dataset = rs.get('dataset') or rs.get('value')
+        if dataset.get('id') is None:
+            dataset['id'] = self.new_id()
+        #The server holds every value as text, which ExportCSV parses
+        if isinstance(dataset.get('value'), (numbers.Number, list, dict)):
+            dataset['value'] = json.dumps(dataset['value'])
+        if dataset.get('unit_id') is not None and dataset.get('unit') is None:
+            dataset['unit'] = self._get_unit(dataset['unit_id'])
+        rs['dataset'] = dataset
+        rs.pop('value', None)
+
+    def _get_unit(self, unit_id):
+        for dimension in self.state['dimensions']:
+            for unit in dimension['units']:
+                if unit['id'] == int(unit_id):
+                    return unit['abbreviation']
+        return None
+
+    def get_network(self, network_id, include_data='Y', summary='N', scenario_ids=None, **kwargs):
+        return self.request('get_network',
+                            dict(network_id=network_id, include_data=include_data),
+                            self._get_network)
+
+    def _get_network(self, network_id, include_data='Y'):
+        network = copy_payload(self._get_item('networks', network_id))
+        for scenario in network.get('scenarios') or []:
+            if include_data == 'Y':
+                self._show_data(scenario)
+            else:
+                scenario.pop('resourcescenarios', None)
+        return network
+
+    def _show_data(self, scenario):
+        #Older clients, such as ExportCSV, read the dataset as 'value'
+        for rs in scenario.get('resourcescenarios') or []:
+            rs['value'] = rs['dataset']
+        return scenario
+
+    #Scenarios
+
+    def _get_scenario(self, scenario_id):
+        for network in self.state['networks'].values():
+            for scenario in network.get('scenarios') or []:
+                if scenario['id'] == int(scenario_id):
+                    return network, scenario
+        raise RequestError("Scenario %s not found"%(scenario_id,))
+
+    def get_scenario(self, scenario_id, include_data=True):
+        return self.request('get_scenario',
+                            dict(scenario_id=scenario_id, include_data=include_data),
+                            self._get_scenario_data)
+
+    def _get_scenario_data(self, scenario_id, include_data=True):
+        scenario = copy_payload(self._get_scenario(scenario_id)[1])
+        if include_data:
+            return self._show_data(scenario)
+        scenario.pop('resourcescenarios', None)
+        return scenario
+
+    def update_scenario(self, scenario, update_data=True, update_groups=True):
+        return self.request('update_scenario',
+                            dict(scenario=scenario, update_data=update_data,
+                                 update_groups=update_groups),
+                            self._update_scenario, True)
+
+    def _update_scenario(self, scenario, update_data=True, update_groups=True):
+        network, stored = self._get_scenario(scenario['id'])
+        for key in ('name', 'description', 'start_time', 'end_time', 'time_step'):
+            if key in scenario:
+                stored[key] = scenario[key]
+        if update_data:
+            self._update_resourcedata(stored['id'], scenario.get('resourcescenarios') or [])
+        if update_groups:
+            self._add_resourcegroupitems(stored['id'], scenario.get('resourcegroupitems') or [])
+        return dict(id=stored['id'], name=stored['name'], network_id=network['id'])
+
+    def clone_scenario(self, scenario_id, scenario_name=None):
+        return self.request('clone_scenario',
+                            dict(scenario_id=scenario_id, scenario_name=scenario_name),
+                            self._clone_scenario, True)
+
+    def _clone_scenario(self, scenario_id, scenario_name=None):
+        network, scenario = self._get_scenario(scenario_id)
+        clone = copy_payload(scenario)
+        clone['id'] = self.new_id()
+        clone['name'] = scenario_name or "%s (clone)"%(scenario['name'],)
+        network['scenarios'].append(clone)
+        return dict(id=clone['id'], name=clone['name'], network_id=network['id'])
+
+    def update_resourcedata(self, scenario_id, resource_scenarios):
+        return self.request('update_resourcedata',
+                            dict(scenario_id=scenario_id, resource_scenarios=resource_scenarios),
+                            self._update_resourcedata, True)
+
+    def _update_resourcedata(self, scenario_id, resource_scenarios):
+        network, scenario = self._get_scenario(scenario_id)
+        existing = dict((rs['resource_attr_id'], i)
+                        for i, rs in enumerate(scenario.setdefault('resourcescenarios', [])))
+        for rs in resource_scenarios:
+            self._add_dataset(rs)
+            if rs['resource_attr_id'] in existing:
+                scenario['resourcescenarios'][existing[rs['resource_attr_id']]] = rs
+            else:
+                existing[rs['resource_attr_id']] = len(scenario['resourcescenarios'])
+                scenario['resourcescenarios'].append(rs)
+        return []
+
+    def delete_resource_scenarios(self, scenario_id, resource_attr_ids, quiet=False):
+        return self.request('delete_resource_scenarios',
+                            dict(scenario_id=scenario_id, resource_attr_ids=resource_attr_ids,
+                                 quiet=quiet),
+                            self._delete_resource_scenarios, True)
+
+    def _delete_resource_scenarios(self, scenario_id, resource_attr_ids, quiet=False):
+        network, scenario = self._get_scenario(scenario_id)
+        to_delete = set(int(ra_id) for ra_id in resource_attr_ids)
+        resource_scenarios = scenario.get('resourcescenarios') or []
+        if not quiet:
+            missing = to_delete - set(rs['resource_attr_id'] for rs in resource_scenarios)
+            if len(missing) > 0:
+                raise RequestError("No data for resource attributes %s in scenario %s"%
+                                   (sorted(missing), scenario_id))
+        scenario['resourcescenarios'] = [rs for rs in resource_scenarios
+                                         if rs['resource_attr_id'] not in to_delete]
+        return 'OK'
+
+    def add_resourcegroupitems(self, scenario_id, items):
+        return self.request('add_resourcegroupitems',
+                            dict(scenario_id=scenario_id, items=items),
+                            self._add_resourcegroupitems, True)
+
+    def _add_resourcegroupitems(self, scenario_id, items):
+        network, scenario = self._get_scenario(scenario_id)
+        for item in items:
+            item['id'] = self.new_id()
+            item['scenario_id'] = scenario['id']
+            scenario.setdefault('resourcegroupitems', []).append(item)
+        return items
+
+    def delete_resourcegroupitems(self, scenario_id, item_ids):
+        return self.request('delete_resourcegroupitems',
+                            dict(scenario_id=scenario_id, item_ids=item_ids),
+                            self._delete_resourcegroupitems, True)
+
+    def _delete_resourcegroupitems(self, scenario_id, item_ids):
+        network, scenario = self._get_scenario(scenario_id)
+        to_delete = set(int(item_id) for item_id in item_ids)
+        scenario['resourcegroupitems'] = [item for item in scenario.get('resourcegroupitems') or []
+                                          if item.get('id') not in to_delete]
+        return 'OK'
+
+    #Templates and types
+
+    def get_template(self, template_id):
+        return self.request('get_template', dict(template_id=template_id),
+                            self._get_template, True)
+
+    def _get_template(self, template_id):
+        """
+            A template which has not been seen before is made up from the
+            types of the resources in the networks held, so that the types
+            set by an import can be assigned.
+        """
+        template = self.state['templates'].get(str(template_id))
+        if template is None:
+            template = dict(id=template_id, name=str(template_id), templatetypes=[])
+            self.state['templates'][str(template_id)] = template
+
+        type_names = set(t['name'] for t in template['templatetypes'])
+        for network in self.state['networks'].values():
+            resources = [network] + [r for _, key in RESOURCE_KEYS for r in network.get(key) or []]
+            for resource in resources:
+                type_name = resource.get('type')
+                if type_name and type_name not in type_names:
+                    template['templatetypes'].append(dict(id=self.new_id(),
+                                                          name=type_name,
+                                                          template_id=template_id))
+                    type_names.add(type_name)
+        return template
+
+    def assign_types_to_resources(self, resource_types):
+        return self.request('assign_types_to_resources',
+                            dict(resource_types=resource_types),
+                            self._assign_types_to_resources, True)
+
+    def _assign_types_to_resources(self, resource_types):
+        types = {}
+        for template in self.state['templates'].values():
+            for templatetype in template['templatetypes']:
+                types[templatetype['id']] = templatetype
+
+        resources = {}
+        for network in self.state['networks'].values():
+            resources[('NETWORK', network['id'])] = network
+            for ref_key, key in RESOURCE_KEYS:
+                for resource in network.get(key) or []:
+                    resources[(ref_key, resource['id'])] = resource
+
+        for resource_type in resource_types:
+            resource = resources.get((resource_type['ref_key'], resource_type['ref_id']))
+            templatetype = types.get(resource_type['type_id'])
+            if resource is None or templatetype is None:
+                raise RequestError("Unable to assign type %s to %s %s"%(resource_type['type_id'],
+                                                                       resource_type['ref_key'],
+                                                                       resource_type['ref_id']))
+            resource['types'] = [t for t in resource.get('types') or []
+                                 if t['id'] != templatetype['id']] + [templatetype]
+        return []
+
+    #Rules
+
+    def get_rules(self, scenario_id):
+        return self.request('get_rules', dict(scenario_id=scenario_id),
+                            lambda scenario_id: self.state['rules'].get(str(scenario_id), []))
+
+    def add_rules(self, scenario_id, rule_list):
+        return self.request('add_rules', dict(scenario_id=scenario_id, rule_list=rule_list),
+                            self._add_rules, True)
+
+    def _add_rules(self, scenario_id, rule_list):
+        rules = self.state['rules'].setdefault(str(scenario_id), [])
+        existing = dict((r['id'], r) for r in rules)
+        for rule in rule_list:
+            if rule.get('id') in existing:
+                existing[rule['id']].update(rule)
+            else:
+                rule['id'] = self.new_id()
+                rule['scenario_id'] = int(scenario_id)
+                rules.append(rule)
+        return rules
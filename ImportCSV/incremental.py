@@ -0,0 +1,126 @@
+# (c) Copyright 2013, 2014,2015 University of Manchester
+#
+# ImportCSV is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImportCSV is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with ImportCSV.  If not, see <http://www.gnu.org/licenses/>
+#
+
+"""
+    Support for incremental imports, which only upload the datasets that
+    have changed since a previous import of the same network.
+
+    A dataset is identified by a hash of its type, value, unit and metadata.
+    The hashes of the previous import (the base scenario) come either from a
+    manifest file written by that import or from the base scenario on the
+    server.
+"""
+
+import os
+import json
+import hashlib
+import logging
+
+log = logging.getLogger(__name__)
+
+def get_dataset_hash(dataset):
+    """
+        Hash the type, value, unit and metadata of a dataset. The metadata
+        may be a JSON string, as created by ImportCSV, a dictionary or a
+        list of {'key':..., 'value':...} as returned by the server.
+    """
+    metadata = dataset.get('metadata')
+    if isinstance(metadata, str):
+        try:
+            metadata = json.loads(metadata)
+        except ValueError:
+            pass
+    if isinstance(metadata, list):
+        metadata = dict((m['key'], m['value']) for m in metadata)
+    if not metadata:
+        metadata = {}
+
+    unit_id = dataset.get('unit_id')
+    if unit_id is not None:
+        unit_id = int(unit_id)
+
+    #The server may write a number differently from the CSV file (-5.0 for
+    #-5), so numeric scalars are compared by value.
+    value = str(dataset.get('value'))
+    if str(dataset.get('type')).lower() == 'scalar':
+        try:
+            value = repr(float(value))
+        except ValueError:
+            pass
+
+    key = json.dumps([dataset.get('type'),
+                      value,
+                      unit_id,
+                      metadata], sort_keys=True)
+
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def get_scenario_hashes(scenario):
+    """
+        Get the hash of the dataset of each resource attribute in a
+        scenario returned by the server.
+        Returns a dictionary of resource attribute id -> hash
+    """
+    hashes = {}
+    for rs in scenario.get('resourcescenarios') or []:
+        hashes[int(rs['resource_attr_id'])] = get_dataset_hash(rs['dataset'])
+    return hashes
+
+def get_group_item_keys(items):
+    """
+        Identify the group items of a scenario, whether read by ImportCSV
+        or returned by the server, by (group id, ref_key, member id), so
+        that the group members of two scenarios can be compared.
+    """
+    member_keys = dict(NODE='node_id', LINK='link_id', GROUP='subgroup_id')
+
+    keys = set()
+    for item in items:
+        ref_id = item.get('ref_id')
+        if ref_id is None:
+            ref_id = item.get(member_keys[item['ref_key']])
+        keys.add((int(item['group_id']), item['ref_key'], int(ref_id)))
+    return keys
+
+def read_manifest(manifest_file):
+    """
+        Read the manifest written by a previous import.
+        Returns the network id, the scenario id and the hashes of the
+        datasets in that scenario, keyed on resource attribute id,
+        or None if there is no manifest.
+    """
+    if manifest_file is None or not os.path.isfile(manifest_file):
+        return None
+
+    with open(manifest_file) as f:
+        manifest = json.load(f)
+
+    hashes = dict((int(ra_id), h) for ra_id, h in manifest['hashes'].items())
+    return manifest['network_id'], manifest['scenario_id'], hashes
+
+def write_manifest(manifest_file, network_id, scenario_id, hashes):
+    """
+        Record the hashes of the datasets in an imported scenario so
+        that the next import can tell which have changed.
+    """
+    manifest = dict(network_id  = network_id,
+                    scenario_id = scenario_id,
+                    hashes      = dict((str(ra_id), h) for ra_id, h in hashes.items()))
+
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f)
+
+    log.info("Written manifest of %s datasets to %s", len(hashes), manifest_file)
@@ -0,0 +1,165 @@
+# (c) Copyright 2013, 2014,2015 University of Manchester
+#
+# ImportCSV is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImportCSV is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with ImportCSV.  If not, see <http://www.gnu.org/licenses/>
+#
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from csv_util import iter_file_data, split_header
+from data import load_data_file, get_seasonal_key
+
+log = logging.getLogger(__name__)
+
+
+class PendingFile(object):
+    """
+        A timeseries or array file which is being read in the background.
+        It sits in the file cache in place of the DataFile until the file
+        is needed, at which point result() waits for it to be ready.
+    """
+    def __init__(self, future, prefetcher):
+        self.future     = future
+        self.prefetcher = prefetcher
+
+    def result(self):
+        if self.future.done():
+            return self.future.result()
+
+        start = time.time()
+        try:
+            return self.future.result()
+        finally:
+            self.prefetcher.add_wait(time.time() - start)
+
+class FilePrefetcher(object):
+    """
+        Reads the timeseries and array files referred to in the network,
+        node, link and group files in a pool of threads, so that the main
+        thread does not stop at every new file name it finds (see -x).
+
+        Each file is read, indexed and, if it holds timeseries, parsed (see
+        data.load_data_file) and put into the file cache, where
+        create_dataset picks it up.
+
+        io_time is the total time spent reading files in the pool and
+        wait_time the time the main thread spent waiting for them, so
+        io_time - wait_time is the time spent reading which was overlapped
+        with other work.
+
+        shutdown() stops the scan and cancels every read which has not
+        started, so an import which fails part way through does not have
+        to wait for the rest of the files to be read before it can exit.
+    """
+    def __init__(self, threads):
+        self.executor  = ThreadPoolExecutor(max_workers=threads)
+        self.lock      = threading.Lock()
+        self.stopped   = threading.Event()
+        #Every read submitted to the pool, so they can be cancelled.
+        self.futures   = []
+        self.io_time   = 0.0
+        self.wait_time = 0.0
+        self.num_files = 0
+        #Values already checked, so each one is only looked for once.
+        self.seen      = set()
+
+        #Needed to parse seasonal timeseries outside the main thread.
+        get_seasonal_key()
+
+    def add_wait(self, wait):
+        with self.lock:
+            self.wait_time += wait
+
+    def read_file(self, full_file_path):
+        start = time.time()
+        try:
+            return load_data_file(full_file_path)
+        finally:
+            with self.lock:
+                self.io_time += time.time() - start
+                self.num_files += 1
+
+    def prefetch_line(self, basepath, linedata, file_dict):
+        """
+            Start reading every file named on a line of a network, node,
+            link or group file which is not already in the file cache.
+        """
+        for value in linedata:
+            if self.stopped.is_set():
+                return
+            value = value.strip()
+            if value in self.seen:
+                continue
+            self.seen.add(value)
+
+            if value == '':
+                continue
+            try:
+                float(value)
+                continue
+            except ValueError:
+                pass
+
+            full_file_path = os.path.join(basepath, value.replace('\\', '/'))
+            if full_file_path in file_dict or not os.path.isfile(full_file_path):
+                continue
+
+            with self.lock:
+                if self.stopped.is_set():
+                    return
+                future = self.executor.submit(self.read_file, full_file_path)
+                self.futures.append(future)
+            file_dict.setdefault(full_file_path, PendingFile(future, self))
+
+    def prefetch_tables(self, basepath, files, file_dict):
+        """
+            Look through node, link and group files for file names in the
+            background, starting to read each file as it is found.
+        """
+        with self.lock:
+            future = self.executor.submit(self.scan_tables, basepath, files, file_dict)
+            self.futures.append(future)
+
+    def scan_tables(self, basepath, files, file_dict):
+        for file in files:
+            if self.stopped.is_set():
+                return
+            try:
+                file_data = iter_file_data(os.path.join(basepath, file))
+                header, units, data = split_header(file, file_data)
+                for line in data:
+                    if self.stopped.is_set():
+                        return
+                    self.prefetch_line(basepath, line.split(','), file_dict)
+            except Exception as e:
+                #The file will be read again, and the error reported,
+                #by the main thread.
+                log.info("Stopped looking for data files in %s: %s", file, e)
+
+    def get_summary(self):
+        overlapped = max(self.io_time - self.wait_time, 0.0)
+        return ("Read %s data file(s) in the background in %.2fs, "
+                "%.2fs of which overlapped with other work."%
+                (self.num_files, self.io_time, overlapped))
+
+    def shutdown(self):
+        self.stopped.set()
+        with self.lock:
+            for future in self.futures:
+                future.cancel()
+            self.futures = []
+        self.executor.shutdown(wait=False)
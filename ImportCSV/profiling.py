@@ -0,0 +1,223 @@
+# (c) Copyright 2013, 2014,2015 University of Manchester
+#
+# ImportCSV is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImportCSV is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with ImportCSV.  If not, see <http://www.gnu.org/licenses/>
+#
+
+"""
+    Timing of the stages of an import or export (see --profile), to find
+    out where the time goes when a run is slow. Used by both ImportCSV and
+    ExportCSV, so it must work with python 2 and 3.
+
+    A stage is timed with:
+
+        with profiler.stage('read_nodes', filename, counter=csv.count_items):
+            csv.read_nodes(filename)
+
+    A stage entered again with the same name and file adds to the same
+    record, so stages may be as small as one resource. Stages entered
+    within another are recorded as part of it and are not counted again
+    in the totals.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    #Not available on Windows
+    resource = None
+
+log = logging.getLogger(__name__)
+
+def get_cpu_time():
+    """
+        The user and system CPU time of this process, in seconds.
+    """
+    times = os.times()
+    return times[0] + times[1]
+
+def get_peak_rss():
+    """
+        The most memory this process has used so far, in bytes,
+        or None where this is not known.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #Linux reports KB, Mac OS bytes
+    if sys.platform != 'darwin':
+        peak = peak * 1024
+    return peak
+
+def format_bytes(num_bytes):
+    if num_bytes is None:
+        return 'unknown'
+    return "%.1fMB"%(num_bytes/(1024.0*1024.0),)
+
+class Stage(object):
+    """
+        What has been recorded for one stage, or one file within a stage.
+    """
+    def __init__(self, name, filename=None, parent=None):
+        self.name     = name
+        self.filename = filename
+        self.parent   = parent
+        self.calls    = 0
+        self.wall     = 0.0
+        self.cpu      = 0.0
+        self.peak_rss = None
+        #Number of each kind of item handled, such as nodes or datasets
+        self.items    = {}
+
+    def count(self, kind, num=1):
+        self.items[kind] = self.items.get(kind, 0) + num
+
+    def as_dict(self):
+        return OrderedDict([('name',     self.name),
+                            ('file',     self.filename),
+                            ('parent',   self.parent),
+                            ('calls',    self.calls),
+                            ('wall',     round(self.wall, 6)),
+                            ('cpu',      round(self.cpu, 6)),
+                            ('peak_rss', self.peak_rss),
+                            ('items',    self.items)])
+
+class Profiler(object):
+    """
+        Records the stages of a run. A profiler which is not enabled records
+        nothing, so the stages can be marked whether or not --profile is
+        used. If stats_file is given, the run is also profiled with cProfile
+        and the statistics are saved to it, for use with pstats.
+    """
+    def __init__(self, enabled=True, stats_file=None):
+        self.enabled    = enabled
+        self.stats_file = stats_file
+        self.stages     = OrderedDict()
+        #The names of the stages currently entered
+        self.current    = []
+        self.cprofile   = None
+        self.start_wall = time.time()
+        self.start_cpu  = get_cpu_time()
+
+        if enabled and stats_file is not None:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    @contextmanager
+    def stage(self, name, filename=None, counter=None):
+        """
+            Time the code run within this context as stage 'name', reading
+            'filename' if given. counter is a function returning the number
+            of each kind of item held so far; the difference it shows
+            across the stage is added to the items of the stage. Items can
+            also be counted with the count method of the stage returned.
+        """
+        if not self.enabled:
+            yield Stage(name, filename)
+            return
+
+        parent = self.current[-1] if len(self.current) > 0 else None
+        key = (name, filename, parent)
+        stage = self.stages.get(key)
+        if stage is None:
+            stage = Stage(name, filename, parent)
+            self.stages[key] = stage
+
+        before = counter() if counter is not None else {}
+        self.current.append(name)
+        start_wall = time.time()
+        start_cpu  = get_cpu_time()
+        try:
+            yield stage
+        finally:
+            stage.wall += time.time() - start_wall
+            stage.cpu  += get_cpu_time() - start_cpu
+            stage.calls += 1
+            stage.peak_rss = get_peak_rss()
+            self.current.pop()
+            if counter is not None:
+                for kind, num in counter().items():
+                    if num != before.get(kind, 0):
+                        stage.count(kind, num - before.get(kind, 0))
+
+    def get_totals(self):
+        """
+            The stages which are not part of another, with the
+            records for each of their files added together.
+        """
+        totals = OrderedDict()
+        for stage in self.stages.values():
+            if stage.parent is not None:
+                continue
+            total = totals.get(stage.name)
+            if total is None:
+                total = Stage(stage.name)
+                totals[stage.name] = total
+            total.calls += stage.calls
+            total.wall  += stage.wall
+            total.cpu   += stage.cpu
+            total.peak_rss = stage.peak_rss
+            for kind, num in stage.items.items():
+                total.count(kind, num)
+        return totals
+
+    def stop(self):
+        """
+            Stop profiling and save the cProfile statistics, if asked for.
+        """
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.stats_file)
+            log.info("Profile statistics saved to %s", self.stats_file)
+            self.cprofile = None
+
+    def as_dict(self):
+        return OrderedDict([('wall',     round(time.time() - self.start_wall, 6)),
+                            ('cpu',      round(get_cpu_time() - self.start_cpu, 6)),
+                            ('peak_rss', get_peak_rss()),
+                            ('stats_file', self.stats_file),
+                            ('totals',   [s.as_dict() for s in self.get_totals().values()]),
+                            ('stages',   [s.as_dict() for s in self.stages.values()])])
+
+    def save(self, filename):
+        """
+            Write everything recorded to a JSON file.
+        """
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+        log.info("Profile saved to %s", filename)
+
+    def get_summary(self):
+        if not self.enabled:
+            return ''
+
+        stages = []
+        for total in self.get_totals().values():
+            summary = "%s %.2fs (%.2fs CPU"%(total.name, total.wall, total.cpu)
+            for kind, num in sorted(total.items.items()):
+                summary = "%s, %s %s"%(summary, num, kind)
+            stages.append("%s)"%(summary,))
+
+        return "Profile: %s. Total %.2fs, %.2fs CPU, peak memory %s."%(
+            "; ".join(stages),
+            time.time() - self.start_wall,
+            get_cpu_time() - self.start_cpu,
+            format_bytes(get_peak_rss()))
@@ -0,0 +1,118 @@
+# (c) Copyright 2013, 2014,2015 University of Manchester
+#
+# ImportCSV is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImportCSV is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with ImportCSV.  If not, see <http://www.gnu.org/licenses/>
+#
+
+"""
+    Compact records for the nodes, links, groups, resource attributes and
+    datasets built while reading the CSV files.
+
+    A large network has millions of these. As dictionaries, each one carries
+    a hash table with its own copy of the keys. A record with __slots__
+    stores just its values. Records can be used like the dictionaries and
+    JSONObjects they replace (record['name'], record.name, record.get('name')
+    and 'name' in record). They are turned into dictionaries with to_wire
+    only when they are sent to the server.
+"""
+
+class Record(object):
+    """
+        Base class of the records. A field which has never been set is
+        treated as a missing key, so it is left out of the dictionary
+        sent to the server. As with a JSONObject, reading it as an
+        attribute (record.data_type) gives None.
+    """
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    def __getattr__(self, key):
+        #Only called for a field which has not been set
+        if key in self.__slots__:
+            return None
+        raise AttributeError("%s has no field %s"%(self.__class__.__name__, key))
+
+    def is_set(self, key):
+        try:
+            object.__getattribute__(self, key)
+            return True
+        except AttributeError:
+            return False
+
+    def __getitem__(self, key):
+        if key not in self.__slots__ or not self.is_set(key):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        try:
+            setattr(self, key, value)
+        except AttributeError:
+            raise KeyError("%s has no field %s"%(self.__class__.__name__, key))
+
+    def __contains__(self, key):
+        return key in self.__slots__ and self.is_set(key)
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self else default
+
+    def keys(self):
+        return [key for key in self.__slots__ if self.is_set(key)]
+
+    def as_dict(self):
+        return dict((key, getattr(self, key)) for key in self.keys())
+
+    def __getstate__(self):
+        return self.as_dict()
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            setattr(self, key, value)
+
+    def __repr__(self):
+        return "%s(%s)"%(self.__class__.__name__, self.as_dict())
+
+class Node(Record):
+    __slots__ = ('id', 'name', 'description', 'x', 'y', 'type', 'attributes')
+
+class Link(Record):
+    __slots__ = ('id', 'name', 'description', 'node_1_id', 'node_2_id', 'type', 'attributes')
+
+class Group(Record):
+    __slots__ = ('id', 'name', 'description', 'type', 'attributes')
+
+class ResourceAttr(Record):
+    #data_type is not saved. It is used to validate against the template.
+    __slots__ = ('id', 'attr_id', 'attr_is_var', 'data_type')
+
+class Dataset(Record):
+    __slots__ = ('id', 'type', 'unit_id', 'name', 'value', 'hidden', 'metadata')
+
+class ResourceScenario(Record):
+    __slots__ = ('attr_id', 'resource_attr_id', 'dataset')
+
+def to_wire(obj):
+    """
+        Turn any records in a structure of dictionaries and lists into
+        dictionaries, ready to be sent to the server.
+    """
+    if isinstance(obj, Record):
+        return dict((key, to_wire(getattr(obj, key))) for key in obj.keys())
+    elif isinstance(obj, dict):
+        return dict((key, to_wire(value)) for key, value in obj.items())
+    elif isinstance(obj, list):
+        return [to_wire(value) for value in obj]
+    return obj
@@ -0,0 +1,98 @@
+# (c) Copyright 2013, 2014,2015 University of Manchester
+#
+# ImportCSV is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImportCSV is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with ImportCSV.  If not, see <http://www.gnu.org/licenses/>
+#
+
+import logging
+
+from hydra_base.exceptions import HydraPluginError
+
+log = logging.getLogger(__name__)
+
+
+class ResourceRegistry(object):
+    """
+        Keeps track of the nodes, links and groups in a network by name, so
+        that duplicates, ids and types can all be looked up in constant time.
+
+        For each kind of resource ('NODE', 'LINK' or 'GROUP') it holds:
+        the names read from the input files, to catch duplicates,
+        a map from name to resource id,
+        a map from type name to the names of the resources of that type and
+        a map from resource name to type name.
+    """
+
+    kinds = ('NODE', 'LINK', 'GROUP')
+
+    def __init__(self):
+        self.names          = dict((kind, set()) for kind in self.kinds)
+        self.ids            = dict((kind, dict()) for kind in self.kinds)
+        self.types          = dict((kind, dict()) for kind in self.kinds)
+        self.resource_types = dict((kind, dict()) for kind in self.kinds)
+
+    @classmethod
+    def from_network(cls, network):
+        """
+            Build a registry of the ids of the resources in a network,
+            as returned by the server.
+        """
+        registry = cls()
+        for kind, key in (('NODE', 'nodes'),
+                          ('LINK', 'links'),
+                          ('GROUP', 'resourcegroups')):
+            for resource in network.get(key) or []:
+                registry.set_id(kind, resource['name'], resource['id'])
+        return registry
+
+    def has_kind(self, kind):
+        return kind in self.ids
+
+    def add(self, kind, name):
+        """
+            Record that a resource has been read from a file, raising an
+            error if one of the same kind and name has been read already.
+        """
+        names = self.names[kind]
+        if name in names:
+            raise HydraPluginError("Duplicate %s name: %s"%(kind.capitalize(), name))
+        names.add(name)
+
+    def set_id(self, kind, name, resource_id):
+        self.ids[kind][name] = resource_id
+
+    def get_id(self, kind, name):
+        """
+            The id of the named resource, or None if it is not known.
+        """
+        return self.ids[kind].get(name)
+
+    def set_type(self, kind, name, type_name):
+        self.resource_types[kind][name] = type_name
+        members = self.types[kind].get(type_name)
+        if members is None:
+            self.types[kind][type_name] = [name]
+        else:
+            members.append(name)
+
+    def get_type(self, kind, name):
+        """
+            The name of the type of the named resource, or None if it has none.
+        """
+        return self.resource_types[kind].get(name)
+
+    def get_types(self, kind):
+        """
+            A dictionary of type name -> names of the resources of that type
+        """
+        return self.types[kind]
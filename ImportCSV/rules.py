@@ -20,7 +20,8 @@ import os
 import logging
 
 from hydra_base.exceptions import HydraPluginError
-from csv_util import get_file_data, check_header
+from csv_util import iter_file_data, check_header
+from registry import ResourceRegistry
 
 log = logging.getLogger(__name__)
 
@@ -36,16 +37,8 @@ class RuleReader(object):
         self.get_existing_rules()
         self.rule_files = rule_files
 
-
-        self.Groups = {}
-        self.Links  = {}
-        self.Nodes  = {}
-        for n in network.get('nodes'):
-            self.Nodes[n.name] = n.id
-        for l in network.get('links'):
-            self.Links[l.name] = l.id
-        for g in network.get('resourcegroups'):
-            self.Groups[g.name] = g.id
+        #The ids of the nodes, links and groups which rules can refer to
+        self.registry = ResourceRegistry.from_network(network)
 
 
     def get_existing_rules(self):
@@ -69,12 +62,12 @@ class RuleReader(object):
             ...
         """
 
-        rule_data = get_file_data(file)
+        rule_data = iter_file_data(file)
 
-        keys  = rule_data[0].split(',')
+        keys  = next(rule_data, '').split(',')
         check_header(file, keys)
 
-        data = rule_data[1:]
+        data = rule_data
 
         #Indicates what the mandatory columns are and where
         #we expect to see them.
@@ -120,17 +113,12 @@ class RuleReader(object):
             ref_key = rule_data[field_idx['type']].strip().upper()
             ref_name = rule_data[field_idx['resource']].strip()
             rule_id=None
-            try:
-                if ref_key == 'NODE':
-                    ref_id = self.Nodes[ref_name]
-                elif ref_key == 'LINK':
-                    ref_id = self.Links[ref_name]
-                elif ref_key == 'GROUP':
-                    ref_id = self.Groups[ref_name]
-                else:
-                    log.critical("Unknown reference type %s. Carrying on"%ref_key)
-            except KeyError:
-                raise HydraPluginError("Rule error: Unknown %s named %s. Please check the name is correct."%(ref_key.lower(), ref_name))
+            if self.registry.has_kind(ref_key):
+                ref_id = self.registry.get_id(ref_key, ref_name)
+                if ref_id is None:
+                    raise HydraPluginError("Rule error: Unknown %s named %s. Please check the name is correct."%(ref_key.lower(), ref_name))
+            else:
+                log.critical("Unknown reference type %s. Carrying on"%ref_key)
 
         rule = dict(id          = rule_id,
                     name        = rule_name,
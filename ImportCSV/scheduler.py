@@ -0,0 +1,164 @@
+# (c) Copyright 2013, 2014,2015 University of Manchester
+#
+# ImportCSV is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImportCSV is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with ImportCSV.  If not, see <http://www.gnu.org/licenses/>
+#
+
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from csv_util import iter_file_data, \
+                     split_header, \
+                     check_header, \
+                     get_field_idx, \
+                     read_resource_metadata
+from data import create_line_datasets, set_parse_cache
+
+log = logging.getLogger(__name__)
+
+
+class PreparedFile(object):
+    """
+        A node, link or group file read by a worker process. lines holds
+        each line of data with the datasets created for it (see
+        data.create_line_datasets), or None if the line could not be
+        prepared and has to be read in full by the main process.
+    """
+    def __init__(self, metadata, keys, units, lines):
+        self.metadata = metadata
+        self.keys     = keys
+        self.units    = units
+        self.lines    = lines
+
+def get_restrictions(kind, linedata, field_idx, template):
+    """
+        Get the attribute restrictions in the template for the type
+        of the resource on a line.
+    """
+    if field_idx['type'] is None or len(template) == 0:
+        return {}
+
+    resource_type = linedata[field_idx['type']].strip()
+    type_def = template['resources'].get(kind, {}).get(resource_type, {})
+
+    return type_def.get('attributes', {})
+
+def prepare_file(kind, file, field_idx, context):
+    """
+        Read a node, link or group file and create the datasets for every
+        line of it. This is the expensive part of reading a file, especially
+        when values refer to timeseries or array files, and does not need
+        anything from the server, so it can be done in a worker process.
+
+        Resources, resource attributes and their temporary ids are not
+        created here. The main process does that when it reads the prepared
+        file, in the same order as it would read the file itself, so the
+        ids are the same however many workers there are.
+    """
+    set_parse_cache(context.cache)
+
+    metadata = read_resource_metadata(context.basepath, file)
+
+    file_data = iter_file_data(os.path.join(context.basepath, file))
+    header, units, data = split_header(file, file_data)
+
+    keys = header.split(',')
+    check_header(file, keys)
+
+    attrs = get_field_idx(keys, field_idx)
+
+    #Timeseries and array files are cached per worker.
+    file_dict = {}
+
+    lines = []
+    for line in data:
+        datasets = None
+        if line.strip() != '' and len(attrs) > 0:
+            try:
+                linedata = line.split(',')
+                resource_name = linedata[field_idx['name']].strip()
+                datasets = create_line_datasets(linedata,
+                                                attrs,
+                                                units,
+                                                resource_name,
+                                                metadata,
+                                                get_restrictions(kind, linedata, field_idx, context.template),
+                                                context,
+                                                file_dict)
+            except Exception as e:
+                #Leave the line to the main process, which will raise
+                #the same error with the line number in it.
+                log.debug("Unable to prepare line of %s: %s", file, e)
+        lines.append((line, datasets))
+
+    return PreparedFile(metadata, keys, units, lines)
+
+class ParseScheduler(object):
+    """
+        Prepares node, link and group files in a pool of worker processes.
+
+        All the files are handed to the pool as soon as the network file
+        has been read. The main process then reads them in the usual order:
+        nodes, then links, which need the node ids, then groups, then group
+        members, which need the group ids. While it adds the resources in
+        one file the workers carry on with the next ones.
+    """
+    def __init__(self, workers):
+        self.workers  = workers
+        self.executor = None
+        #(kind, file) -> future of a PreparedFile
+        self.jobs     = {}
+
+    def schedule(self, kind, files, field_idx, context):
+        if self.executor is None:
+            #Forked workers inherit any lock held by another thread of
+            #this process and could wait on it forever, so they are
+            #started as new processes instead.
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context('spawn'))
+
+        for file in files:
+            if file == "" or (kind, file) in self.jobs:
+                continue
+            log.info("Scheduling %s file %s", kind.lower(), file)
+            self.jobs[(kind, file)] = self.executor.submit(prepare_file,
+                                                           kind,
+                                                           file,
+                                                           dict(field_idx),
+                                                           context)
+
+    def get(self, kind, file):
+        """
+            Wait for a file to be prepared. Returns None if the file was not
+            scheduled or could not be prepared, in which case it should be
+            read as normal.
+        """
+        job = self.jobs.pop((kind, file), None)
+        if job is None:
+            return None
+
+        try:
+            return job.result()
+        except Exception as e:
+            log.info("Unable to prepare %s in a worker (%s). Reading it again.", file, e)
+            return None
+
+    def shutdown(self):
+        if self.executor is not None:
+            for job in self.jobs.values():
+                job.cancel()
+            self.jobs = {}
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,216 @@
+# (c) Copyright 2013, 2014,2015 University of Manchester
+#
+# ImportCSV is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImportCSV is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with ImportCSV.  If not, see <http://www.gnu.org/licenses/>
+#
+
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from hydra_base.exceptions import HydraPluginError
+
+from records import to_wire
+
+log = logging.getLogger(__name__)
+
+#The kinds of resource in a network and where each is kept in a network
+#structure. The network itself is identified by kind alone.
+resource_keys = (('NODE', 'nodes'), ('LINK', 'links'), ('GROUP', 'resourcegroups'))
+
+def iter_resource_attributes(network):
+    """
+        Yield (kind, resource name, resource attribute) for every resource
+        attribute of a network structure, whether it has been built by
+        ImportCSV or returned by the server.
+    """
+    for res_attr in network.get('attributes') or []:
+        yield 'NETWORK', None, res_attr
+
+    for kind, key in resource_keys:
+        for resource in network.get(key) or []:
+            for res_attr in resource.get('attributes') or []:
+                yield kind, resource['name'], res_attr
+
+def get_resource_attr_keys(network):
+    """
+        Map the id of each resource attribute in a network, which may be a
+        temporary (negative) id, to the kind and name of its resource and
+        its attribute id. This identifies the resource attribute once the
+        server has given it a real id.
+    """
+    res_attr_keys = {}
+    for kind, name, res_attr in iter_resource_attributes(network):
+        res_attr_keys[res_attr['id']] = (kind, name, res_attr['attr_id'])
+    return res_attr_keys
+
+def get_resource_attr_ids(network):
+    """
+        Map the (kind, resource name, attribute id) of each resource
+        attribute in a network returned by the server to its real id.
+    """
+    res_attr_ids = {}
+    for kind, name, res_attr in iter_resource_attributes(network):
+        res_attr_ids[(kind, name, res_attr['attr_id'])] = res_attr['id']
+    return res_attr_ids
+
+def map_resource_attr_ids(resource_scenarios, id_map):
+    """
+        Replace the temporary resource attribute ids in a list of resource
+        scenarios with the ids given to them by the server, using a map of
+        temporary id -> real id.
+    """
+    for rs in resource_scenarios:
+        real_id = id_map.get(rs['resource_attr_id'])
+        if real_id is None:
+            raise HydraPluginError("Unable to find resource attribute %s "
+                                   "in the saved network."%(rs['resource_attr_id'],))
+        rs['resource_attr_id'] = real_id
+
+def iter_batches(resource_scenarios, batch_size=None, batch_bytes=None):
+    """
+        Split a list of resource scenarios into batches of at most batch_size
+        resource scenarios and, approximately, at most batch_bytes bytes of
+        JSON. A resource scenario which is bigger than batch_bytes on its own
+        is sent in a batch by itself.
+    """
+    batch = []
+    size = 0
+    for rs in resource_scenarios:
+        rs_size = len(json.dumps(to_wire(rs))) if batch_bytes is not None else 0
+        if len(batch) > 0:
+            if (batch_size is not None and len(batch) >= batch_size) or \
+               (batch_bytes is not None and size + rs_size > batch_bytes):
+                yield batch
+                batch = []
+                size = 0
+        batch.append(rs)
+        size += rs_size
+
+    if len(batch) > 0:
+        yield batch
+
+class DataUploader(object):
+    """
+        Uploads the data of a scenario whose network has already been saved,
+        a batch at a time, so that no single request has to carry all of it.
+
+        Up to max_in_flight batches are sent at once, each from its own
+        thread. A batch which fails with a connection error (IOError) is
+        retried up to retries times, waiting backoff seconds before the first
+        retry and twice as long before each one after that. Errors returned
+        by the server are not retried.
+
+        A connection is not known to be safe to use from several threads at
+        once. If connect is given, it is called to make a connection of its
+        own for each thread. Otherwise the threads share connection and take
+        turns to use it.
+    """
+    def __init__(self, connection, scenario_id, batch_size=None, batch_bytes=None,
+                 max_in_flight=1, retries=3, backoff=1.0, connect=None):
+        self.connection    = connection
+        self.connect       = connect
+        self.lock          = threading.Lock()
+        self.local         = threading.local()
+        self.scenario_id   = scenario_id
+        self.batch_size    = batch_size
+        self.batch_bytes   = batch_bytes
+        self.max_in_flight = max_in_flight
+        self.retries       = retries
+        self.backoff       = backoff
+
+        self.num_values    = 0
+        self.elapsed       = 0.0
+        #(batch number, number of values, seconds) for each batch sent
+        self.latencies     = []
+
+    def upload(self, resource_scenarios):
+        start = time.time()
+
+        batches = enumerate(iter_batches(resource_scenarios, self.batch_size, self.batch_bytes), 1)
+        if self.max_in_flight > 1:
+            self.upload_concurrently(batches)
+        else:
+            for batch_num, batch in batches:
+                self.upload_batch(batch_num, batch)
+
+        self.num_values = len(resource_scenarios)
+        self.elapsed = time.time() - start
+        log.info(self.get_summary())
+
+    def upload_concurrently(self, batches):
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            pending = set()
+            for batch_num, batch in batches:
+                #Wait for a batch to finish before sending another, so
+                #no more than max_in_flight requests are open at once.
+                if len(pending) >= self.max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for job in done:
+                        job.result()
+                pending.add(executor.submit(self.upload_batch, batch_num, batch))
+
+            for job in wait(pending)[0]:
+                job.result()
+
+    def get_connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.connect()
+            self.local.connection = connection
+        return connection
+
+    def send_batch(self, batch):
+        if self.connect is None:
+            with self.lock:
+                self.connection.update_resourcedata(scenario_id=self.scenario_id,
+                                                    resource_scenarios=to_wire(batch))
+        else:
+            self.get_connection().update_resourcedata(scenario_id=self.scenario_id,
+                                                      resource_scenarios=to_wire(batch))
+
+    def upload_batch(self, batch_num, batch):
+        attempt = 0
+        while True:
+            log.info("Uploading batch %s (%s resource scenarios)", batch_num, len(batch))
+            start = time.time()
+            try:
+                self.send_batch(batch)
+                break
+            except IOError as e:
+                if attempt >= self.retries:
+                    raise HydraPluginError("Unable to upload batch %s after %s attempts: %s"%
+                                           (batch_num, attempt + 1, e))
+                delay = self.backoff * 2 ** attempt
+                log.warning("Batch %s failed (%s). Retrying in %ss.", batch_num, e, delay)
+                time.sleep(delay)
+                attempt += 1
+
+        latency = time.time() - start
+        log.info("Uploaded batch %s (%s resource scenarios) in %.2fs",
+                 batch_num, len(batch), latency)
+        self.latencies.append((batch_num, len(batch), latency))
+
+    def get_summary(self):
+        if len(self.latencies) == 0:
+            return "No data uploaded."
+
+        times = [t for _, _, t in self.latencies]
+        rate = self.num_values / self.elapsed if self.elapsed > 0 else 0
+
+        return ("Uploaded %s values in %s batches in %.2fs (%.0f values/s). "
+                "Batch latency: min %.2fs, mean %.2fs, max %.2fs."%
+                (self.num_values, len(times), self.elapsed, rate,
+                 min(times), sum(times) / len(times), max(times)))
@@ -0,0 +1,159 @@
+# (c) Copyright 2013, 2014,2015 University of Manchester
+#
+# ImportCSV is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImportCSV is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with ImportCSV.  If not, see <http://www.gnu.org/licenses/>
+#
+
+"""
+    Time the export of networks of increasing size from a fake Hydra server
+    (see fake_connection.py), to show how the export scales with the number
+    of datasets in a scenario. The time per dataset should stay about the
+    same as the network grows.
+
+    Each network is exported with its timeseries values held as numbers and
+    again with them held as strings, as ImportCSV saves them.
+
+    ExportCSV is a python 2 plug-in, so run this with the same python.
+
+    Usage: python bench_export.py [-n NODES] [-a ATTRIBUTES] [-s STEPS]
+                                  [-t TIMESERIES_FRACTION]
+                                  [-v {number,string,both}]
+"""
+
+from __future__ import print_function
+
+import argparse as ap
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ExportCSV'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ImportCSV'))
+
+from ExportCSV import ExportCSV
+from fake_connection import FakeConnection
+
+
+def make_dataset(rng, timeseries_fraction, string_values=False):
+    if rng.random() < timeseries_fraction:
+        value = dict(("2000-%02d-01 00:00:00"%(m,), rng.random()) for m in range(1, 13))
+        if string_values:
+            value = dict((t, "%.3f"%(v,)) for t, v in value.items())
+        return dict(type='timeseries',
+                    name='Benchmark data',
+                    value=json.dumps({'0': value}),
+                    metadata='{}')
+    return dict(type='scalar',
+                name='Benchmark data',
+                value=json.dumps(rng.random()),
+                metadata='{}')
+
+
+def add_network(connection, nodes, attributes, timeseries_fraction, string_values=False, seed=0):
+    """
+        Save a chain of 'nodes' nodes, each linked to the next, with values
+        for 'attributes' attributes of every node and link. If string_values
+        is set, the values of timeseries are strings rather than numbers.
+        Returns the id of the network and the number of datasets.
+    """
+    rng = random.Random(seed)
+    attrs = connection.add_attributes(attrs=[dict(name="attr%s"%(i,)) for i in range(attributes)])
+
+    res_attr_ids = iter(range(-1, -(2 * nodes * attributes) - 1, -1))
+    resourcescenarios = []
+
+    def get_attributes():
+        res_attrs = []
+        for attr in attrs:
+            res_attr = dict(id=next(res_attr_ids), attr_id=attr['id'], attr_is_var='N')
+            res_attrs.append(res_attr)
+            resourcescenarios.append(dict(attr_id=attr['id'],
+                                          resource_attr_id=res_attr['id'],
+                                          dataset=make_dataset(rng, timeseries_fraction,
+                                                               string_values)))
+        return res_attrs
+
+    network_nodes = [dict(id=-i - 1,
+                          name="node%s"%(i,),
+                          description='',
+                          x=str(i),
+                          y='0',
+                          attributes=get_attributes()) for i in range(nodes)]
+    network_links = [dict(id=-i - 1,
+                          name="link%s"%(i,),
+                          description='',
+                          node_1_id=-i - 1,
+                          node_2_id=-i - 2,
+                          attributes=get_attributes()) for i in range(nodes - 1)]
+
+    network = connection.add_network(network=dict(name='benchmark',
+                                                  description='Export benchmark network',
+                                                  nodes=network_nodes,
+                                                  links=network_links,
+                                                  resourcegroups=[],
+                                                  attributes=[],
+                                                  scenarios=[dict(name='benchmark',
+                                                                  resourcescenarios=resourcescenarios,
+                                                                  resourcegroupitems=[])]))
+    return network['id'], len(resourcescenarios)
+
+
+def main():
+    parser = ap.ArgumentParser(description="ExportCSV scaling benchmark")
+    parser.add_argument('-n', '--nodes', type=int, default=500,
+                        help="Number of nodes in the smallest network")
+    parser.add_argument('-a', '--attributes', type=int, default=5,
+                        help="Number of attributes of each node and link")
+    parser.add_argument('-s', '--steps', type=int, default=4,
+                        help="Number of networks, each twice the size of the last")
+    parser.add_argument('-t', '--timeseries-fraction', type=float, default=0.1,
+                        help="Fraction of the values which are timeseries")
+    parser.add_argument('-v', '--values', choices=('number', 'string', 'both'), default='both',
+                        help="Whether timeseries values are numbers, strings or each in turn")
+    args = parser.parse_args()
+
+    value_kinds = ['number', 'string'] if args.values == 'both' else [args.values]
+
+    #No units are given, so the export warns about every attribute
+    logging.basicConfig(level=logging.ERROR)
+
+    print("%10s %10s %10s %10s %16s" % ("nodes", "values", "datasets", "seconds", "ms per dataset"))
+    for step in range(args.steps):
+        nodes = args.nodes * 2 ** step
+        for value_kind in value_kinds:
+            connection = FakeConnection()
+            network_id, num_datasets = add_network(connection,
+                                                   nodes,
+                                                   args.attributes,
+                                                   args.timeseries_fraction,
+                                                   value_kind == 'string')
+
+            output_folder = tempfile.mkdtemp(prefix='hydra-csv-export-')
+            try:
+                csv = ExportCSV(connection=connection)
+                x = time.time()
+                csv.export(network_id, None, output_folder)
+                seconds = time.time() - x
+            finally:
+                shutil.rmtree(output_folder, ignore_errors=True)
+
+            print("%10s %10s %10s %10.3f %16.4f" % (nodes, value_kind, num_datasets, seconds,
+                                                      1000.0 * seconds / num_datasets))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# (c) Copyright 2013, 2014,2015 University of Manchester
+#
+# ImportCSV is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImportCSV is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with ImportCSV.  If not, see <http://www.gnu.org/licenses/>
+#
+
+"""
+    Measure the throughput and peak memory of reading a large node table,
+    either streamed line by line or read into a list.
+
+    Usage: python bench_file_reader.py [-s SIZE_MB] [-f FILE]
+"""
+
+import argparse as ap
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ImportCSV'))
+
+from csv_util import iter_file_data, get_file_data
+
+
+def write_node_table(path, size_mb):
+    target = size_mb * 1024 * 1024
+    with open(path, 'w') as f:
+        f.write("Name , x, y, type, capacity, demand, cost, description\n")
+        f.write("Units,  ,  ,     , m^3     , m^3 s^-1, -   ,\n")
+        i = 0
+        while f.tell() < target:
+            f.write("node%s , %s, %s, reservoir, %s, %s, %s, Reservoir number %s\n" %
+                    (i, i % 1000, i // 1000, i * 1.5, i * 0.25, i % 7, i))
+            i += 1
+
+
+def stream(path):
+    n = 0
+    for line in iter_file_data(path):
+        n += 1
+    return n
+
+
+def read_list(path):
+    return len(get_file_data(path))
+
+
+def measure(label, func, path):
+    size = os.path.getsize(path) / (1024.0 * 1024.0)
+
+    x = time.time()
+    lines = func(path)
+    elapsed = time.time() - x
+
+    tracemalloc.start()
+    func(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print("%-10s %9s lines %8.2fs %8.1f MB/s  peak %8.1f MB" %
+          (label, lines, elapsed, size / elapsed, peak / (1024.0 * 1024.0)))
+
+
+def main():
+    parser = ap.ArgumentParser(description="CSV reader benchmark")
+    parser.add_argument('-s', '--size', type=int, default=200,
+                        help="Size of the generated node table in MB")
+    parser.add_argument('-f', '--file',
+                        help="Use an existing file instead of generating one")
+    args = parser.parse_args()
+
+    path = args.file
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'nodes.csv')
+        write_node_table(path, args.size)
+
+    print("%s (%.1f MB)" % (path, os.path.getsize(path) / (1024.0 * 1024.0)))
+    measure("stream", stream, path)
+    measure("list", read_list, path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# (c) Copyright 2013, 2014,2015 University of Manchester
+#
+# ImportCSV is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImportCSV is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with ImportCSV.  If not, see <http://www.gnu.org/licenses/>
+#
+
+"""
+    Compare the peak memory of holding the nodes, resource attributes and
+    resource scenarios of a synthetic import as dictionaries and as records
+    (see records.py).
+
+    Usage: python bench_records.py [-n DATASETS] [-a ATTRIBUTES]
+"""
+
+import argparse as ap
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ImportCSV'))
+
+from records import Node, ResourceAttr, Dataset, ResourceScenario, to_wire
+
+
+def build(num_datasets, num_attrs, node, res_attr, dataset, rs):
+    nodes = []
+    scenario = []
+    ra_id = 0
+    for n in range(num_datasets // num_attrs):
+        attributes = []
+        for a in range(num_attrs):
+            ra_id -= 1
+            attributes.append(res_attr(id=ra_id, attr_id=a, attr_is_var='N', data_type='scalar'))
+            scenario.append(rs(attr_id=a,
+                               resource_attr_id=ra_id,
+                               dataset=dataset(id=None,
+                                               type='scalar',
+                                               unit_id=None,
+                                               name='Import CSV data',
+                                               value=str(n * num_attrs + a),
+                                               hidden='N',
+                                               metadata='{"source": "bench"}')))
+        nodes.append(node(id=-n - 1, name="node%s"%(n,), description="",
+                          x="0", y="0", attributes=attributes))
+    return nodes, scenario
+
+
+def measure(label, num_datasets, num_attrs, *types):
+    gc.collect()
+    tracemalloc.start()
+    x = time.time()
+    nodes, scenario = build(num_datasets, num_attrs, *types)
+    elapsed = time.time() - x
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("%-8s %9s datasets %8.2fs  held %8.1f MB  peak %8.1f MB" %
+          (label, len(scenario), elapsed,
+           current / (1024.0 * 1024.0), peak / (1024.0 * 1024.0)))
+    return nodes, scenario
+
+
+def main():
+    parser = ap.ArgumentParser(description="Record memory benchmark")
+    parser.add_argument('-n', '--datasets', type=int, default=1000000,
+                        help="Number of datasets to create")
+    parser.add_argument('-a', '--attributes', type=int, default=10,
+                        help="Number of attributes per node")
+    args = parser.parse_args()
+
+    dicts = measure("dict", args.datasets, args.attributes, dict, dict, dict, dict)
+    del dicts
+
+    records = measure("records", args.datasets, args.attributes,
+                      Node, ResourceAttr, Dataset, ResourceScenario)
+    del records
+
+    #Converting to dictionaries at commit time must give the same result.
+    dicts = build(args.attributes, args.attributes, dict, dict, dict, dict)
+    assert to_wire(list(build(args.attributes, args.attributes,
+                              Node, ResourceAttr, Dataset, ResourceScenario))) == list(dicts)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# (c) Copyright 2013, 2014,2015 University of Manchester
+#
+# ImportCSV is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImportCSV is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with ImportCSV.  If not, see <http://www.gnu.org/licenses/>
+#
+
+"""
+    Time the conversion of a single long timeseries, including the check
+    for duplicate timestamps.
+
+    Usage: python bench_timeseries.py [-n STEPS] [--compare]
+
+    --compare also times the list-based duplicate check the importer used
+    to do, which is quadratic and takes minutes at 100k steps.
+"""
+
+import argparse as ap
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ImportCSV'))
+
+import pytz
+
+import data
+
+
+def make_series(steps):
+    start = datetime(2000, 1, 1)
+    return [[(start + timedelta(hours=i)).strftime('%Y-%m-%d %H:%M:%S'), '', str(i * 0.5)]
+            for i in range(steps)]
+
+
+def list_duplicate_check(times):
+    seen = []
+    for t in times:
+        if t in seen:
+            raise ValueError(t)
+        seen.append(t)
+
+
+def set_duplicate_check(times):
+    seen = set()
+    for t in times:
+        if t in seen:
+            raise ValueError(t)
+        seen.add(t)
+
+
+def timed(label, func, *args):
+    x = time.time()
+    func(*args)
+    print("%-40s %8.3fs" % (label, time.time() - x))
+
+
+def main():
+    parser = ap.ArgumentParser(description="Timeseries conversion benchmark")
+    parser.add_argument('-n', '--steps', type=int, default=100000)
+    parser.add_argument('--compare', action='store_true')
+    args = parser.parse_args()
+
+    lines = make_series(args.steps)
+    datafile = data.DataFile(None, {'node': lines})
+    times = [l[0] for l in lines]
+
+    print("%s step series" % args.steps)
+    timed("line by line conversion", data._parse_timeseries_lines,
+          lines, {'0': {}}, ['0'], 'benchmark', pytz.utc, data.FileSchema('timeseries'))
+    timed("batched file conversion", data.parse_timeseries_file, datafile)
+    timed("set duplicate check", set_duplicate_check, times)
+    if args.compare:
+        timed("list duplicate check (previous)", list_duplicate_check, times)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+# (c) Copyright 2013, 2014,2015 University of Manchester
+#
+# ImportCSV is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImportCSV is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with ImportCSV.  If not, see <http://www.gnu.org/licenses/>
+#
+
+"""
+    Import each network in testdata into a fake Hydra server (see
+    fake_connection.py), with the arguments in its import_data.sh, and
+    export it again with ExportCSV, to check that both plug-ins work with
+    the fake server and with each other.
+
+    ExportCSV is a python 2 plug-in. Both plug-ins are run with the python
+    running this script unless --export-python is given.
+
+    Usage: python check_testdata.py [--import-python PYTHON]
+                                    [--export-python PYTHON] [--no-export]
+                                    [NETWORK_FOLDER ...]
+"""
+
+from __future__ import print_function
+
+import argparse as ap
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+
+__location__ = os.path.dirname(os.path.abspath(__file__))
+import_script = os.path.join(__location__, '..', 'ImportCSV', 'ImportCSV.py')
+export_script = os.path.join(__location__, '..', 'ExportCSV', 'ExportCSV.py')
+testdata = os.path.join(__location__, '..', 'testdata')
+
+#Networks whose import is meant to fail, with the error it should give
+expected_errors = {'short_timeseries': 'nodes.csv at line 5'}
+
+
+def find_networks():
+    """
+        The folders in testdata with an import_data.sh.
+    """
+    folders = []
+    for folder, dirs, files in os.walk(testdata):
+        dirs.sort()
+        if 'import_data.sh' in files:
+            folders.append(folder)
+    return folders
+
+
+def get_import_args(folder):
+    """
+        The arguments given to ImportCSV.py in a folder's import_data.sh.
+    """
+    with open(os.path.join(folder, 'import_data.sh')) as script:
+        for line in script:
+            args = shlex.split(line, comments=True)
+            for i, arg in enumerate(args):
+                if arg.endswith('ImportCSV.py'):
+                    return args[i+1:]
+    raise ValueError("ImportCSV.py is not run in %s"%(os.path.join(folder, 'import_data.sh'),))
+
+
+def run_plugin(python, script, args, folder):
+    """
+        Run a plug-in and read the result it writes at the end of its
+        output. Returns the result as an element, or None and the output
+        if the plug-in wrote no result.
+    """
+    proc = subprocess.Popen([python, script] + args,
+                            cwd=folder,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    out, err = proc.communicate()
+    start = out.find('<plugin_result>')
+    if start < 0:
+        return None, out + err
+    return ET.fromstring(out[start:]), out + err
+
+
+def get_errors(result):
+    return [e.text.strip() for e in result.iter('error') if e.text and e.text.strip()]
+
+
+def check_network(folder, args, state_file, output_folder):
+    """
+        Import and export the network in a folder. Returns a list of
+        problems, which is empty if both succeeded or the import failed as
+        expected.
+    """
+    import_args = get_import_args(folder)
+    result, output = run_plugin(args.import_python,
+                                import_script,
+                                import_args + ['--fake-server', state_file],
+                                folder)
+    if result is None:
+        return ["Import failed:\n%s"%(output[-2000:],)]
+    errors = get_errors(result)
+
+    expected = expected_errors.get(os.path.relpath(folder, testdata).replace(os.sep, '/'))
+    if expected is not None:
+        if any(expected in e for e in errors):
+            return []
+        return ["Import did not fail with '%s'"%(expected,)] + errors
+
+    #The folders without a template are not given one
+    if '-m' not in import_args:
+        errors = [e for e in errors if 'No template specified' not in e]
+    network_id = result.findtext('network_id')
+    if errors or not network_id:
+        return ["Import: %s"%(result.findtext('message'),)] + errors
+
+    if args.no_export:
+        return []
+
+    result, output = run_plugin(args.export_python,
+                                export_script,
+                                ['-t', network_id,
+                                 '-o', output_folder,
+                                 '--fake-server', state_file],
+                                folder)
+    if result is None:
+        return ["Export failed:\n%s"%(output[-2000:],)]
+    errors = get_errors(result)
+    if errors:
+        return ["Export: %s"%(result.findtext('message'),)] + errors
+    return []
+
+
+def main():
+    parser = ap.ArgumentParser(description="Import and export the test networks")
+    parser.add_argument('folders', nargs='*',
+                        help="Network folders to check. Defaults to every folder in testdata with an import_data.sh")
+    parser.add_argument('--import-python', default=sys.executable,
+                        help="The python to run ImportCSV with")
+    parser.add_argument('--export-python', default=sys.executable,
+                        help="The python to run ExportCSV with")
+    parser.add_argument('--no-export', action='store_true',
+                        help="Only import the networks")
+    args = parser.parse_args()
+
+    folders = [os.path.abspath(f) for f in args.folders] or find_networks()
+
+    failed = 0
+    for folder in folders:
+        work = tempfile.mkdtemp(prefix='hydra-csv-check-')
+        try:
+            problems = check_network(folder,
+                                     args,
+                                     os.path.join(work, 'server.json'),
+                                     os.path.join(work, 'export'))
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+
+        print("%-6s %s"%("FAIL" if problems else "OK", os.path.relpath(folder, testdata)))
+        for problem in problems:
+            print("       %s"%(problem,))
+        if problems:
+            failed += 1
+
+    print("%s of %s networks failed"%(failed, len(folders)))
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
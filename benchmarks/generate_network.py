@@ -0,0 +1,240 @@
+# (c) Copyright 2013, 2014,2015 University of Manchester
+#
+# ImportCSV is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImportCSV is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with ImportCSV.  If not, see <http://www.gnu.org/licenses/>
+#
+
+"""
+    Write a synthetic network in the CSV format read by ImportCSV: a network
+    file, node, link and group files, a group member file and the timeseries
+    and array files referred to from them.
+
+    Usage: python generate_network.py DIR [-n NODES] [-d LINK_DENSITY]
+                                          [-a ATTRIBUTES] [-t TIMESTEPS]
+                                          [-s ARRAY_SHAPE] [-f FILE_FRACTION]
+"""
+
+import argparse as ap
+import os
+import random
+from datetime import datetime, timedelta
+
+NODE_TYPES  = ['reservoir', 'junction', 'demand']
+LINK_TYPES  = ['river', 'canal']
+GROUP_TYPES = ['zone']
+NETWORK_TYPE = 'benchmark'
+
+#The units of the attributes, in turn. They must be known to the fake
+#server, see DEFAULT_DIMENSIONS in fake_connection.py
+UNITS = ['m^3', 'm^3 s^-1', 'm', 'USD']
+
+#Resources per group
+GROUP_SIZE = 50
+
+
+class ValueWriter(object):
+    """
+        Produces the value of each attribute cell. A fraction of the cells
+        refer to a timeseries or array file, one file per attribute and kind
+        of resource, and the rest are scalars.
+    """
+    def __init__(self, path, rng, timesteps, array_shape, file_fraction):
+        self.path          = path
+        self.rng           = rng
+        self.times         = [(datetime(2000, 1, 1) + timedelta(days=i)).strftime('%Y-%m-%d %H:%M')
+                              for i in range(timesteps)]
+        self.array_shape   = array_shape
+        self.array_size    = 1
+        for dim in array_shape:
+            self.array_size *= dim
+        self.file_fraction = file_fraction
+        self.files         = {}
+        self.num_values    = dict(scalar=0, timeseries=0, array=0)
+
+    def get_file(self, name):
+        f = self.files.get(name)
+        if f is None:
+            f = open(os.path.join(self.path, name), 'w')
+            self.files[name] = f
+        return f
+
+    def value(self, kind, resource_name, attr_name):
+        if self.rng.random() >= self.file_fraction:
+            self.num_values['scalar'] += 1
+            return "%.3f"%(self.rng.random() * 1000,)
+
+        if self.rng.random() < 0.5:
+            self.num_values['timeseries'] += 1
+            name = "ts_%s_%s.csv"%(kind, attr_name)
+            f = self.get_file(name)
+            for t in self.times:
+                f.write("%s,%s,,%.3f\n"%(resource_name, t, self.rng.random() * 100))
+        else:
+            self.num_values['array'] += 1
+            name = "array_%s_%s.csv"%(kind, attr_name)
+            f = self.get_file(name)
+            f.write("%s,%s,%s\n"%(resource_name,
+                                  " ".join([str(d) for d in self.array_shape]),
+                                  ",".join(["%.2f"%(self.rng.random(),)
+                                            for i in range(self.array_size)])))
+        return name
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+
+def write_table(path, headings, units, rows):
+    with open(path, 'w') as f:
+        f.write(",".join(headings) + "\n")
+        f.write(",".join(units) + "\n")
+        for row in rows:
+            f.write(",".join(row) + "\n")
+
+
+def generate_network(path,
+                     nodes=1000,
+                     link_density=1.5,
+                     attributes=5,
+                     timesteps=365,
+                     array_shape=(3, 4),
+                     file_fraction=0.2,
+                     seed=0):
+    """
+        Write a network of the given size to the directory 'path'.
+        link_density is the number of links per node and file_fraction the
+        fraction of attribute values which are timeseries or arrays kept in
+        separate files, half of each. Returns the path of the network file
+        and the number of each kind of resource and value written.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    rng = random.Random(seed)
+    values = ValueWriter(path, rng, timesteps, array_shape, file_fraction)
+
+    attr_names = ["attr%s"%(i,) for i in range(attributes)]
+    attr_units = [UNITS[i % len(UNITS)] for i in range(attributes)]
+
+    node_names = ["node%s"%(i,) for i in range(nodes)]
+    rows = []
+    for i, name in enumerate(node_names):
+        rows.append([name,
+                     str(i % 1000),
+                     str(i // 1000),
+                     NODE_TYPES[i % len(NODE_TYPES)]] +
+                    [values.value('node', name, a) for a in attr_names] +
+                    ["Node %s"%(i,)])
+    write_table(os.path.join(path, 'nodes.csv'),
+                ['Name', 'X', 'Y', 'Type'] + attr_names + ['Description'],
+                ['Units', '', '', ''] + attr_units + [''],
+                rows)
+
+    num_links = int(nodes * link_density) if nodes > 1 else 0
+    rows = []
+    for i in range(num_links):
+        #Every node is linked to the next one, further links are random.
+        if i < nodes - 1:
+            node_1, node_2 = i, i + 1
+        else:
+            node_1, node_2 = rng.sample(range(nodes), 2)
+        name = "link%s"%(i,)
+        rows.append([name,
+                     node_names[node_1],
+                     node_names[node_2],
+                     LINK_TYPES[i % len(LINK_TYPES)]] +
+                    [values.value('link', name, a) for a in attr_names] +
+                    ["Link %s"%(i,)])
+    write_table(os.path.join(path, 'links.csv'),
+                ['Name', 'From', 'To', 'Type'] + attr_names + ['Description'],
+                ['Units', '', '', ''] + attr_units + [''],
+                rows)
+
+    num_groups = max(1, nodes // GROUP_SIZE)
+    rows = []
+    members = []
+    for i in range(num_groups):
+        name = "group%s"%(i,)
+        rows.append([name,
+                     GROUP_TYPES[i % len(GROUP_TYPES)],
+                     'group_members.csv'] +
+                    [values.value('group', name, a) for a in attr_names] +
+                    ["Group %s"%(i,)])
+        for node_name in node_names[i * GROUP_SIZE:(i + 1) * GROUP_SIZE]:
+            members.append([name, 'Node', node_name])
+    write_table(os.path.join(path, 'groups.csv'),
+                ['Name', 'Type', 'Members'] + attr_names + ['Description'],
+                ['Units', '', ''] + attr_units + [''],
+                rows)
+
+    with open(os.path.join(path, 'group_members.csv'), 'w') as f:
+        f.write("Name,Type,Member\n")
+        for row in members:
+            f.write(",".join(row) + "\n")
+
+    network_file = os.path.join(path, 'network.csv')
+    write_table(network_file,
+                ['ID', 'Name', 'Type', 'nodes', 'links', 'groups', 'rules'] + attr_names + ['Description'],
+                ['Units', '', '', '', '', '', ''] + attr_units + [''],
+                [['', 'benchmark', NETWORK_TYPE, 'nodes.csv', 'links.csv', 'groups.csv', ''] +
+                 [values.value('network', 'benchmark', a) for a in attr_names] +
+                 ['Synthetic benchmark network']])
+
+    values.close()
+
+    counts = dict(nodes=nodes, links=num_links, groups=num_groups, group_members=len(members))
+    counts.update(values.num_values)
+    return network_file, counts
+
+
+def parse_shape(shape):
+    return tuple([int(d) for d in shape.lower().split('x')])
+
+
+def get_parser():
+    parser = ap.ArgumentParser(description="Synthetic network generator", add_help=False)
+    parser.add_argument('-n', '--nodes', type=int, default=1000,
+                        help="Number of nodes")
+    parser.add_argument('-d', '--link-density', type=float, default=1.5,
+                        help="Number of links per node")
+    parser.add_argument('-a', '--attributes', type=int, default=5,
+                        help="Number of attributes of each resource")
+    parser.add_argument('-t', '--timesteps', type=int, default=365,
+                        help="Length of each timeseries (daily)")
+    parser.add_argument('-s', '--array-shape', type=parse_shape, default=(3, 4),
+                        help="Shape of each array, e.g. 3x4")
+    parser.add_argument('-f', '--file-fraction', type=float, default=0.2,
+                        help="Fraction of values which are timeseries or "
+                             "arrays in separate files")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed of the random values")
+    return parser
+
+
+def main():
+    parser = ap.ArgumentParser(parents=[get_parser()])
+    parser.add_argument('path', help="Directory to write the network to")
+    args = parser.parse_args()
+
+    network_file, counts = generate_network(args.path,
+                                            nodes=args.nodes,
+                                            link_density=args.link_density,
+                                            attributes=args.attributes,
+                                            timesteps=args.timesteps,
+                                            array_shape=args.array_shape,
+                                            file_fraction=args.file_fraction,
+                                            seed=args.seed)
+    print("Written %s: %s" % (network_file, counts))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+# (c) Copyright 2013, 2014,2015 University of Manchester
+#
+# ImportCSV is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ImportCSV is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with ImportCSV.  If not, see <http://www.gnu.org/licenses/>
+#
+
+"""
+    Time each stage of an import of a synthetic network (see
+    generate_network.py) into a fake Hydra server (see fake_connection.py),
+    and save the timings as JSON so that they can be compared across commits.
+
+    Usage: python run_benchmarks.py [generator options] [-r REPEAT]
+                                    [-o OUTPUT] [--compare RESULTS]
+                                    [-w WORKERS] [--io-threads THREADS]
+                                    [--batch-size SIZE] [--cache-dir DIR]
+                                    [--fake-latency SECONDS]
+                                    [--fake-bandwidth MB_PER_S]
+
+    With --compare, the time of each stage is shown next to the same stage
+    in an earlier results file.
+"""
+
+import argparse as ap
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ImportCSV'))
+
+import ImportCSV as importcsv
+from prefetch import FilePrefetcher
+from fake_connection import FakeConnection
+from profiling import Profiler
+
+from generate_network import generate_network, get_parser
+
+
+def run_import(network_file, options):
+    """
+        Import a network into a fake server in the same stages as
+        ImportCSV.run, timing each one. Returns a list of (stage, seconds)
+        and the number of values the server holds afterwards.
+    """
+    profiler = Profiler()
+    bandwidth = None
+    if options.fake_bandwidth:
+        bandwidth = options.fake_bandwidth*1024*1024
+    connection = FakeConnection(latency=options.fake_latency, bandwidth=bandwidth)
+
+    with profiler.stage('connect'):
+        csv = importcsv.ImportCSV(connection=connection)
+    csv.profiler = profiler
+    csv.expand_filenames = True
+    csv.batch_size = options.batch_size
+    csv.template_id = 1
+
+    try:
+        with profiler.stage('create_project'):
+            csv.create_project()
+        with profiler.stage('create_scenario'):
+            csv.create_scenario()
+        if options.cache_dir is not None:
+            csv.set_cache(options.cache_dir)
+        if options.io_threads > 0:
+            csv.prefetcher = FilePrefetcher(options.io_threads)
+
+        with profiler.stage('read_network'):
+            csv.create_network(network_file)
+
+        if options.workers > 1:
+            csv.schedule_files(options.workers)
+        elif csv.prefetcher is not None:
+            csv.prefetch_files()
+
+        for stage, read, files in (('read_nodes', csv.read_nodes, csv.node_args),
+                                   ('read_links', csv.read_links, csv.link_args),
+                                   ('read_groups', csv.read_groups, csv.group_args)):
+            with profiler.stage(stage):
+                for f in files:
+                    read(f)
+
+        if csv.scheduler is not None:
+            csv.scheduler.shutdown()
+        if csv.prefetcher is not None:
+            csv.prefetcher.shutdown()
+
+        with profiler.stage('read_group_members'):
+            for f in csv.groupmember_args:
+                csv.read_group_members(f)
+        with profiler.stage('commit'):
+            csv.commit()
+        with profiler.stage('set_resource_types'):
+            csv.set_resource_types()
+    finally:
+        if csv.scheduler is not None:
+            csv.scheduler.shutdown()
+        if csv.prefetcher is not None:
+            csv.prefetcher.shutdown()
+
+    num_values = sum(len(scenario.get('resourcescenarios') or [])
+                     for network in connection.state['networks'].values()
+                     for scenario in network['scenarios'])
+    stages = [(stage.name, stage.wall) for stage in profiler.get_totals().values()]
+    return stages, num_values
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.STDOUT).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous):
+    """
+        Print the best time of each stage next to the best
+        time of the same stage in an earlier set of results.
+    """
+    print("%-20s %10s %10s %8s" % ("stage", "previous", "now", "ratio"))
+    for stage, seconds in results['best'].items():
+        before = previous['best'].get(stage)
+        if before is None:
+            print("%-20s %10s %10.3f" % (stage, "-", seconds))
+        else:
+            print("%-20s %10.3f %10.3f %7.2fx" %
+                  (stage, before, seconds, seconds / before if before > 0 else float('nan')))
+
+
+def main():
+    parser = ap.ArgumentParser(description="ImportCSV benchmark suite", parents=[get_parser()])
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help="Number of times to import the network")
+    parser.add_argument('-o', '--output',
+                        help="File to save the results to. Defaults to "
+                             "results/<commit>-<time>.json next to this script")
+    parser.add_argument('--compare',
+                        help="An earlier results file to compare against")
+    parser.add_argument('--network-dir',
+                        help="Write the network here and keep it, "
+                             "rather than in a temporary directory")
+    parser.add_argument('-w', '--workers', type=int, default=1)
+    parser.add_argument('--io-threads', type=int, default=4)
+    parser.add_argument('--batch-size', type=int)
+    parser.add_argument('--cache-dir')
+    parser.add_argument('--fake-latency', type=float, default=0.0,
+                        help="Seconds taken by every call to the server")
+    parser.add_argument('--fake-bandwidth', type=float,
+                        help="MB/s at which requests and responses are sent")
+    args = parser.parse_args()
+
+    path = args.network_dir or tempfile.mkdtemp(prefix='hydra-csv-benchmark-')
+    try:
+        x = time.time()
+        network_file, counts = generate_network(path,
+                                                nodes=args.nodes,
+                                                link_density=args.link_density,
+                                                attributes=args.attributes,
+                                                timesteps=args.timesteps,
+                                                array_shape=args.array_shape,
+                                                file_fraction=args.file_fraction,
+                                                seed=args.seed)
+        print("Generated %s in %.2fs: %s" % (network_file, time.time() - x, counts))
+
+        runs = []
+        for i in range(args.repeat):
+            stages, num_values = run_import(network_file, args)
+            total = sum(seconds for _, seconds in stages)
+            print("Run %s: %.3fs, %s values (%s)" %
+                  (i + 1, total, num_values,
+                   ", ".join(["%s %.3fs" % (stage, seconds) for stage, seconds in stages])))
+            runs.append(dict(stages=dict(stages), total=total, values=num_values))
+    finally:
+        if args.network_dir is None:
+            shutil.rmtree(path, ignore_errors=True)
+
+    best = dict((stage, min(run['stages'][stage] for run in runs))
+                for stage in runs[0]['stages'])
+    best['total'] = min(run['total'] for run in runs)
+
+    commit = get_commit()
+    results = dict(
+        commit     = commit,
+        date       = datetime.now().isoformat(),
+        python     = platform.python_version(),
+        platform   = platform.platform(),
+        parameters = dict(nodes=args.nodes,
+                          link_density=args.link_density,
+                          attributes=args.attributes,
+                          timesteps=args.timesteps,
+                          array_shape=list(args.array_shape),
+                          file_fraction=args.file_fraction,
+                          seed=args.seed),
+        options    = dict(workers=args.workers,
+                          io_threads=args.io_threads,
+                          batch_size=args.batch_size,
+                          cache=args.cache_dir is not None,
+                          fake_latency=args.fake_latency,
+                          fake_bandwidth=args.fake_bandwidth),
+        counts     = counts,
+        runs       = runs,
+        best       = best,
+    )
+
+    output = args.output
+    if output is None:
+        results_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+        if not os.path.isdir(results_dir):
+            os.makedirs(results_dir)
+        output = os.path.join(results_dir, "%s-%s.json" %
+                              (commit or 'unknown', datetime.now().strftime('%Y%m%d%H%M%S')))
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print("Results saved to %s" % (output,))
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == '__main__':
+    main()
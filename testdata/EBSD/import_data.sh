@@ -1,3 +1,3 @@
 #!/bin/bash
 #python -m cProfile -o import_profile ../../ImportCSV/ImportCSV.py -t EBSD_network.csv -n WRZ_nodes.csv -l WRZ_links.csv -x -m ebsd_template.xml
-python ../../ImportCSV/ImportCSV.py -t EBSD_network.csv -n EBSD_nodes.csv -l EBSD_links.csv -g EBSD_groups.csv -k EBSD_group_members.csv -x -m ebsd_template.xml
+python ../../ImportCSV/ImportCSV.py -t EBSD_network.csv -x -m ebsd_template.xml
@@ -0,0 +1,3 @@
+#!/bin/bash
+#n1 and n2 import. n3 is reported as an error of its own.
+python ../../ImportCSV/ImportCSV.py -t network.csv -x